@@ -0,0 +1,324 @@
+# Star Pusher asyncio game loop
+# Plays the game with asyncio tasks instead of runLevel()'s polling loop.
+# The input sources are coroutines that all put actions on one queue:
+#   keyboard  the same keys as runLevel() (arrows, W, X, SPACE, N, B,
+#             BACKSPACE, ESC, H, F3 and the camera keys)
+#   replay    the actions in a file: action names separated by spaces or
+#             new lines (';' starts a comment), or a save file's action log
+#   bot       plays the solver's solutions, one level after the other
+#   socket    lines of actions from local TCP connections; after each line
+#             the game state is sent back as a line of JSON, so a test
+#             harness can drive the game and check where everything is
+# The game task applies the actions with the game's rules, and the render
+# task draws a frame FPS times a second whatever the inputs are doing, so
+# the window stays responsive while a bot makes thousands of moves.
+#
+# Usage:
+#   python asyncgame.py [--level N] [--replay FILE] [--bot] [--socket PORT]
+#                       [--delay SECONDS] [--levels N] [--headless] [--no-render] [--gpu]
+# The keyboard is used too unless --headless or --no-render is given.
+# Actions that aren't moves: 'next', 'back', 'reset' and 'quit'.
+
+import argparse, asyncio, copy, json, os, sys, time
+
+import gameloader, frameprofiler, hintengine, savegame, starsolver
+
+game = gameloader.loadGame()
+pygame = game.pygame
+
+COMMANDS = ('next', 'back', 'reset', 'quit')
+KEYBOARD_POLL = 1.0 / (game.FPS * 2) # seconds between two looks at the SDL event queue
+BOT_WEIGHT = 2.0 # heuristic weight of the bot's solver
+BOT_MAX_STATES = 500000
+
+KEYACTIONS = {pygame.K_UP: 'up', pygame.K_LEFT: 'left', pygame.K_DOWN: 'down', pygame.K_RIGHT: 'right',
+              pygame.K_w: 'turnleft', pygame.K_x: 'turnright', pygame.K_SPACE: 'grab',
+              pygame.K_n: 'next', pygame.K_b: 'back', pygame.K_BACKSPACE: 'reset', pygame.K_ESCAPE: 'quit'}
+CAMERAKEYS = {pygame.K_z: 'cameraUp', pygame.K_s: 'cameraDown', pygame.K_q: 'cameraLeft', pygame.K_d: 'cameraRight'}
+
+
+def makeRun(levels, render=True):
+    """Returns a run object: the state of the game shared by the tasks."""
+    return {'levels': levels,
+            'levelNum': None,
+            'levelObj': None,
+            'mapObj': None,
+            'gameStateObj': None,
+            'levelIsComplete': False,
+            'viewObj': None, # None when nothing is drawn
+            'render': render,
+            'hintObj': None,
+            'showHint': False,
+            'cameraUp': False, 'cameraDown': False, 'cameraLeft': False, 'cameraRight': False,
+            'quitEvent': asyncio.Event(),
+            'actionsDone': 0, # actions that changed the game state
+            'levelsSolved': 0}
+
+
+def startLevel(runObj, levelNum):
+    """Starts levels[levelNum] from its start; going past the last level
+    goes back to the first one and the other way around, like main()."""
+    if runObj['hintObj'] is not None:
+        hintengine.stopHintEngine(runObj['hintObj'])
+    levels = runObj['levels']
+    levelNum = levelNum % len(levels)
+    runObj['levelNum'] = levelNum
+    runObj['levelObj'] = levels[levelNum]
+    # Only the walls matter to the rules, the decoration is for drawing.
+    runObj['mapObj'] = game.getDecoratedMap(levels[levelNum]) if runObj['render'] else levels[levelNum]['mapObj']
+    runObj['gameStateObj'] = copy.deepcopy(levels[levelNum]['startState'])
+    runObj['levelIsComplete'] = False
+    runObj['hintObj'] = hintengine.makeHintEngine(levels[levelNum])
+    if runObj['render']:
+        runObj['viewObj'] = game.makeLevelView(levels, levelNum, runObj['mapObj'], runObj['gameStateObj'])
+
+
+def doAction(runObj, action):
+    """Does one action (from savegame.ACTIONS or COMMANDS) like runLevel()
+    does when its key is pressed."""
+    if action == 'quit':
+        runObj['quitEvent'].set()
+    elif action == 'next':
+        startLevel(runObj, runObj['levelNum'] + 1)
+    elif action == 'back':
+        startLevel(runObj, runObj['levelNum'] - 1)
+    elif action == 'reset':
+        startLevel(runObj, runObj['levelNum'])
+    elif runObj['levelIsComplete']:
+        # Any other key goes to the next level once the level is solved.
+        startLevel(runObj, runObj['levelNum'] + 1)
+    elif starsolver.applyAction(runObj['mapObj'], runObj['gameStateObj'], action):
+        runObj['actionsDone'] += 1
+        if runObj['viewObj'] is not None:
+            game.updateLevelView(runObj['viewObj'], runObj['gameStateObj'])
+        if game.isLevelFinished(runObj['levelObj'], runObj['gameStateObj']):
+            runObj['levelIsComplete'] = True
+            runObj['levelsSolved'] += 1
+
+
+def parseActions(text):
+    """Returns the list of actions in text (names separated by white
+    space, ';' starts a comment that goes to the end of the line).
+    Raises ValueError for an unknown name."""
+    actions = []
+    for line in text.splitlines():
+        for word in line.split(';')[0].split():
+            if word not in savegame.ACTIONS and word not in COMMANDS:
+                raise ValueError('Unknown action: %r' % word)
+            actions.append(word)
+    return actions
+
+
+def getStateSummary(runObj):
+    """Returns the state of the game as a dict that can be sent as JSON."""
+    gameStateObj = runObj['gameStateObj']
+    return {'level': runObj['levelNum'] + 1,
+            'player': list(gameStateObj['player']),
+            'direction': gameStateObj['playerdirection'],
+            'stars': sorted([list(star) for star in gameStateObj['stars']]),
+            'grab': list(gameStateObj['grabstar'][0]) if gameStateObj['grabstar'] else None,
+            'steps': gameStateObj['stepCounter'],
+            'solved': runObj['levelIsComplete'],
+            'quit': runObj['quitEvent'].is_set()}
+
+
+async def gameTask(queue, runObj):
+    """Applies the actions from the queue, one at a time."""
+    while True:
+        action = await queue.get()
+        try:
+            doAction(runObj, action)
+        finally:
+            queue.task_done()
+
+
+async def renderTask(runObj):
+    """Draws a frame FPS times a second."""
+    frameTime = 1.0 / game.FPS
+    while not runObj['quitEvent'].is_set():
+        startTime = time.perf_counter()
+        frameprofiler.startFrame()
+        viewObj = runObj['viewObj']
+        game.moveCamera(viewObj, runObj['cameraUp'], runObj['cameraDown'], runObj['cameraLeft'], runObj['cameraRight'])
+        dirtyRects = game.drawLevelView(viewObj, runObj['gameStateObj'], runObj['levelIsComplete'],
+                                        runObj['hintObj'] if runObj['showHint'] else None)
+        game.updateDisplay(dirtyRects)
+        frameprofiler.mark('update')
+        await asyncio.sleep(max(0.0, frameTime - (time.perf_counter() - startTime)))
+        frameprofiler.mark('wait')
+        frameprofiler.endFrame()
+
+
+async def keyboardInput(queue, runObj):
+    """Input source: the keyboard (and the window's close button). The
+    hint, profiler and camera keys only change what is drawn, so they
+    don't go through the queue."""
+    while True:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                await queue.put('quit')
+            elif event.type == pygame.KEYDOWN:
+                if event.key in KEYACTIONS:
+                    await queue.put(KEYACTIONS[event.key])
+                elif event.key in CAMERAKEYS:
+                    runObj[CAMERAKEYS[event.key]] = True
+                elif event.key == pygame.K_h:
+                    runObj['showHint'] = not runObj['showHint']
+                elif event.key == pygame.K_F3:
+                    game.showProfiler = not game.showProfiler
+                elif runObj['levelIsComplete']:
+                    await queue.put('next') # any key, like runLevel()
+            elif event.type == pygame.KEYUP and event.key in CAMERAKEYS:
+                runObj[CAMERAKEYS[event.key]] = False
+        await asyncio.sleep(KEYBOARD_POLL)
+
+
+def readReplay(filename):
+    """Returns the list of actions in the replay file, which is either a
+    text file for parseActions() or a save file (its action log)."""
+    with open(filename, 'rb') as replayFile:
+        data = replayFile.read()
+    if data.startswith(savegame.MAGIC):
+        return savegame.unpackSession(data)['moveLog']
+    return parseActions(data.decode('utf-8'))
+
+
+async def replayInput(queue, runObj, filename, delay=0.0):
+    """Input source: the actions in the replay file, one every delay
+    seconds."""
+    for action in readReplay(filename):
+        await queue.put(action)
+        await asyncio.sleep(delay)
+    await queue.join()
+
+
+async def botInput(queue, runObj, numLevels, delay=0.0):
+    """Input source: solves the level being played with the solver (on
+    another thread, so the other tasks keep running) and plays the
+    solution, until numLevels levels are solved."""
+    loop = asyncio.get_running_loop()
+    while runObj['levelsSolved'] < numLevels and not runObj['quitEvent'].is_set():
+        await queue.join() # wait until the game state is up to date
+        if runObj['levelIsComplete']:
+            await queue.put('next')
+            continue
+        rules = starsolver.makeRules(runObj['levelObj'])
+        state = starsolver.fromGameState(runObj['gameStateObj'])
+        levelNum = runObj['levelNum']
+        result = await loop.run_in_executor(None, starsolver.search, rules, state, BOT_WEIGHT, BOT_MAX_STATES)
+        if runObj['levelNum'] != levelNum or starsolver.fromGameState(runObj['gameStateObj']) != state:
+            continue # another input changed the game meanwhile
+        if result['solution'] is None:
+            print('The bot can\'t solve level %s' % (levelNum + 1), file=sys.stderr)
+            await queue.put('next')
+            continue
+        for action in result['solution']:
+            await queue.put(action)
+            await asyncio.sleep(delay)
+    await queue.join()
+
+
+async def socketInput(queue, runObj, port, host='127.0.0.1'):
+    """Input source: a TCP server on host:port (port 0 picks a free one).
+    Each line a client sends is a list of actions for parseActions(); once
+    they are done the game state is sent back as a line of JSON (or
+    {"error": ...} if the line can't be parsed)."""
+    async def handleClient(reader, writer):
+        while not runObj['quitEvent'].is_set():
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                actions = parseActions(line.decode('utf-8'))
+            except (ValueError, UnicodeDecodeError) as error:
+                writer.write((json.dumps({'error': str(error)}) + '\n').encode('utf-8'))
+                await writer.drain()
+                continue
+            for action in actions:
+                await queue.put(action)
+            await queue.join()
+            writer.write((json.dumps(getStateSummary(runObj)) + '\n').encode('utf-8'))
+            await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handleClient, host, port)
+    print('Listening on %s:%s' % server.sockets[0].getsockname()[:2], file=sys.stderr)
+    async with server:
+        await runObj['quitEvent'].wait()
+
+
+async def playAsync(levels, levelNum, inputs, render=True):
+    """Plays levels starting with levels[levelNum]. inputs is a list of
+    functions that take (queue, runObj) and return an input source
+    coroutine. Returns the run object once an input sends 'quit' or all
+    the inputs have finished."""
+    runObj = makeRun(levels, render)
+    startLevel(runObj, levelNum)
+    queue = asyncio.Queue()
+    tasks = [asyncio.create_task(gameTask(queue, runObj))]
+    if render:
+        tasks.append(asyncio.create_task(renderTask(runObj)))
+    inputTasks = set(asyncio.create_task(makeInput(queue, runObj)) for makeInput in inputs)
+    quitTask = asyncio.create_task(runObj['quitEvent'].wait())
+    try:
+        while inputTasks and not runObj['quitEvent'].is_set():
+            # The game and render tasks only stop if they fail.
+            done, pending = await asyncio.wait(inputTasks | set(tasks + [quitTask]), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result() # raises the task's exception, if it failed
+            inputTasks -= done
+        await queue.join()
+    finally:
+        for task in tasks + list(inputTasks) + [quitTask]:
+            task.cancel()
+        hintengine.stopHintEngine(runObj['hintObj'])
+    return runObj
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Plays Star Pusher with an asyncio game loop and several input sources.')
+    parser.add_argument('--level', type=int, default=1, help='level to start with')
+    parser.add_argument('--replay', default=None, help='file of actions (or save file) to play')
+    parser.add_argument('--bot', action='store_true', help='let the solver play')
+    parser.add_argument('--socket', type=int, default=None, help='take actions from TCP connections to this port on 127.0.0.1')
+    parser.add_argument('--delay', type=float, default=None, help='seconds between the replay and bot actions (default: 0.1, or 0 with --headless/--no-render)')
+    parser.add_argument('--levels', type=int, default=None, help='levels the bot plays (default: all of them)')
+    parser.add_argument('--headless', action='store_true', help='draw without a window (no keyboard)')
+    parser.add_argument('--no-render', action='store_true', help="don't draw at all (no keyboard)")
+    parser.add_argument('--gpu', action='store_true', help="draw with SDL2's renderer (see gpurenderer.py)")
+    args = parser.parse_args()
+    if args.replay is not None:
+        args.replay = os.path.abspath(args.replay) # before initHeadless()/initDisplay() go to GAMEDIR
+
+    render = not args.no_render
+    keyboard = render and not args.headless
+    if args.headless:
+        gameloader.initHeadless(gpu=args.gpu)
+    elif render:
+        gameloader.initDisplay(gpu=args.gpu)
+    delay = args.delay if args.delay is not None else (0.1 if keyboard else 0.0)
+    levels = game.readLevelsFile(gameloader.LEVELFILE)
+
+    inputs = []
+    if keyboard:
+        inputs.append(keyboardInput)
+    if args.replay is not None:
+        inputs.append(lambda queue, runObj: replayInput(queue, runObj, args.replay, delay))
+    if args.bot:
+        inputs.append(lambda queue, runObj: botInput(queue, runObj, args.levels or len(levels), delay))
+    if args.socket is not None:
+        inputs.append(lambda queue, runObj: socketInput(queue, runObj, args.socket))
+    if not inputs:
+        parser.error('no input: give --replay, --bot or --socket (or let the keyboard be used)')
+
+    startTime = time.time()
+    runObj = asyncio.run(playAsync(levels, args.level - 1, inputs, render))
+    seconds = time.time() - startTime
+    print('%s actions, %s levels solved in %.2f s (%.0f actions/s)' % (runObj['actionsDone'], runObj['levelsSolved'],
+          seconds, runObj['actionsDone'] / max(seconds, 1e-9)), file=sys.stderr)
+    if render:
+        pygame.quit()
+
+
+if __name__ == '__main__':
+    main()
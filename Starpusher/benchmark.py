@@ -0,0 +1,308 @@
+# Star Pusher benchmark suite
+# Times the level parser, the rules, the map decoration and the drawing
+# code (with Surface objects and with the GPU renderer), and compares the
+# results with a stored baseline.
+#
+# Usage:
+#   python benchmark.py                     run and compare with the baseline
+#   python benchmark.py --save-baseline     run and store the results as the new baseline
+#   python benchmark.py --quick             smaller workloads, for a fast check
+#
+# It runs without a display or sound card (SDL's "dummy" drivers are used).
+# The exit code is 1 if a benchmark got slower than the baseline by more
+# than the tolerance, so it can be used before a release.
+#
+# No baseline comes with the game: the timings depend on the machine, so
+# each machine makes its own with --save-baseline (on the release it is
+# compared against). Until then the results are only printed and written,
+# and the comparison is skipped.
+
+import argparse, copy, json, os, platform, random, sys, tempfile, time
+
+import gameloader
+
+BENCHMARK_VERSION = 1
+DEFAULT_RESULTS = 'benchmark_results.json'
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+DEFAULT_TOLERANCE = 0.20 # 20% slower than the baseline is a regression
+
+
+def timeIt(function, repeat):
+    """Calls function() repeat times and returns the fastest time, in
+    seconds. The fastest run is the one least disturbed by the rest of
+    the machine."""
+    best = None
+    for i in range(repeat):
+        startTime = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - startTime
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def makeRandomLevelText(rand, width, height, numStars):
+    """Returns the text of a random rectangular level, in the format of
+    starPusherLevels.txt, with a door and a button."""
+    rows = [['#'] * width]
+    for y in range(height - 2):
+        rows.append(['#'] + [' '] * (width - 2) + ['#'])
+    rows.append(['#'] * width)
+
+    freeSpaces = [(x, y) for x in range(1, width - 1) for y in range(1, height - 1)]
+    rand.shuffle(freeSpaces)
+    x, y = freeSpaces.pop()
+    rows[y][x] = '@'
+    for i in range(numStars):
+        x, y = freeSpaces.pop()
+        rows[y][x] = '$'
+        x, y = freeSpaces.pop()
+        rows[y][x] = '.'
+    x, y = freeSpaces.pop()
+    rows[y][x] = 'd'
+    x, y = freeSpaces.pop()
+    rows[y][x] = 'b'
+    return '\n'.join(''.join(row) for row in rows)
+
+
+def makeBigMap(size):
+    """Returns a size x size map object: a wall border, a few inner walls,
+    and the player at (1, 1)."""
+    mapObj = []
+    for x in range(size):
+        column = []
+        for y in range(size):
+            if x in (0, size - 1) or y in (0, size - 1) or (x % 7 == 3 and y % 5 != 0):
+                column.append('#')
+            else:
+                column.append(' ')
+        mapObj.append(column)
+    mapObj[1][1] = '@'
+    return mapObj
+
+
+def benchParse(game, numLevels, repeat):
+    """readLevelsFile() on a synthetic pack of numLevels levels."""
+    rand = random.Random(1)
+    levelTexts = ['; %s\n\n%s\n' % (i + 1, makeRandomLevelText(rand, 10, 8, 3)) for i in range(numLevels)]
+    fd, filename = tempfile.mkstemp(suffix='.txt')
+    try:
+        with os.fdopen(fd, 'w') as packFile:
+            packFile.write('\n'.join(levelTexts))
+        elapsed = timeIt(lambda: game.readLevelsFile(filename), repeat)
+    finally:
+        os.remove(filename)
+    return {'parse levels per second': (numLevels / elapsed, 'levels/s', True)}
+
+
+def benchRules(game, numMoves, repeat):
+    """makeMove(), makeTurn() and makeGrab() on scripted move sequences
+    played on the shipped levels."""
+    levels = game.readLevelsFile(gameloader.LEVELFILE)
+    rand = random.Random(2)
+    moveScript = [rand.choice((0, 1, 2, 3)) for i in range(numMoves)]
+    turnScript = [rand.choice((game.LEFT, game.RIGHT)) for i in range(numMoves)]
+    grabScript = [rand.random() < 0.3 for i in range(numMoves)]
+
+    def playMoves():
+        for levelObj in levels:
+            gameStateObj = copy.deepcopy(levelObj['startState'])
+            for move in moveScript:
+                game.makeMove(levelObj['mapObj'], gameStateObj, move)
+
+    def playTurns():
+        for levelObj in levels:
+            gameStateObj = copy.deepcopy(levelObj['startState'])
+            for i in range(numMoves):
+                game.makeMove(levelObj['mapObj'], gameStateObj, moveScript[i])
+                game.makeTurn(levelObj['mapObj'], gameStateObj, turnScript[i])
+
+    def playGrabs():
+        for levelObj in levels:
+            gameStateObj = copy.deepcopy(levelObj['startState'])
+            for i in range(numMoves):
+                game.makeMove(levelObj['mapObj'], gameStateObj, moveScript[i])
+                if grabScript[i]:
+                    game.makeGrab(levelObj['mapObj'], gameStateObj)
+
+    totalMoves = numMoves * len(levels)
+    return {'makeMove per second': (totalMoves / timeIt(playMoves, repeat), 'moves/s', True),
+            'makeMove+makeTurn per second': (totalMoves / timeIt(playTurns, repeat), 'moves/s', True),
+            'makeMove+makeGrab per second': (totalMoves / timeIt(playGrabs, repeat), 'moves/s', True)}
+
+
+def benchDecorate(game, mapSize, repeat):
+    """decorateMap() and floodFill() on a big map."""
+    mapObj = makeBigMap(mapSize)
+
+    def fill():
+        mapObjCopy = copy.deepcopy(mapObj)
+        mapObjCopy[1][1] = ' '
+        game.floodFill(mapObjCopy, 1, 1, ' ', 'o')
+
+    # The deep copy is part of fill() so take it out of the result.
+    copyTime = timeIt(lambda: copy.deepcopy(mapObj), repeat)
+    return {'decorateMap %sx%s' % (mapSize, mapSize): (timeIt(lambda: game.decorateMap(mapObj, (1, 1)), repeat) * 1000, 'ms', False),
+            'floodFill %sx%s' % (mapSize, mapSize): (max(0.0, timeIt(fill, repeat) - copyTime) * 1000, 'ms', False)}
+
+
+def benchDraw(game, mapSize, repeat):
+    """drawMap() and the chunked drawing used by runLevel() on an
+    offscreen display."""
+    levels = game.readLevelsFile(gameloader.LEVELFILE)
+    levelObj = levels[-1]
+    mapObj = game.decorateMap(levelObj['mapObj'], levelObj['startState']['player'])
+    gameStateObj = copy.deepcopy(levelObj['startState'])
+    results = {'drawMap last level': (timeIt(lambda: game.drawMap(mapObj, gameStateObj, levelObj['goals']), repeat) * 1000, 'ms', False)}
+
+    bigMap = game.decorateMap(makeBigMap(mapSize), (1, 1))
+    bigState = {'player': (1, 1), 'stepCounter': 0, 'stars': [(2, 1)], 'playerdirection': 2,
+                'grabstar': [], 'doors': [], 'buttons': [], 'grabstaroffset': [(0, 0)],
+                'buttonPressed?': False, 'otherstar': []}
+
+    def drawChunkedFrames():
+        # Pan across the big map like the ZQSD camera does, starting
+        # from an empty chunk cache.
+        chunkCache = game.makeChunkCache(bigMap, [(3, 3)])
+        for step in range(0, 2000, 20):
+            game.DISPLAYSURF.fill(game.BGCOLOR)
+            game.drawMapChunks(chunkCache, bigState, game.DISPLAYSURF, (-step, -step))
+            game.pygame.display.update()
+
+    results['chunked frame %sx%s' % (mapSize, mapSize)] = (timeIt(drawChunkedFrames, repeat) * 1000 / 100, 'ms', False)
+    return results
+
+
+def benchRenderers(game, mapSize, repeat):
+    """Whole level frames (drawLevelView() and updateDisplay()) panning
+    across a big map, drawn with Surface objects and with the GPU
+    renderer, and frames with a still camera where only the steps
+    change (so only the changed parts of the window are drawn). The GPU
+    renderer uses SDL's software renderer here, as there is no graphics
+    card behind the dummy video driver."""
+    bigMap = game.decorateMap(makeBigMap(mapSize), (1, 1))
+    bigState = {'player': (1, 1), 'stepCounter': 0, 'stars': [(2, 1)], 'playerdirection': 2,
+                'grabstar': [], 'doors': [], 'buttons': [], 'grabstaroffset': [(0, 0)],
+                'buttonPressed?': False, 'otherstar': []}
+    levels = [{'goals': [(3, 3)]}]
+
+    def drawFrames():
+        viewObj = game.makeLevelView(levels, 0, bigMap, bigState)
+        for step in range(0, 2000, 20):
+            viewObj['cameraOffsetX'] = viewObj['cameraOffsetY'] = viewObj['maxCamXPan'] - step
+            game.updateDisplay(game.drawLevelView(viewObj, bigState, False))
+
+    def drawStillFrames():
+        viewObj = game.makeLevelView(levels, 0, bigMap, bigState)
+        for step in range(100):
+            bigState['stepCounter'] = step
+            game.updateDisplay(game.drawLevelView(viewObj, bigState, False))
+
+    results = {}
+    oldGpu = game.GPU
+    try:
+        game.GPU = None
+        results['level frame %sx%s software' % (mapSize, mapSize)] = (timeIt(drawFrames, repeat) * 1000 / 100, 'ms', False)
+        results['still frame %sx%s software' % (mapSize, mapSize)] = (timeIt(drawStillFrames, repeat) * 1000 / 100, 'ms', False)
+        game.GPU = game.gpurenderer.makeGpu('Star Pusher benchmark', (game.WINWIDTH, game.WINHEIGHT))
+        if game.GPU is not None:
+            results['level frame %sx%s gpu' % (mapSize, mapSize)] = (timeIt(drawFrames, repeat) * 1000 / 100, 'ms', False)
+    finally:
+        game.GPU = oldGpu
+    return results
+
+
+def runBenchmarks(quick=False):
+    """Runs every benchmark and returns the results dict that is written
+    to the JSON file."""
+    game = gameloader.initHeadless()
+    repeat = 3 if quick else 5
+    benchmarks = {}
+    benchmarks.update(benchParse(game, 1000 if quick else 10000, repeat))
+    benchmarks.update(benchRules(game, 200 if quick else 2000, repeat))
+    benchmarks.update(benchDecorate(game, 100 if quick else 300, repeat))
+    benchmarks.update(benchDraw(game, 100 if quick else 300, repeat))
+    benchmarks.update(benchRenderers(game, 100 if quick else 300, repeat))
+
+    results = {}
+    for name, (value, unit, higherIsBetter) in benchmarks.items():
+        results[name] = {'value': value, 'unit': unit, 'higherIsBetter': higherIsBetter}
+    return {'version': BENCHMARK_VERSION,
+            'quick': quick,
+            'python': platform.python_version(),
+            'pygame': game.pygame.version.ver,
+            'machine': platform.platform(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'results': results}
+
+
+def compareWithBaseline(current, baseline, tolerance):
+    """Returns a list of (name, baselineValue, currentValue, change) for
+    every benchmark, and a list of the names that regressed. change is
+    how much worse (positive) or better (negative) the current run is, as
+    a fraction of the baseline."""
+    comparisons = []
+    regressions = []
+    for name, baseResult in sorted(baseline['results'].items()):
+        if name not in current['results'] or baseResult['value'] == 0:
+            continue
+        value = current['results'][name]['value']
+        change = (value - baseResult['value']) / baseResult['value']
+        if baseResult['higherIsBetter']:
+            change = -change
+        comparisons.append((name, baseResult['value'], value, change))
+        if change > tolerance:
+            regressions.append(name)
+    return comparisons, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Star Pusher performance benchmarks.')
+    parser.add_argument('--output', default=DEFAULT_RESULTS, help='JSON file to write the results to')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='JSON file with the baseline results')
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='allowed slowdown before a benchmark counts as a regression (0.2 = 20%%)')
+    parser.add_argument('--quick', action='store_true', help='use smaller workloads')
+    args = parser.parse_args()
+
+    # The game changes the current directory, so remember the paths now.
+    outputFile = os.path.abspath(args.output)
+    baselineFile = os.path.abspath(args.baseline)
+
+    current = runBenchmarks(args.quick)
+    with open(outputFile, 'w') as resultsFile:
+        json.dump(current, resultsFile, indent=2, sort_keys=True)
+
+    for name, result in sorted(current['results'].items()):
+        print('%-32s %12.2f %s' % (name, result['value'], result['unit']))
+    print('Results written to %s' % (outputFile))
+
+    if args.save_baseline:
+        with open(baselineFile, 'w') as baseFile:
+            json.dump(current, baseFile, indent=2, sort_keys=True)
+        print('Baseline saved to %s' % (baselineFile))
+        return 0
+
+    if not os.path.exists(baselineFile):
+        print('No baseline at %s, not comparing (run with --save-baseline to create one).' % (baselineFile))
+        return 0
+
+    with open(baselineFile) as baseFile:
+        baseline = json.load(baseFile)
+    if baseline.get('version') != BENCHMARK_VERSION or baseline.get('quick') != current['quick']:
+        print('The baseline was made with different benchmark settings, not comparing.')
+        return 0
+
+    comparisons, regressions = compareWithBaseline(current, baseline, args.tolerance)
+    print()
+    for name, baseValue, value, change in comparisons:
+        mark = 'REGRESSION' if name in regressions else ''
+        print('%-32s %12.2f -> %12.2f  %+6.1f%% slower %s' % (name, baseValue, value, change * 100, mark))
+    if regressions:
+        print('%s benchmark(s) got slower than the baseline by more than %d%%.' % (len(regressions), args.tolerance * 100))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
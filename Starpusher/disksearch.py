@@ -0,0 +1,248 @@
+# Star Pusher disk search
+# Enumerates every state a level can reach, breadth first, keeping the
+# states on disk instead of in memory, so that levels with far more
+# states than fit in memory can be searched to the end: to prove that a
+# level can't be solved, to find the length of its shortest solution, or
+# to get the distance of every state from the start.
+#
+# Usage:
+#   python disksearch.py [levelfile] [--level N] [--memory MB]
+#                        [--temp-dir DIR] [--keep DIR] [--stop-at-solution]
+#
+# The states are stored with starsolver.encodeState(), which gives every
+# state of a level the same number of bytes. A run file is a sorted list
+# of such states, in zlib compressed blocks of BLOCK_STATES states:
+#   I + compressed bytes    per block
+# Each layer (the states first reached after the same number of actions)
+# is a run file. The next layer is made with delayed duplicate detection:
+# the successors of the layer are collected in memory until the memory
+# limit is reached, then sorted and written as a run; the runs are then
+# merged, and the states that are in the run of all the visited states
+# are dropped (a merge of the two sorted runs). Memory use depends on the
+# --memory limit, not on the size of the level.
+#
+# Solved states are counted but not expanded, the game ends there.
+
+import argparse, heapq, os, shutil, struct, sys, tempfile, time, zlib
+
+import gameloader, starsolver
+
+game = gameloader.loadGame()
+
+DEFAULT_MEMORY = 256 # megabytes for the states waiting to be sorted
+BLOCK_STATES = 4096 # states per compressed block of a run file
+STATE_OVERHEAD = 41 # bytes Python uses for each state in a list, besides the state's own
+
+BLOCK = struct.Struct('<I')
+
+
+def writeRun(filename, states):
+    """Writes the (sorted) states to a run file. Returns how many states
+    were written."""
+    count = 0
+    block = []
+    with open(filename, 'wb') as runFile:
+        for state in states:
+            block.append(state)
+            if len(block) == BLOCK_STATES:
+                writeBlock(runFile, block)
+                count += len(block)
+                block = []
+        if block:
+            writeBlock(runFile, block)
+            count += len(block)
+    return count
+
+
+def writeBlock(runFile, block):
+    """Writes one compressed block of states to the run file."""
+    data = zlib.compress(b''.join(block), 1)
+    runFile.write(BLOCK.pack(len(data)))
+    runFile.write(data)
+
+
+def readRun(filename, stateSize):
+    """Yields the states of a run file, in order. Only one block is in
+    memory at a time."""
+    with open(filename, 'rb') as runFile:
+        while True:
+            header = runFile.read(BLOCK.size)
+            if not header:
+                return
+            data = zlib.decompress(runFile.read(BLOCK.unpack(header)[0]))
+            for i in range(0, len(data), stateSize):
+                yield data[i:i + stateSize]
+
+
+def getUnique(states):
+    """Yields the sorted states without the repeated ones."""
+    last = None
+    for state in states:
+        if state != last:
+            yield state
+            last = state
+
+
+def getDifference(states, visited):
+    """Yields the states (sorted, without repeats) that are not in
+    visited (sorted too)."""
+    visitedState = next(visited, None)
+    for state in states:
+        while visitedState is not None and visitedState < state:
+            visitedState = next(visited, None)
+        if state != visitedState:
+            yield state
+
+
+def searchOnDisk(levelObj, memory=DEFAULT_MEMORY * 1024 * 1024, tempDir=None, keepDir=None, stopAtSolution=False):
+    """Enumerates the states the level can reach from its start, breadth
+    first, with the states on disk and about memory bytes of memory for
+    the successors waiting to be sorted. The run files go to a new
+    folder in tempDir, which is deleted at the end; if keepDir is given,
+    the layer files (layer-N.run: the states N actions from the start,
+    encoded with starsolver.encodeState()) are moved there.
+
+    Returns a dict with:
+        'seen': how many different states can be reached
+        'layers': the number of states at each distance from the start
+        'solutionLength': the fewest actions that solve the level, or None
+        'solved': how many solved states can be reached
+        'solution': a shortest list of actions that solves the level, or
+                    None
+        'complete': True if every reachable state was seen (False if
+                    stopAtSolution stopped the search early)"""
+    rules = starsolver.makeRules(levelObj)
+    startState = starsolver.getStartState(levelObj)
+    startData = starsolver.encodeState(rules, startState)
+    stateSize = len(startData)
+    maxBuffered = max(BLOCK_STATES, memory // (stateSize + STATE_OVERHEAD))
+
+    workDir = tempfile.mkdtemp(prefix='starpusher-search-', dir=tempDir)
+    try:
+        layerFiles = [os.path.join(workDir, 'layer-0.run')]
+        writeRun(layerFiles[0], [startData])
+        visitedFile = layerFiles[0]
+        layers = [1]
+        solved = 0
+        solvedData = None
+        solutionLength = None
+        complete = True
+
+        while layers[-1] > 0:
+            depth = len(layers) - 1
+            # Expand the layer, writing the successors as sorted runs.
+            runFiles = []
+            buffered = []
+            for data in readRun(layerFiles[depth], stateSize):
+                state = starsolver.decodeState(rules, data)
+                if starsolver.isSolved(rules, state):
+                    solved += 1
+                    if solvedData is None:
+                        solvedData = data
+                        solutionLength = depth
+                    continue
+                for action, newState in starsolver.getSuccessors(rules, state):
+                    buffered.append(starsolver.encodeState(rules, newState))
+                if len(buffered) >= maxBuffered:
+                    runFiles.append(writeSortedRun(workDir, len(runFiles), buffered))
+                    buffered = []
+            if buffered:
+                runFiles.append(writeSortedRun(workDir, len(runFiles), buffered))
+                buffered = []
+            if stopAtSolution and solvedData is not None:
+                complete = False
+                break
+
+            # Merge the runs, without the repeats and the visited states.
+            layerFiles.append(os.path.join(workDir, 'layer-%s.run' % (depth + 1)))
+            candidates = getUnique(heapq.merge(*[readRun(runFile, stateSize) for runFile in runFiles]))
+            layers.append(writeRun(layerFiles[-1], getDifference(candidates, readRun(visitedFile, stateSize))))
+            for runFile in runFiles:
+                os.remove(runFile)
+
+            # The new layer joins the visited states.
+            newVisitedFile = os.path.join(workDir, 'visited-%s.run' % (depth + 1))
+            writeRun(newVisitedFile, heapq.merge(readRun(visitedFile, stateSize), readRun(layerFiles[-1], stateSize)))
+            if visitedFile not in layerFiles:
+                os.remove(visitedFile)
+            visitedFile = newVisitedFile
+
+        if layers[-1] == 0:
+            layers.pop()
+        solution = None
+        if solvedData is not None:
+            solution = getLayerPath(rules, layerFiles, stateSize, solutionLength, solvedData)
+        if keepDir is not None:
+            os.makedirs(keepDir, exist_ok=True)
+            for i in range(len(layers)):
+                shutil.move(layerFiles[i], os.path.join(keepDir, os.path.basename(layerFiles[i])))
+        return {'seen': sum(layers),
+                'layers': layers,
+                'solutionLength': solutionLength,
+                'solved': solved,
+                'solution': solution,
+                'complete': complete}
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+
+def writeSortedRun(workDir, runNum, buffered):
+    """Sorts the states and writes them (without repeats) to a new run
+    file. Returns its name."""
+    buffered.sort()
+    runFile = os.path.join(workDir, 'run-%s.run' % (runNum))
+    writeRun(runFile, getUnique(buffered))
+    return runFile
+
+
+def getLayerPath(rules, layerFiles, stateSize, depth, data):
+    """Returns the list of actions from the start to the encoded state,
+    which is in layer depth: a state of each layer before it that leads
+    to the next one is found by reading the layer file again."""
+    actions = []
+    target = starsolver.decodeState(rules, data)
+    for layer in range(depth - 1, -1, -1):
+        for layerData in readRun(layerFiles[layer], stateSize):
+            state = starsolver.decodeState(rules, layerData)
+            step = [action for action, newState in starsolver.getSuccessors(rules, state) if newState == target]
+            if step:
+                actions.append(step[0])
+                target = state
+                break
+    actions.reverse()
+    return actions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Enumerates every reachable state of a Star Pusher level, on disk.')
+    parser.add_argument('levelfile', nargs='?', default=gameloader.LEVELFILE)
+    parser.add_argument('--level', type=int, default=1, help='level to search')
+    parser.add_argument('--memory', type=float, default=DEFAULT_MEMORY, help='megabytes of memory for the states waiting to be sorted')
+    parser.add_argument('--temp-dir', default=None, help='folder for the run files (default: the system temp folder)')
+    parser.add_argument('--keep', default=None, help='folder to keep the layer files in (the distance of every state)')
+    parser.add_argument('--stop-at-solution', action='store_true', help='stop at the first layer with a solved state')
+    args = parser.parse_args()
+
+    levelObj = game.readLevelsFile(args.levelfile)[args.level - 1]
+    startTime = time.time()
+    result = searchOnDisk(levelObj, int(args.memory * 1024 * 1024), args.temp_dir, args.keep, args.stop_at_solution)
+    elapsed = time.time() - startTime
+    print('Level %s: %s states in %s layers, %.1f s (%.0f states/s)%s' % (
+          args.level, result['seen'], len(result['layers']), elapsed, result['seen'] / elapsed,
+          '' if result['complete'] else ', stopped at the first solution'))
+    print('States per distance: %s' % (' '.join(str(count) for count in result['layers'])))
+    if result['solution'] is not None:
+        print('Shortest solution: %s actions (%s solved states reachable)' % (result['solutionLength'], result['solved']))
+        print(' '.join(result['solution']))
+    elif result['complete']:
+        print('No solution: the level can never be solved.')
+    try:
+        import resource
+        print('Peak memory: %.1f MB' % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+    except ImportError:
+        pass # not on Windows
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,168 @@
+# Star Pusher frame profiler
+# Measures how long each part of a frame takes, and draws an overlay with
+# a frame time histogram so that lag can be diagnosed on a player's machine.
+#
+# A frame is timed by calling startFrame(), then mark(section) at the end
+# of each part of the frame (the time since the previous mark goes to that
+# section), then endFrame(). Each call is only a perf_counter() and a dict
+# update, so the profiler stays on all the time and the overlay can show
+# the recent history as soon as it is turned on.
+
+import cProfile, collections, time
+import pygame
+
+HISTORY_FRAMES = 300 # how many frames the histogram and percentiles cover
+HISTOGRAM_BUCKET_MS = 2 # width of each histogram bar, in milliseconds
+HISTOGRAM_BUCKETS = 20 # the last bucket also counts all the slower frames
+
+OVERLAYCOLOR = (0, 0, 0, 180)
+OVERLAYTEXTCOLOR = (255, 255, 255)
+BARCOLOR = (0, 170, 255)
+SLOWBARCOLOR = (255, 80, 80)
+
+# The sections of a frame, in the order they are shown.
+SECTIONS = ('events', 'rules', 'drawMap', 'blits', 'update', 'wait')
+
+_frames = collections.deque(maxlen=HISTORY_FRAMES) # one dict of section times per frame
+_currentFrame = {}
+_frameStart = 0.0
+_lastMark = 0.0
+
+# Exporting to a file or to cProfile is done for a given number of frames.
+_exportFile = None
+_exportFramesLeft = 0
+_profile = None
+_profileFilename = None
+_profileFramesLeft = 0
+
+
+def startFrame():
+    """Starts timing a new frame."""
+    global _currentFrame, _frameStart, _lastMark
+    _currentFrame = {}
+    _frameStart = _lastMark = time.perf_counter()
+
+
+def mark(section):
+    """Adds the time since the last mark (or since startFrame()) to the
+    given section of the current frame."""
+    global _lastMark
+    now = time.perf_counter()
+    _currentFrame[section] = _currentFrame.get(section, 0.0) + now - _lastMark
+    _lastMark = now
+
+
+def endFrame():
+    """Finishes timing the current frame and stores it in the history.
+    Also writes it to the export file and stops the exports that have
+    covered all of their frames."""
+    global _exportFile, _exportFramesLeft, _profile, _profileFramesLeft
+
+    _currentFrame['total'] = time.perf_counter() - _frameStart
+    _frames.append(_currentFrame)
+
+    if _exportFile is not None:
+        _exportFile.write(','.join(['%.6f' % (_currentFrame.get(section, 0.0)) for section in SECTIONS + ('total',)]) + '\n')
+        _exportFramesLeft -= 1
+        if _exportFramesLeft <= 0:
+            _exportFile.close()
+            _exportFile = None
+
+    if _profile is not None:
+        _profileFramesLeft -= 1
+        if _profileFramesLeft <= 0:
+            _profile.disable()
+            _profile.dump_stats(_profileFilename)
+            _profile = None
+
+
+def percentile(values, pct):
+    """Returns the pct percentile (0 to 100) of the list of values."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def getStats():
+    """Returns a dict that maps each section (and 'total') to a
+    (p50, p99) tuple of its time in seconds over the recent frames."""
+    stats = {}
+    for section in SECTIONS + ('total',):
+        times = [frame.get(section, 0.0) for frame in _frames]
+        stats[section] = (percentile(times, 50), percentile(times, 99))
+    return stats
+
+
+def getHistogram():
+    """Returns a list with the number of recent frames in each frame
+    time bucket."""
+    buckets = [0] * HISTOGRAM_BUCKETS
+    for frame in _frames:
+        bucket = min(HISTOGRAM_BUCKETS - 1, int(frame['total'] * 1000 / HISTOGRAM_BUCKET_MS))
+        buckets[bucket] += 1
+    return buckets
+
+
+def exportFrames(filename, numFrames):
+    """Writes the section times of the next numFrames frames to filename
+    as CSV."""
+    global _exportFile, _exportFramesLeft
+    if _exportFile is not None:
+        _exportFile.close()
+    _exportFile = open(filename, 'w')
+    _exportFile.write(','.join(SECTIONS + ('total',)) + '\n')
+    _exportFramesLeft = numFrames
+
+
+def profileFrames(filename, numFrames):
+    """Runs cProfile over the next numFrames frames and dumps the stats
+    to filename (open it with the pstats module or snakeviz)."""
+    global _profile, _profileFilename, _profileFramesLeft
+    if _profile is not None:
+        _profile.disable()
+    _profile = cProfile.Profile()
+    _profileFilename = filename
+    _profileFramesLeft = numFrames
+    _profile.enable()
+
+
+def isExporting():
+    """Returns True while frames are being written to a file or profiled."""
+    return _exportFile is not None or _profile is not None
+
+
+def makeOverlay(font):
+    """Returns the profiler overlay drawn on a new (partly transparent)
+    Surface object."""
+    stats = getStats()
+    lines = ['%-8s p50 %5.1f  p99 %5.1f ms' % (section, stats[section][0] * 1000, stats[section][1] * 1000)
+             for section in SECTIONS + ('total',)]
+    if isExporting():
+        lines.append('recording...')
+
+    lineHeight = font.get_linesize()
+    histogramHeight = 60
+    overlayRect = pygame.Rect(0, 0, 320, lineHeight * len(lines) + histogramHeight + 30)
+    overlaySurf = pygame.Surface(overlayRect.size, pygame.SRCALPHA)
+    overlaySurf.fill(OVERLAYCOLOR)
+
+    for i in range(len(lines)):
+        overlaySurf.blit(font.render(lines[i], 1, OVERLAYTEXTCOLOR), (10, 5 + i * lineHeight))
+
+    # Draw the histogram: one bar per bucket, the height is the number of
+    # frames. Buckets slower than a 30 FPS frame are drawn in red.
+    buckets = getHistogram()
+    mostFrames = max(max(buckets), 1)
+    barWidth = (overlayRect.width - 20) // HISTOGRAM_BUCKETS
+    bottom = overlayRect.height - 20
+    for i in range(HISTOGRAM_BUCKETS):
+        barHeight = int(buckets[i] * histogramHeight / mostFrames)
+        if barHeight == 0:
+            continue
+        color = SLOWBARCOLOR if i * HISTOGRAM_BUCKET_MS >= 1000 / 30 else BARCOLOR
+        pygame.draw.rect(overlaySurf, color, (10 + i * barWidth, bottom - barHeight, barWidth - 1, barHeight))
+    legendSurf = font.render('0 ms %*s %d+ ms' % (18, '', (HISTOGRAM_BUCKETS - 1) * HISTOGRAM_BUCKET_MS), 1, OVERLAYTEXTCOLOR)
+    overlaySurf.blit(legendSurf, (10, bottom + 2))
+    return overlaySurf
@@ -0,0 +1,75 @@
+# Star Pusher tools helper
+# Loads the game script so that other scripts can use its functions.
+
+"""The game lives in "starpusher(turns).py", which can't be imported with
+a normal import statement because of the parentheses in its name. The
+tools (benchmark, solver, analyzer...) call loadGame() to get it as a
+module and use its rules (makeMove(), makeTurn(), makeGrab()...) and
+drawing functions."""
+
+import importlib.util, os, sys
+
+GAMEDIR = os.path.dirname(os.path.abspath(__file__))
+GAMEFILE = os.path.join(GAMEDIR, 'starpusher(turns).py')
+LEVELFILE = os.path.join(GAMEDIR, 'starPusherLevels.txt')
+
+_gameModule = None
+
+
+def loadGame():
+    """Returns the Star Pusher game module. If the game itself is the
+    running program, its __main__ module is returned so that both share
+    the same global variables (IMAGESDICT, DISPLAYSURF...)."""
+    global _gameModule
+
+    if _gameModule is not None:
+        return _gameModule
+
+    mainModule = sys.modules.get('__main__')
+    if getattr(mainModule, '__file__', None) is not None and \
+       os.path.abspath(mainModule.__file__) == GAMEFILE:
+        _gameModule = mainModule
+        return _gameModule
+
+    spec = importlib.util.spec_from_file_location('starpusher', GAMEFILE)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['starpusher'] = module # so that worker processes can unpickle its objects
+    # The game imports the tool modules that call loadGame() too, they
+    # must get this same module (even though it isn't fully loaded yet).
+    _gameModule = module
+    spec.loader.exec_module(module)
+    return _gameModule
+
+
+def initHeadless(width=None, height=None, gpu=False):
+    """Initializes pygame without a screen or sound card (using SDL's
+    dummy drivers), loads the game's images and returns the game module."""
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    return initDisplay(width, height, gpu)
+
+
+def initDisplay(width=None, height=None, gpu=False):
+    """Initializes pygame and the game's display globals (DISPLAYSURF,
+    BASICFONT, FPSCLOCK...) like the game's main() does, loads the game's
+    images and returns the game module. With gpu=True the game draws with
+    the GPU renderer, like with --gpu. The current directory is changed
+    to the game's folder because the game loads its files with relative
+    paths."""
+    os.chdir(GAMEDIR)
+
+    game = loadGame()
+    game.pygame.init()
+    size = (width or game.WINWIDTH, height or game.WINHEIGHT)
+    game.GPU = game.gpurenderer.makeGpu('Star Pusher', size) if gpu else None
+    if game.GPU is not None:
+        game.DISPLAYSURF = game.pygame.Surface(size)
+    else:
+        game.DISPLAYSURF = game.pygame.display.set_mode(size)
+        game.pygame.display.set_caption('Star Pusher')
+    game.BASICFONT = game.pygame.font.Font('freesansbold.ttf', 18)
+    game.PROFILERFONT = game.pygame.font.Font('freesansbold.ttf', 12)
+    game.showProfiler = False
+    game.FPSCLOCK = game.pygame.time.Clock()
+    game.loadImages()
+    return game
@@ -0,0 +1,314 @@
+# Star Pusher game server
+# Hosts the levels of a level file for players and spectators on the same
+# machine, over TCP or a Unix socket.
+#
+# Usage:
+#   python gameserver.py [--level N] [--port 8765 | --unix PATH]
+#   python gameserver.py --self-test 300
+#
+# Protocol (one JSON object or one line of text per line, both ways):
+#   1. The client sends "player" or "spectator".
+#   2. The server sends a snapshot of the level:
+#        {"type": "snapshot", "seq": 12, "level": 1, "map": [rows...],
+#         "goals": [[x, y]...], "cells": [[x, y, piece]...], "steps": 0,
+#         "solved": false}
+#      where each piece is what asyncgame's drawing uses for the space
+#      (getPieceCells()): ["door", open], ["button"], ["star"],
+#      ["grabstar"], ["player", direction] or a mix of them.
+#   3. A player sends lines of actions (the same as asyncgame.py's socket
+#      input: 'up', 'turnleft', 'grab', 'next'...); spectators don't send
+#      anything more.
+#   4. Every BROADCAST_INTERVAL the server sends everyone one message with
+#      what changed since the last one: a new snapshot when the level
+#      changed, otherwise
+#        {"type": "delta", "seq": 13, "cells": [[x, y, piece or null]...],
+#         "steps": 5, "solved": false}
+#      so the facing of the player and the door states come with the
+#      spaces whose pieces changed.
+# Each message is turned into bytes once and the same bytes are written to
+# every client without waiting for them, so one core can serve hundreds of
+# spectators; a client that doesn't read its messages is dropped.
+
+import argparse, asyncio, json, os, sys, time
+
+import gameloader, asyncgame, starsolver
+
+game = gameloader.loadGame()
+
+BROADCAST_INTERVAL = 1.0 / 30 # seconds between two broadcasts
+MAX_CLIENT_BUFFER = 1024 * 1024 # bytes waiting for a client before it's dropped
+
+
+def makeServer(levels, levelNum):
+    """Returns a server object. Its game runs without drawing."""
+    runObj = asyncgame.makeRun(levels, render=False)
+    asyncgame.startLevel(runObj, levelNum)
+    return {'runObj': runObj,
+            'queue': asyncio.Queue(),
+            'clients': {}, # writer -> 'player' or 'spectator'
+            'seq': 0, # number of the last message sent
+            'sentGameState': None, # the game state of the last message sent
+            'sentCells': {},
+            'sentSteps': 0,
+            'sentSolved': False,
+            'messages': 0,
+            'bytes': 0}
+
+
+def encodeMessage(message):
+    """Returns the message as one line of compact JSON, in bytes."""
+    return (json.dumps(message, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def encodeCells(cells):
+    """Returns the piece cells (from getPieceCells()) as a JSON list."""
+    return [[x, y, list(piece)] for (x, y), piece in sorted(cells.items())]
+
+
+def makeSnapshot(serverObj):
+    """Returns the snapshot message of the level as it was in the last
+    message sent (call broadcast() first to bring that up to date)."""
+    runObj = serverObj['runObj']
+    mapObj = runObj['levelObj']['mapObj']
+    return {'type': 'snapshot',
+            'seq': serverObj['seq'],
+            'level': runObj['levelNum'] + 1,
+            'map': [''.join(mapObj[x][y] for x in range(len(mapObj))) for y in range(len(mapObj[0]))],
+            'goals': [list(goal) for goal in runObj['levelObj']['goals']],
+            'cells': encodeCells(serverObj['sentCells']),
+            'steps': serverObj['sentSteps'],
+            'solved': serverObj['sentSolved']}
+
+
+def makeUpdate(serverObj):
+    """Returns the message with what changed since the last message sent
+    (a snapshot if the level changed), or None if nothing changed."""
+    runObj = serverObj['runObj']
+    cells = game.getPieceCells(runObj['gameStateObj'])
+    steps = runObj['gameStateObj']['stepCounter']
+    changed = game.getChangedCells(serverObj['sentCells'], cells)
+    # startLevel() makes a new game state: a new level, or a reset.
+    newLevel = runObj['gameStateObj'] is not serverObj['sentGameState']
+    if not newLevel and not changed and steps == serverObj['sentSteps'] and \
+       runObj['levelIsComplete'] == serverObj['sentSolved']:
+        return None
+    serverObj['seq'] += 1
+    serverObj['sentGameState'] = runObj['gameStateObj']
+    serverObj['sentCells'] = cells
+    serverObj['sentSteps'] = steps
+    serverObj['sentSolved'] = runObj['levelIsComplete']
+    if newLevel:
+        return makeSnapshot(serverObj)
+    return {'type': 'delta',
+            'seq': serverObj['seq'],
+            'cells': [[x, y, list(cells[(x, y)]) if (x, y) in cells else None] for x, y in sorted(changed)],
+            'steps': steps,
+            'solved': serverObj['sentSolved']}
+
+
+def sendToAll(serverObj, message):
+    """Writes the message to every client, without waiting for any of
+    them. Clients with too much unread data are dropped."""
+    data = encodeMessage(message)
+    for writer in list(serverObj['clients']):
+        if writer.transport.is_closing() or writer.transport.get_write_buffer_size() > MAX_CLIENT_BUFFER:
+            del serverObj['clients'][writer]
+            writer.close()
+            continue
+        writer.write(data)
+        serverObj['messages'] += 1
+        serverObj['bytes'] += len(data)
+
+
+def broadcast(serverObj):
+    """Sends everyone what changed since the last broadcast, if anything."""
+    message = makeUpdate(serverObj)
+    if message is not None:
+        sendToAll(serverObj, message)
+
+
+async def broadcastTask(serverObj):
+    """Broadcasts the changes every BROADCAST_INTERVAL, so that a burst of
+    moves costs one message per client."""
+    while True:
+        broadcast(serverObj)
+        await asyncio.sleep(BROADCAST_INTERVAL)
+
+
+async def handleClient(serverObj, reader, writer):
+    """Talks to one client, from its hello line until it disconnects."""
+    hello = (await reader.readline()).decode('utf-8', 'replace').strip()
+    role = 'player' if hello == 'player' else 'spectator'
+
+    # The others get the changes up to now first, so that the snapshot and
+    # the next delta start from the same state.
+    broadcast(serverObj)
+    writer.write(encodeMessage(makeSnapshot(serverObj)))
+    serverObj['clients'][writer] = role
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if role != 'player':
+                continue
+            try:
+                actions = asyncgame.parseActions(line.decode('utf-8'))
+            except (ValueError, UnicodeDecodeError) as error:
+                writer.write(encodeMessage({'type': 'error', 'error': str(error)}))
+                continue
+            for action in actions:
+                if action != 'quit': # a player can't stop the server
+                    await serverObj['queue'].put(action)
+    except ConnectionError:
+        pass
+    finally:
+        serverObj['clients'].pop(writer, None)
+        writer.close()
+
+
+async def startServer(serverObj, host='127.0.0.1', port=0, unixPath=None):
+    """Starts the game and broadcast tasks and the TCP (or Unix socket)
+    server. Returns (server, tasks)."""
+    runObj = serverObj['runObj']
+    tasks = [asyncio.create_task(asyncgame.gameTask(serverObj['queue'], runObj)),
+             asyncio.create_task(broadcastTask(serverObj))]
+    handler = lambda reader, writer: handleClient(serverObj, reader, writer)
+    if unixPath is not None:
+        server = await asyncio.start_unix_server(handler, unixPath)
+    else:
+        server = await asyncio.start_server(handler, host, port, backlog=1024)
+    return server, tasks
+
+
+def applyMessage(viewObj, message):
+    """Client side: updates viewObj (a dict, empty at first) with a
+    message from the server. viewObj['cells'] maps (x, y) to the piece
+    tuple, like getPieceCells()."""
+    if message['type'] == 'snapshot':
+        viewObj['level'] = message['level']
+        viewObj['map'] = message['map']
+        viewObj['cells'] = dict(((x, y), tuple(piece)) for x, y, piece in message['cells'])
+    elif message['type'] == 'delta':
+        for x, y, piece in message['cells']:
+            if piece is None:
+                viewObj['cells'].pop((x, y), None)
+            else:
+                viewObj['cells'][(x, y)] = tuple(piece)
+    else:
+        return
+    viewObj['seq'] = message['seq']
+    viewObj['steps'] = message['steps']
+    viewObj['solved'] = message['solved']
+
+
+async def spectate(host, port, viewObj, doneEvent):
+    """Client side: connects as a spectator and keeps viewObj up to date
+    until doneEvent is set."""
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b'spectator\n')
+    readTask = None
+    while not doneEvent.is_set():
+        readTask = asyncio.ensure_future(reader.readline())
+        doneTask = asyncio.ensure_future(doneEvent.wait())
+        done, pending = await asyncio.wait([readTask, doneTask], return_when=asyncio.FIRST_COMPLETED)
+        doneTask.cancel()
+        if readTask not in done:
+            readTask.cancel()
+            break
+        line = readTask.result()
+        if not line:
+            break
+        applyMessage(viewObj, json.loads(line))
+    writer.close()
+
+
+async def selfTest(levels, numSpectators, numLevels):
+    """Runs a server on localhost with numSpectators spectators and a
+    player that plays the solver's solutions of the first numLevels
+    levels. Returns the number of spectators whose view doesn't match the
+    server's game in the end."""
+    serverObj = makeServer(levels, 0)
+    server, tasks = await startServer(serverObj)
+    host, port = server.sockets[0].getsockname()[:2]
+    doneEvent = asyncio.Event()
+    views = [{} for i in range(numSpectators)]
+    spectators = [asyncio.create_task(spectate(host, port, viewObj, doneEvent)) for viewObj in views]
+
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b'player\n')
+    startTime = time.time()
+    runObj = serverObj['runObj']
+    numActions = 0
+    for levelNum in range(numLevels):
+        rules = starsolver.makeRules(levels[levelNum])
+        solution = starsolver.search(rules, starsolver.getStartState(levels[levelNum]), 2.0)['solution']
+        if levelNum > 0:
+            writer.write(b'next\n')
+        for action in solution:
+            writer.write((action + '\n').encode('utf-8'))
+            numActions += 1
+            await asyncio.sleep(0)
+    await writer.drain()
+
+    # Wait for the server to do everything and the spectators to get it.
+    while serverObj['queue'].qsize() or not runObj['levelIsComplete'] or \
+          any(viewObj.get('seq') != serverObj['seq'] for viewObj in views):
+        await asyncio.sleep(BROADCAST_INTERVAL)
+    seconds = time.time() - startTime
+
+    cells = game.getPieceCells(runObj['gameStateObj'])
+    wrong = len([viewObj for viewObj in views if viewObj['cells'] != cells or viewObj['level'] != runObj['levelNum'] + 1
+                 or viewObj['steps'] != runObj['gameStateObj']['stepCounter'] or not viewObj['solved']])
+    print('%s spectators, %s actions, %s messages (%s bytes) in %.2f s, %s wrong views' % (
+          numSpectators, numActions, serverObj['messages'], serverObj['bytes'], seconds, wrong), file=sys.stderr)
+
+    doneEvent.set()
+    writer.close()
+    await asyncio.gather(*spectators)
+    for task in tasks:
+        task.cancel()
+    server.close()
+    await server.wait_closed()
+    return wrong
+
+
+async def serve(levels, levelNum, host, port, unixPath):
+    """Runs the server until it is interrupted."""
+    serverObj = makeServer(levels, levelNum)
+    server, tasks = await startServer(serverObj, host, port, unixPath)
+    if unixPath is not None:
+        print('Serving on %s' % unixPath, file=sys.stderr)
+    else:
+        print('Serving on %s:%s' % server.sockets[0].getsockname()[:2], file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hosts Star Pusher levels for local players and spectators.')
+    parser.add_argument('levelfile', nargs='?', default=gameloader.LEVELFILE)
+    parser.add_argument('--level', type=int, default=1, help='level to start with')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', default=None, help='listen on this Unix socket instead of TCP')
+    parser.add_argument('--self-test', type=int, default=None, metavar='SPECTATORS',
+                        help='play the first levels with this many spectators on localhost and check their views')
+    parser.add_argument('--test-levels', type=int, default=3, help='levels played by --self-test')
+    args = parser.parse_args()
+
+    levels = game.readLevelsFile(args.levelfile)
+    if args.self_test is not None:
+        wrong = asyncio.run(selfTest(levels, args.self_test, min(args.test_levels, len(levels))))
+        sys.exit(1 if wrong else 0)
+    try:
+        asyncio.run(serve(levels, args.level - 1, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.unix is not None and os.path.exists(args.unix):
+            os.remove(args.unix)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+# Star Pusher GPU renderer
+# Draws the levels with SDL2's Renderer and Texture API (pygame._sdl2)
+# instead of blitting Surface objects. The tile images are uploaded as
+# textures once, the map chunks (see the game's makeChunkCache()) are
+# drawn into target textures that stay on the graphics card, and a frame
+# is a handful of texture copies, which SDL batches into as few draw calls
+# as it can.
+#
+# The game uses it when started with --gpu. If SDL can't make a renderer,
+# makeGpu() returns None and the game draws with Surface objects as usual.
+# Without a screen (SDL's dummy video driver) SDL picks its own software
+# renderer, so the same code runs in headless tests and benchmarks.
+
+import collections, os, time
+
+import pygame
+from pygame._sdl2 import video
+
+import frameprofiler, gameloader
+
+game = gameloader.loadGame()
+
+TEXT_CACHE_SIZE = 64 # text textures kept (the steps text changes with every move)
+
+
+def makeGpu(title, size):
+    """Returns a GPU renderer object with its own window of the given
+    (width, height), or None if SDL can't make a renderer."""
+    # SDL reads its hints from the environment; batching is only on by
+    # default when SDL picks the render driver itself.
+    os.environ.setdefault('SDL_RENDER_BATCHING', '1')
+    try:
+        window = video.Window(title, size)
+        renderer = video.Renderer(window, accelerated=-1)
+    except (pygame.error, video.error):
+        return None
+    return {'window': window,
+            'renderer': renderer,
+            'textures': {}, # id(Surface) -> (Surface, Texture) for the images
+            'texts': collections.OrderedDict(), # key -> Texture, oldest first
+            'screen': None} # the Texture that drawSurface() copies to
+
+
+def getImageTexture(gpuObj, surf):
+    """Returns the texture of an image that doesn't change (a tile or
+    sprite from IMAGESDICT), uploading it the first time."""
+    textures = gpuObj['textures']
+    if id(surf) not in textures:
+        # The Surface is kept too, so its id can't be reused by another.
+        textures[id(surf)] = (surf, video.Texture.from_surface(gpuObj['renderer'], surf))
+    return textures[id(surf)][1]
+
+
+def getOverlayTexture(gpuObj, surf, key):
+    """Returns the texture of an overlay image (see the game's
+    getLevelOverlay()). Images with the same key are uploaded once, as
+    long as they are among the TEXT_CACHE_SIZE most recently used."""
+    if key is None:
+        return video.Texture.from_surface(gpuObj['renderer'], surf)
+    texts = gpuObj['texts']
+    if key in texts:
+        texts.move_to_end(key)
+    else:
+        texts[key] = video.Texture.from_surface(gpuObj['renderer'], surf)
+        if len(texts) > TEXT_CACHE_SIZE:
+            texts.popitem(last=False)
+    return texts[key]
+
+
+def drawChunk(gpuObj, chunkCache, gameStateObj, chunkx, chunky):
+    """Draws one chunk of the map into a new target texture and returns
+    it. The same as the game's drawChunk(), on the graphics card; when
+    zoomed, the graphics card scales the tiles' textures to the spaces."""
+    renderer = gpuObj['renderer']
+    mapObj = chunkCache['mapObj']
+    chunkTexture = video.Texture(renderer, game.getChunkRect(chunkCache, chunkx, chunky).size, target=True)
+    renderer.target = chunkTexture
+    renderer.draw_color = pygame.Color(game.BGCOLOR)
+    renderer.clear()
+    for x, y, spaceRect in game.getChunkTiles(chunkCache, chunkx, chunky):
+        for image in game.getTileImages(mapObj, gameStateObj, chunkCache['goals'], x, y):
+            getImageTexture(gpuObj, image).draw(dstrect=spaceRect)
+    renderer.target = None
+    return chunkTexture
+
+
+def drawMapChunks(gpuObj, chunkCache, gameStateObj, topleft):
+    """Draws the chunks of the map that can be seen, like the game's
+    drawMapChunks(). The chunk cache holds textures instead of Surface
+    objects, so it must only be used with this renderer."""
+    mapLeft, mapTop = topleft
+    chunks = chunkCache['chunks']
+    screenRect = pygame.Rect((0, 0), gpuObj['window'].size)
+    visibleChunks = game.getVisibleChunks(chunkCache, screenRect, topleft)
+    deadline = game.getChunkDeadline(chunkCache)
+    for chunkx, chunky in visibleChunks:
+        if (chunkx, chunky) in chunks:
+            chunks.move_to_end((chunkx, chunky)) # mark as recently used
+        elif time.perf_counter() < deadline:
+            chunks[(chunkx, chunky)] = drawChunk(gpuObj, chunkCache, gameStateObj, chunkx, chunky)
+            chunkCache['bytes'] += game.getChunkBytes(chunkCache, chunkx, chunky)
+        else:
+            continue # drawn in the next frames
+        chunkRect = game.getChunkRect(chunkCache, chunkx, chunky)
+        chunks[(chunkx, chunky)].draw(dstrect=chunkRect.move(mapLeft, mapTop))
+    game.trimChunkCache(chunkCache, len(visibleChunks))
+
+
+def drawLevelView(gpuObj, viewObj, gameStateObj, levelIsComplete, hintObj=None, selectedStar=None):
+    """Draws the level with the renderer, like the game's drawLevelView().
+    Call the game's updateDisplay() to show it."""
+    renderer = gpuObj['renderer']
+    renderer.draw_color = pygame.Color(game.BGCOLOR)
+    renderer.clear()
+    frameprofiler.mark('blits')
+
+    drawMapChunks(gpuObj, viewObj['chunkCache'], gameStateObj, game.getMapTopLeft(viewObj))
+    frameprofiler.mark('drawMap')
+
+    for kind, value, rect, key in game.getLevelOverlay(viewObj, gameStateObj, levelIsComplete, hintObj, selectedStar):
+        if kind == 'outline':
+            drawOutline(renderer, value, rect, 3)
+        else:
+            getOverlayTexture(gpuObj, value, key).draw(dstrect=rect)
+    frameprofiler.mark('blits')
+
+
+def drawOutline(renderer, color, rect, width):
+    """Draws the outline of rect, width pixels wide on the inside, like
+    pygame.draw.rect() does."""
+    renderer.draw_color = pygame.Color(color)
+    rect = pygame.Rect(rect)
+    for i in range(width):
+        renderer.draw_rect(rect.inflate(-2 * i, -2 * i))
+
+
+def drawSurface(gpuObj, surf):
+    """Copies all of surf to the renderer (for the screens that are drawn
+    on DISPLAYSURF, such as the start screen)."""
+    renderer = gpuObj['renderer']
+    if gpuObj['screen'] is None or gpuObj['screen'].get_rect().size != surf.get_size():
+        gpuObj['screen'] = video.Texture(renderer, surf.get_size(), streaming=True)
+    gpuObj['screen'].update(surf)
+    gpuObj['screen'].draw()
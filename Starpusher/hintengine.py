@@ -0,0 +1,124 @@
+# Star Pusher hint engine
+# Finds the next best action for the player with starsolver.py, on a
+# background thread so that runLevel()'s frame loop never waits for it.
+#
+# Once a solution is found it is kept: while the player follows the hints,
+# every state they reach is on the solution, so the next hint is a dict
+# lookup and no new search is needed. When the player does something else,
+# the old search (if still running) is cancelled and a new one starts from
+# where the player is.
+
+import threading, time
+
+import lowerbound, starsolver
+
+HINT_BUDGET = 0.2 # seconds before a provisional hint is shown
+HINT_WEIGHT = 2.0 # heuristic weight of the best first search
+HINT_MAX_STATES = 500000 # give up after this many states
+
+
+def makeHintEngine(levelObj, boundObj=None):
+    """Returns a hint engine object for the level. boundObj is the level's
+    lower bound object, if it was already made (see levelprefetch.py)."""
+    if boundObj is None:
+        boundObj = lowerbound.makeBound(starsolver.makeRules(levelObj))
+    return {'rules': boundObj['rules'],
+            'boundObj': boundObj, # the search's heuristic
+            'lock': threading.Lock(),
+            'generation': 0, # increased every time a new search starts
+            'cancelEvent': None, # set to stop the current search
+            'searchState': None, # the state the current search started from
+            'searchStart': 0.0,
+            'provisional': None, # best guess from the current search so far
+            'pathIndex': {}, # state -> next action, for the known solution
+            'noHint': set()} # states the search found no solution from
+
+
+def getHint(hintObj, gameStateObj):
+    """Returns (action, isFinal) for the player's current state, or None
+    if there is no hint (yet). isFinal is False while the search is still
+    running and the action is only the best guess so far. Starts a new
+    background search if needed; this never waits for the search."""
+    state = starsolver.fromGameState(gameStateObj)
+
+    with hintObj['lock']:
+        if state in hintObj['pathIndex']:
+            # The player is following the known solution.
+            return (hintObj['pathIndex'][state], True)
+        if state in hintObj['noHint']:
+            return None
+        if hintObj['searchState'] == state:
+            # Still searching from here.
+            if hintObj['provisional'] and time.time() - hintObj['searchStart'] >= HINT_BUDGET:
+                return (hintObj['provisional'], False)
+            return None
+
+    startSearch(hintObj, state)
+    return None
+
+
+def startSearch(hintObj, state):
+    """Cancels the running search (if any) and starts a new one from
+    state on a background thread."""
+    with hintObj['lock']:
+        if hintObj['cancelEvent'] is not None:
+            hintObj['cancelEvent'].set()
+        hintObj['generation'] += 1
+        hintObj['cancelEvent'] = threading.Event()
+        hintObj['searchState'] = state
+        hintObj['searchStart'] = time.time()
+        hintObj['provisional'] = None
+        generation = hintObj['generation']
+        cancelEvent = hintObj['cancelEvent']
+
+    thread = threading.Thread(target=runSearch, args=(hintObj, state, generation, cancelEvent))
+    thread.daemon = True # don't keep the game running when it quits
+    thread.start()
+
+
+def runSearch(hintObj, state, generation, cancelEvent):
+    """The background thread: searches (showing the best guess so far as
+    a provisional hint while it runs), then stores the solution."""
+    rules = hintObj['rules']
+
+    def showProgress(best):
+        with hintObj['lock']:
+            if hintObj['generation'] == generation and best:
+                hintObj['provisional'] = best[0]
+
+    result = starsolver.search(rules, state, HINT_WEIGHT, HINT_MAX_STATES, cancelEvent,
+                               boundObj=hintObj['boundObj'], progress=showProgress)
+    if cancelEvent.is_set():
+        return
+
+    with hintObj['lock']:
+        if hintObj['generation'] != generation:
+            return # a newer search has started
+        hintObj['cancelEvent'] = None
+        if result['solution'] is None:
+            if result['complete']:
+                # Unsolvable: don't search from here again.
+                hintObj['searchState'] = None
+                hintObj['noHint'].add(state)
+            elif result['best']:
+                # Too hard: keep the best guess (searchState stays, so
+                # getHint() doesn't search from here again until the
+                # player moves).
+                hintObj['provisional'] = result['best'][0]
+            return
+        hintObj['searchState'] = None
+        # Remember the next action for every state along the solution.
+        states = starsolver.playActions(rules, state, result['solution'])
+        hintObj['pathIndex'] = {}
+        for i in range(len(result['solution'])):
+            hintObj['pathIndex'][states[i]] = result['solution'][i]
+
+
+def stopHintEngine(hintObj):
+    """Cancels the running search, if any."""
+    with hintObj['lock']:
+        if hintObj['cancelEvent'] is not None:
+            hintObj['cancelEvent'].set()
+        hintObj['generation'] += 1
+        hintObj['searchState'] = None
+        hintObj['cancelEvent'] = None
@@ -0,0 +1,248 @@
+# Star Pusher level analyzer
+# Computes difficulty metrics for every level of a level file, using all
+# the CPU cores, and writes them as a CSV file (or as a columnar JSON
+# file: one list of values per column).
+#
+# Usage:
+#   python levelanalyzer.py [levelfile] [-o metrics.csv] [--format csv|json]
+#                           [--processes N] [--max-states N]
+#                           [--cache FILE | --no-cache]
+#
+# The level file is read once into shared memory; the worker processes
+# parse the level blocks they are given straight from it, with the game's
+# parseLevels(), so doors, buttons and the 'p' and 's' characters work
+# exactly like in the game.
+#
+# The metrics are kept in levelcache.py's cache (unless --no-cache is
+# given), keyed by the level's hash, so only new or changed levels are
+# analyzed again.
+
+import argparse, collections, csv, json, multiprocessing, os, sys, time
+from multiprocessing import shared_memory
+
+import gameloader, levelcache, lowerbound, starsolver
+
+game = gameloader.loadGame()
+
+DEFAULT_MAX_STATES = 200000 # states explored per level before giving up
+
+COLUMNS = ('level', 'hash', 'width', 'height', 'stars', 'goals', 'doors', 'buttons',
+           'solvable', 'optimal', 'actions', 'moves', 'pushes', 'grabs', 'turns',
+           'reachable_states', 'all_states_seen', 'branching_factor',
+           'dead_squares', 'door_depth', 'lower_bound', 'seconds', 'cached', 'error')
+
+
+def getDoorDepth(rules, startxy, stars):
+    """Returns the largest number of doors the player has to walk through
+    to get from startxy to one of the stars or a goal (0 when no door is in the
+    way). Every door needs a button to be pressed first, so this is how
+    deep the door and button puzzles are nested."""
+    doors = set(rules['doors'])
+    depths = {startxy: 0}
+    toVisit = collections.deque([startxy])
+    while toVisit:
+        # A 0-1 breadth first search: stepping onto a door costs 1.
+        x, y = toVisit.popleft()
+        for xOffset, yOffset in starsolver.OFFSETS:
+            neighbour = (x + xOffset, y + yOffset)
+            if neighbour not in rules['inside']:
+                continue
+            cost = 1 if neighbour in doors else 0
+            if neighbour not in depths or depths[(x, y)] + cost < depths[neighbour]:
+                depths[neighbour] = depths[(x, y)] + cost
+                if cost == 0:
+                    toVisit.appendleft(neighbour)
+                else:
+                    toVisit.append(neighbour)
+    return max([depths.get(cell, 0) for cell in list(rules['goals']) + list(stars)] + [0])
+
+
+def countActions(rules, startState, actions):
+    """Returns (moves, pushes, grabs, turns) for a list of actions: the
+    arrow key moves, the actions that moved a star, the grabs and let
+    gos, and the turns."""
+    states = starsolver.playActions(rules, startState, actions)
+    moves = pushes = grabs = turns = 0
+    for i in range(len(actions)):
+        if actions[i] in starsolver.MOVEACTIONS:
+            moves += 1
+        elif actions[i] == 'grab':
+            grabs += 1
+        else:
+            turns += 1
+        # Compare where the stars are, grabbed or not.
+        starsBefore = sorted(states[i][2] + ((states[i][3],) if states[i][3] else ()))
+        starsAfter = sorted(states[i + 1][2] + ((states[i + 1][3],) if states[i + 1][3] else ()))
+        if starsBefore != starsAfter:
+            pushes += 1
+    return moves, pushes, grabs, turns
+
+
+def analyzeLevel(levelObj, maxStates=DEFAULT_MAX_STATES):
+    """Returns a dict of metrics (the COLUMNS, except 'level', 'hash',
+    'cached' and 'error') for the level."""
+    startTime = time.time()
+    rules = starsolver.makeRules(levelObj)
+    startState = starsolver.getStartState(levelObj)
+    stars = levelObj['startState']['stars']
+
+    metrics = {'width': len(levelObj['mapObj']),
+               'height': len(levelObj['mapObj'][0]),
+               'stars': len(stars),
+               'goals': len(rules['goals']),
+               'doors': len(rules['doors']),
+               'buttons': len(rules['buttons']),
+               'dead_squares': len(starsolver.getDeadSquares(rules)),
+               'door_depth': getDoorDepth(rules, startState[0], stars),
+               'lower_bound': lowerbound.getStateBound(lowerbound.makeBound(rules), startState)}
+
+    # A breadth first search through every reachable state gives the
+    # shortest solution and the size of the state space.
+    result = starsolver.search(rules, startState, 0, maxStates, exhaustive=True)
+    metrics['reachable_states'] = result['seen']
+    metrics['all_states_seen'] = result['complete']
+    metrics['branching_factor'] = round(result['edges'] / max(1, result['expanded']), 3)
+    solution = result['solution']
+    metrics['optimal'] = solution is not None
+    if solution is None and not result['complete']:
+        # Too many states to be sure: a best first search may still find
+        # a (longer than optimal) solution.
+        solution = starsolver.search(rules, startState, 1.0, maxStates)['solution']
+
+    if solution is not None:
+        metrics['solvable'] = True
+        metrics['actions'] = len(solution)
+        metrics['moves'], metrics['pushes'], metrics['grabs'], metrics['turns'] = countActions(rules, startState, solution)
+    elif result['complete']:
+        metrics['solvable'] = False # every reachable state was seen
+    metrics['seconds'] = round(time.time() - startTime, 3)
+    return metrics
+
+
+def getMetricsVersion():
+    """Returns the version of the code that computes the metrics, for
+    the cache entries."""
+    return levelcache.getCodeVersion([analyzeLevel, getDoorDepth, countActions, starsolver.getSuccessors,
+                                      starsolver.search, starsolver.getDeadSquares, lowerbound.getStarMoves,
+                                      lowerbound.makeMatching, lowerbound.augment])
+
+
+# The shared memory holding the level file and the cache, in the worker
+# processes.
+_sharedLevels = None
+_cache = None
+
+
+def attachSharedLevels(name, cacheFile):
+    """Pool initializer: opens the shared memory made by analyzeFile(),
+    and the cache file (read only: only the main process writes to it)."""
+    global _sharedLevels, _cache
+    _sharedLevels = shared_memory.SharedMemory(name=name)
+    if cacheFile is not None:
+        _cache = levelcache.openCache(cacheFile, readOnly=True)
+
+
+def analyzeBlock(task):
+    """Worker function: parses and analyzes one level, whose text is at
+    bytes start to end of the shared memory. Returns the row of metrics."""
+    levelNum, start, end, filename, maxStates, version = task
+    row = {'level': levelNum + 1}
+    try:
+        text = bytes(_sharedLevels.buf[start:end]).decode('utf-8')
+        levelObj = game.parseLevels(text.splitlines(True), filename, levelNum)[0]
+        row['hash'] = levelcache.getLevelHash(levelObj)
+        metrics = None
+        if _cache is not None:
+            metrics = levelcache.cacheGet(_cache, row['hash'], 'metrics:%s' % maxStates, version)
+        row['cached'] = metrics is not None
+        if metrics is None:
+            metrics = analyzeLevel(levelObj, maxStates)
+        row.update(metrics)
+    except AssertionError as error:
+        row['error'] = str(error)
+    return row
+
+
+def analyzeFile(filename, processes=None, maxStates=DEFAULT_MAX_STATES, cacheFile=levelcache.DEFAULT_CACHE_FILE):
+    """Analyzes every level of the level file in parallel. Yields the
+    rows of metrics, in level order. The metrics are looked up in, and
+    stored to, the cache file unless cacheFile is None."""
+    with open(filename, 'rb') as levelFile:
+        data = levelFile.read()
+
+    # Find the byte range of each level's lines.
+    lines = data.splitlines(True)
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+    blocks = game.findLevelBlocks([line.decode('utf-8') for line in lines])
+    version = getMetricsVersion()
+    tasks = [(i, offsets[blocks[i][0]], offsets[blocks[i][1]], filename, maxStates, version) for i in range(len(blocks))]
+
+    # Opened first, so that the file exists when the workers open it.
+    cacheObj = levelcache.openCache(cacheFile) if cacheFile is not None else None
+    sharedLevels = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    try:
+        sharedLevels.buf[:len(data)] = data
+        processes = processes or os.cpu_count() or 1
+        with multiprocessing.Pool(processes, initializer=attachSharedLevels, initargs=(sharedLevels.name, cacheFile)) as pool:
+            # Big enough chunks to keep the overhead low, small enough
+            # that every process gets some of the hard levels.
+            chunkSize = max(1, min(64, len(tasks) // (processes * 8)))
+            for row in pool.imap(analyzeBlock, tasks, chunkSize):
+                if cacheObj is not None and not row.get('cached', True):
+                    metrics = dict((column, row[column]) for column in row if column not in ('level', 'hash', 'cached'))
+                    levelcache.cachePut(cacheObj, row['hash'], 'metrics:%s' % maxStates, metrics, version)
+                yield row
+    finally:
+        sharedLevels.close()
+        sharedLevels.unlink()
+        if cacheObj is not None:
+            levelcache.closeCache(cacheObj)
+
+
+def writeCsv(rows, outFile):
+    """Writes the rows as CSV, one line per level."""
+    writer = csv.DictWriter(outFile, COLUMNS, restval='')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+
+
+def writeColumns(rows, outFile):
+    """Writes the rows as a columnar JSON object: each column name maps to
+    the list of its values, one per level."""
+    columns = dict((column, []) for column in COLUMNS)
+    for row in rows:
+        for column in COLUMNS:
+            columns[column].append(row.get(column))
+    json.dump(columns, outFile)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Computes difficulty metrics for Star Pusher levels.')
+    parser.add_argument('levelfile', nargs='?', default=gameloader.LEVELFILE)
+    parser.add_argument('-o', '--output', default='-', help='file to write to (default: the screen)')
+    parser.add_argument('--format', choices=('csv', 'json'), default='csv', help='csv, or json for one list per column')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--max-states', type=int, default=DEFAULT_MAX_STATES, help='states to explore per level before giving up')
+    parser.add_argument('--cache', default=levelcache.DEFAULT_CACHE_FILE, help='cache file of the metrics')
+    parser.add_argument('--no-cache', action='store_true', help='analyze every level again, without the cache')
+    args = parser.parse_args()
+
+    startTime = time.time()
+    rows = analyzeFile(args.levelfile, args.processes, args.max_states, None if args.no_cache else args.cache)
+    outFile = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    try:
+        if args.format == 'csv':
+            writeCsv(rows, outFile)
+        else:
+            writeColumns(rows, outFile)
+    finally:
+        if outFile is not sys.stdout:
+            outFile.close()
+    print('Analyzed %s in %.1f s' % (args.levelfile, time.time() - startTime), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
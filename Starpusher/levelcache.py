@@ -0,0 +1,144 @@
+# Star Pusher level cache
+# Keeps solutions, metrics and dead square tables of levels in an SQLite
+# file, so that a level that was solved or analyzed before doesn't have to
+# be again.
+#
+# Entries are keyed by the level's levelhash.py hash (without symmetry:
+# a solution is a list of key presses, which only works for the level the
+# way it is turned) and by a kind, such as 'solution:1.0:None'. Each entry
+# also stores the version of the code that made it: a hash of the source
+# of the game's rule functions (makeMove(), makeTurn()...), plus the
+# source of the tool that computed it (for the solutions and dead square
+# tables, the starsolver.py functions in SOLVER_FUNCTIONS and
+# DEADSQUARE_FUNCTIONS). Changing any of them makes the old entries stale:
+# they are never returned, and those made with other rule functions are
+# deleted when the cache is opened.
+
+import hashlib, inspect, json, os, pathlib, sqlite3
+
+import gameloader, levelhash, starsolver
+
+game = gameloader.loadGame()
+
+DEFAULT_CACHE_FILE = os.path.join(gameloader.GAMEDIR, 'starpusher-cache.sqlite')
+RULE_FUNCTIONS = ('parseLevels', 'isWall', 'isBlocked', 'isDoorOpen', 'makeGrab',
+                  'makeTurn', 'moveStar', 'makeMove', 'isLevelFinished')
+DEADSQUARE_FUNCTIONS = ('makeRules', 'getInsideCells', 'getDeadSquares')
+SOLVER_FUNCTIONS = DEADSQUARE_FUNCTIONS + ('getGoalDistances', 'applyAction', 'getSuccessors', 'isSolved',
+                                           'getHeuristic', 'search', 'getPath')
+COMMIT_EVERY = 500 # puts between commits
+
+
+def getCodeVersion(functions):
+    """Returns a hash of the source code of the functions (or modules)."""
+    versionHash = hashlib.sha1()
+    for function in functions:
+        versionHash.update(inspect.getsource(function).encode('utf-8'))
+    return versionHash.hexdigest()
+
+
+def getRulesVersion():
+    """Returns the hash of the source of the game's rule functions."""
+    return getCodeVersion([getattr(game, name) for name in RULE_FUNCTIONS])
+
+
+def getSolverVersion(names):
+    """Returns the hash of the source of the named starsolver.py
+    functions."""
+    return getCodeVersion([getattr(starsolver, name) for name in names])
+
+
+def openCache(filename=DEFAULT_CACHE_FILE, readOnly=False):
+    """Returns a cache object for the SQLite file (made if it doesn't
+    exist). Entries made with other rule functions are deleted."""
+    rulesVersion = getRulesVersion()
+    if readOnly:
+        db = sqlite3.connect(pathlib.Path(filename).resolve().as_uri() + '?mode=ro', uri=True, check_same_thread=False)
+    else:
+        db = sqlite3.connect(filename, check_same_thread=False)
+        # WAL lets other processes read while this one writes.
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('CREATE TABLE IF NOT EXISTS entries (hash TEXT, kind TEXT, rules TEXT, '
+                   'version TEXT, value TEXT, PRIMARY KEY (hash, kind))')
+        db.execute('DELETE FROM entries WHERE rules != ?', (rulesVersion,))
+        db.commit()
+    return {'db': db,
+            'filename': filename,
+            'rulesVersion': rulesVersion,
+            'solverVersion': getSolverVersion(SOLVER_FUNCTIONS), # the version of the solutions
+            'deadSquaresVersion': getSolverVersion(DEADSQUARE_FUNCTIONS), # and of the dead square tables
+            'pending': 0, # puts not committed yet
+            'hits': 0,
+            'misses': 0}
+
+
+def closeCache(cacheObj):
+    """Commits the pending entries and closes the cache file."""
+    cacheObj['db'].commit()
+    cacheObj['db'].close()
+
+
+def cacheGet(cacheObj, levelHash, kind, version=''):
+    """Returns the value stored for the level hash and kind by the code
+    version (a string, see getCodeVersion()), or None."""
+    row = cacheObj['db'].execute('SELECT value FROM entries WHERE hash = ? AND kind = ? AND rules = ? AND version = ?',
+                                 (levelHash, kind, cacheObj['rulesVersion'], version)).fetchone()
+    if row is None:
+        cacheObj['misses'] += 1
+        return None
+    cacheObj['hits'] += 1
+    return json.loads(row[0])
+
+
+def cachePut(cacheObj, levelHash, kind, value, version=''):
+    """Stores the value (anything that can be saved as JSON) for the level
+    hash and kind. It is written to the file every COMMIT_EVERY puts, and
+    by closeCache()."""
+    cacheObj['db'].execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                           (levelHash, kind, cacheObj['rulesVersion'], version, json.dumps(value)))
+    cacheObj['pending'] += 1
+    if cacheObj['pending'] >= COMMIT_EVERY:
+        cacheObj['db'].commit()
+        cacheObj['pending'] = 0
+
+
+def getLevelHash(levelObj):
+    """Returns the hash the level's entries are keyed by."""
+    return levelhash.getLevelHash(levelObj, symmetric=False)
+
+
+def getSolution(cacheObj, levelObj, weight=1.0, maxStates=None):
+    """Returns the same as starsolver.solve(), from the cache if it can.
+    A cached solution is played again before it is returned, so a wrong
+    entry is never used."""
+    rules = starsolver.makeRules(levelObj)
+    startState = starsolver.getStartState(levelObj)
+    levelHash = getLevelHash(levelObj)
+    kind = 'solution:%s:%s' % (weight, maxStates)
+    cached = cacheGet(cacheObj, levelHash, kind, cacheObj['solverVersion'])
+    if cached is not None:
+        solution = cached['solution']
+        if solution is None or starsolver.isSolved(rules, starsolver.playActions(rules, startState, solution)[-1]):
+            return solution
+
+    solution = starsolver.search(rules, startState, weight, maxStates)['solution']
+    cachePut(cacheObj, levelHash, kind, {'solution': solution}, cacheObj['solverVersion'])
+    return solution
+
+
+def getDeadSquares(cacheObj, levelObj, rules=None):
+    """Returns the same as starsolver.getDeadSquares(), from the cache if it
+    can. The squares are stored relative to the player's start, which
+    doesn't depend on the margins around the level."""
+    startx, starty = levelObj['startState']['player']
+    levelHash = getLevelHash(levelObj)
+    cached = cacheGet(cacheObj, levelHash, 'deadsquares', cacheObj['deadSquaresVersion'])
+    if cached is not None:
+        return set((startx + x, starty + y) for x, y in cached)
+
+    if rules is None:
+        rules = starsolver.makeRules(levelObj)
+    deadSquares = starsolver.getDeadSquares(rules)
+    cachePut(cacheObj, levelHash, 'deadsquares', sorted((x - startx, y - starty) for x, y in deadSquares),
+             cacheObj['deadSquaresVersion'])
+    return deadSquares
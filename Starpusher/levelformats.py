@@ -0,0 +1,402 @@
+# Star Pusher level collections
+# Reads and writes the level collection formats of other Sokoban programs,
+# so that their levels can be played and analyzed here, and ours there:
+#   .txt          the game's own format (see readLevelsFile())
+#   .xsb          the common text format: the maps, with "Title:" and
+#                 "Author:" lines or ; comments around them
+#   .sok          the same, with a legend at the top of the file and,
+#                 optionally, run length encoded rows ("3#" is "###", "|"
+#                 starts a new row)
+#   .slc (.xml)   SokobanLevels XML, as made by Sokoban YASC and others:
+#                 <LevelCollection><Level Id=".."><L>row</L>...
+# The game's readLevelsFile() reads all of them, picking the format by the
+# file's extension.
+#
+# Usage (converts a collection, the formats come from the extensions):
+#   python levelformats.py IN OUT [--extensions keep|plain|skip]
+#                          [--letters extensions|sokoban] [--rle]
+# or (writes a level file to every format and back, and checks that the
+# maps didn't change):
+#   python levelformats.py --check [IN]
+#
+# Files are read and written a level at a time, so big collections never
+# are all in memory; the XML is read with iterparse(), and every level is
+# thrown away once it has been handed over.
+#
+# The doors and buttons of this game (d door, b button, p player on a
+# button, s star on a button) aren't in the other formats. --extensions
+# says what is written for them in the .xsb, .sok and .slc files:
+#   keep    (default) the letters as they are: this game reads them back,
+#           other programs may not
+#   plain   the nearest standard characters: d and b are floor, p is @ and
+#           s is $ (the doors are open all the time, so the level can get
+#           easier, but it stays solvable)
+#   skip    the levels with doors or buttons are left out
+# When reading, p, b and s are this game's letters too, unless --letters
+# sokoban is given: then, as in some other programs, p is the player
+# (P on a goal) and b is a box (B on a goal).
+#
+# The map rows are kept as they are, with two exceptions: - and _ are read
+# as floor (a space), and the spaces at the end of a row are dropped (the
+# game makes every row as wide as the widest one). A row with no wall in
+# it (only floor, as below some maps of this game) is written with - for
+# its spaces, so it isn't taken for a blank line, and is read as part of
+# the map when it comes right after a map row. Non-breaking spaces (which
+# the game draws differently from spaces) are kept.
+
+import argparse, os, re, shutil, sys, tempfile
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, quoteattr
+
+FORMATS = {'.txt': 'txt', '.xsb': 'xsb', '.sok': 'sok', '.slc': 'slc', '.xml': 'slc'}
+MAPCHARS = frozenset(' #x@+$*.dbps-_pPbB\xa0') # characters a map row can have
+FLOORCHARS = ('-', '_') # floor in the other formats (a space here)
+BLANKCHARS = frozenset(' -_\xa0') # characters of a map row with no wall in it
+DEFAULT_CHECK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'starPusherLevels.txt')
+EXTENSIONCHARS = ('d', 'b', 'p', 's')
+PLAINCHARS = {'d': ' ', 'b': ' ', 'p': '@', 's': '$'} # --extensions plain
+SOKOBANLETTERS = {'p': '@', 'P': '+', 'b': '$', 'B': '*'} # --letters sokoban
+RLE_RE = re.compile(r'(\d+)(.)')
+PROPERTY_RE = re.compile(r'^([A-Za-z][A-Za-z -]*):\s*(.*)$')
+SOK_LEGEND = ['::   Legend:               ::',
+              '::   # - wall              ::',
+              '::   @ - player            ::',
+              '::   + - player on goal    ::',
+              '::   $ - box               ::',
+              '::   * - box on goal       ::',
+              '::   . - goal              ::',
+              '::   - - floor             ::',
+              '::   d - door (Star Pusher)  b - button, p - player on button, s - box on button ::']
+
+
+def getFormat(filename):
+    """Returns the format of the file ('txt', 'xsb', 'sok' or 'slc'),
+    from its extension ('txt' if it isn't known)."""
+    return FORMATS.get(os.path.splitext(filename)[1].lower(), 'txt')
+
+
+def makeLevel(rows, title=None, author=None, comments=()):
+    """Returns a level record: the map rows (strings, in this game's
+    characters) and the text that goes with them."""
+    return {'rows': rows,
+            'title': title,
+            'author': author,
+            'comments': list(comments)}
+
+
+def decodeRow(line, letters, inMap=False):
+    """Returns the list of map rows in a line of a text collection (more
+    than one if it is run length encoded with "|"), or None if the line
+    isn't part of a map. inMap is True if the line comes right after a map
+    row: then a row of floor only is part of the map too."""
+    if any(c.isdigit() for c in line):
+        line = RLE_RE.sub(lambda match: match.group(2) * int(match.group(1)), line)
+    rows = line.split('|')
+    for row in rows:
+        if not set(row) <= MAPCHARS:
+            return None
+    if not any('#' in row for row in rows) and not (inMap and line and set(line) <= BLANKCHARS | set('|')):
+        return None # a line of text, like "bbb" or "-"
+    for i in range(len(rows)):
+        row = rows[i]
+        for c in FLOORCHARS:
+            row = row.replace(c, ' ')
+        if letters == 'sokoban':
+            row = ''.join(SOKOBANLETTERS.get(c, c) for c in row)
+        rows[i] = row.replace('P', '+').replace('B', '*')
+    return rows
+
+
+def readTextLevels(textFile, letters='extensions', gameRows=False):
+    """Yields the level records of an open .txt, .xsb or .sok file. With
+    gameRows, the map rows are found like the game's parseLevels() does
+    (every line that isn't empty without its ; comment, as it is).
+
+    The lines after a map, up to the first blank line, belong to it (the
+    "Title:" lines of .sok files); the other lines, from the last blank
+    line on, belong to the next map (the ; comments of .txt and .xsb
+    files). A level's title is its "Title:" property, or else the last
+    line of text before its map."""
+    pending = [] # text lines for the next level
+    level = None # the level whose map (or the text right after it) is being read
+    inComment = False
+    for line in textFile:
+        line = line.rstrip('\r\n')
+        if gameRows:
+            text = line[:line.find(';')] if ';' in line else line
+            rows = [text] if text != '' else None
+        elif line.startswith(';') or inComment:
+            rows = None
+        else:
+            rows = decodeRow(line.rstrip(' \t'), letters, level is not None and not level['afterMap'])
+        if rows is not None:
+            if level is not None and level['afterMap']:
+                yield finishLevel(level)
+                level = None
+            if level is None:
+                level = {'rows': [], 'before': pending, 'after': [], 'afterMap': False}
+                pending = []
+            level['rows'].extend(rows)
+            continue
+        if level is not None and gameRows:
+            # The game ends a level at the first line that isn't a row.
+            yield finishLevel(level)
+            level = None
+        if level is not None and not level['afterMap']:
+            level['afterMap'] = True
+        if line.strip() == '' and not inComment:
+            if level is not None:
+                yield finishLevel(level)
+                level = None
+            elif pending and pending[-1] != '':
+                pending.append('') # only the text after it is the next level's
+            continue
+        # Comment: ... Comment-End: blocks may have blank lines in them.
+        lowered = line.strip().lower()
+        if lowered == 'comment:':
+            inComment = True
+        elif lowered in ('comment-end:', 'comment_end:'):
+            inComment = False
+        if level is not None:
+            level['after'].append(line)
+        else:
+            pending.append(line)
+    if level is not None:
+        yield finishLevel(level)
+
+
+def finishLevel(level):
+    """Returns the level record of a level read by readTextLevels()."""
+    title = author = None
+    comments = []
+    lastText = None
+    before = level['before']
+    while before and before[-1] == '':
+        before = before[:-1]
+    if '' in before:
+        before = before[len(before) - before[::-1].index(''):] # the text before it isn't this level's
+    level['before'] = before
+    for line in before + level['after']:
+        text = line.lstrip(';').strip()
+        match = PROPERTY_RE.match(text)
+        if match and match.group(1).lower() == 'title':
+            title = match.group(2)
+        elif match and match.group(1).lower() == 'author':
+            author = match.group(2)
+        elif text.lower() not in ('comment:', 'comment-end:', 'comment_end:'):
+            comments.append(text)
+        if line in level['before'] and text:
+            lastText = text
+    if title is None and lastText is not None and not PROPERTY_RE.match(lastText):
+        title = lastText
+        comments.remove(lastText)
+    while comments and comments[-1] == '':
+        comments.pop()
+    return makeLevel(level['rows'], title, author, comments)
+
+
+def readSlcLevels(filename, letters='extensions'):
+    """Yields the level records of an .slc (XML) file. The XML is parsed a
+    piece at a time, and each <Level> element is thrown away once its
+    record is made, so only one level is in memory."""
+    elements = [] # the open elements, outermost first
+    collectionAuthor = None
+    for event, element in ElementTree.iterparse(filename, events=('start', 'end')):
+        tag = element.tag.rsplit('}', 1)[-1] # without the XML namespace
+        if event == 'start':
+            elements.append(element)
+            if tag == 'LevelCollection':
+                collectionAuthor = element.get('Copyright')
+            continue
+        elements.pop()
+        if tag != 'Level':
+            continue
+        rows = []
+        for child in element:
+            if child.tag.rsplit('}', 1)[-1] == 'L':
+                rows.extend(decodeRow(child.text or '', letters, True) or [(child.text or '').replace('-', ' ')])
+        author = element.get('Copyright') or collectionAuthor
+        yield makeLevel(rows, element.get('Id'), author)
+        element.clear()
+        if elements:
+            elements[-1].remove(element)
+
+
+def readCollection(filename, letters='extensions'):
+    """Yields the level records of a collection file of any format."""
+    if getFormat(filename) == 'slc':
+        for level in readSlcLevels(filename, letters):
+            yield level
+        return
+    with open(filename, encoding='utf-8', errors='replace') as textFile:
+        for level in readTextLevels(textFile, letters, getFormat(filename) == 'txt'):
+            yield level
+
+
+def getLevelLines(filename, letters='extensions'):
+    """Returns the lines of a collection file of any format, in the format
+    of this game's level files (for the game's parseLevels())."""
+    lines = []
+    for level in readCollection(filename, letters):
+        lines.extend(getTextLines(level, 'txt'))
+    return lines
+
+
+def hasExtensions(level):
+    """Returns True if the level has doors or buttons."""
+    return any(c in row for row in level['rows'] for c in EXTENSIONCHARS)
+
+
+def getRows(level, extensions):
+    """Returns the level's rows for a standard format, with the doors and
+    buttons written as --extensions says."""
+    if extensions != 'plain':
+        return level['rows']
+    return [''.join(PLAINCHARS.get(c, c) for c in row) for row in level['rows']]
+
+
+def getBlankRow(row):
+    """Returns the row as it is written to the other formats: without its
+    spaces at the end, or with - for its spaces if it has no wall."""
+    if '#' not in row:
+        return row.replace(' ', '-')
+    return row.rstrip(' ')
+
+
+def encodeRow(row):
+    """Returns the row run length encoded, with - for floor."""
+    row = getBlankRow(row).replace(' ', '-')
+    return re.sub(r'(.)\1+', lambda match: '%s%s' % (len(match.group(0)), match.group(1)), row)
+
+
+def getTextLines(level, fmt, extensions='keep', rle=False):
+    """Returns the lines (with line endings) of a level in a text format."""
+    lines = []
+    if fmt == 'txt':
+        # The game's format: the text as ; comments before the map.
+        if level['title'] is not None:
+            lines.append('; %s\n' % (level['title']))
+        if level['author'] is not None:
+            lines.append('; Author: %s\n' % (level['author']))
+        for comment in level['comments']:
+            lines.append('; %s\n' % (comment) if comment else ';\n')
+        lines.append('\n')
+        lines.extend('%s\n' % (row) for row in level['rows'])
+    else:
+        # The map first, then its properties.
+        rows = getRows(level, extensions)
+        if rle:
+            lines.extend('%s\n' % (encodeRow(row)) for row in rows)
+        else:
+            lines.extend('%s\n' % (getBlankRow(row).replace(' ', '-') if fmt == 'sok' else getBlankRow(row)) for row in rows)
+        if level['title'] is not None:
+            lines.append('Title: %s\n' % (level['title']))
+        if level['author'] is not None:
+            lines.append('Author: %s\n' % (level['author']))
+        if level['comments']:
+            lines.append('Comment:\n')
+            lines.extend('%s\n' % (comment) for comment in level['comments'])
+            lines.append('Comment-End:\n')
+    lines.append('\n')
+    return lines
+
+
+def writeCollection(levels, filename, extensions='keep', rle=False, title=None):
+    """Writes the level records to a collection file, in the format of its
+    extension. Returns (levels written, levels skipped)."""
+    fmt = getFormat(filename)
+    written = skipped = 0
+    with open(filename, 'w', encoding='utf-8') as outFile:
+        if fmt == 'slc':
+            outFile.write('<?xml version="1.0" encoding="utf-8"?>\n')
+            outFile.write('<SokobanLevels xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">\n')
+            outFile.write('  <Title>%s</Title>\n' % (escape(title or 'Star Pusher levels')))
+            outFile.write('  <Description></Description>\n')
+            outFile.write('  <LevelCollection>\n')
+        elif fmt == 'sok':
+            outFile.writelines('%s\n' % (line) for line in SOK_LEGEND)
+            outFile.write('\n')
+        for level in levels:
+            if fmt != 'txt' and extensions == 'skip' and hasExtensions(level):
+                skipped += 1
+                continue
+            written += 1
+            if fmt == 'slc':
+                rows = getRows(level, extensions)
+                attributes = 'Id=%s Width="%s" Height="%s"' % (quoteattr(level['title'] or str(written)),
+                                                                max(len(row) for row in rows), len(rows))
+                if level['author'] is not None:
+                    attributes += ' Copyright=%s' % (quoteattr(level['author']))
+                outFile.write('    <Level %s>\n' % (attributes))
+                outFile.writelines('      <L>%s</L>\n' % (escape(getBlankRow(row))) for row in rows)
+                outFile.write('    </Level>\n')
+            else:
+                outFile.writelines(getTextLines(level, fmt, extensions, rle))
+        if fmt == 'slc':
+            outFile.write('  </LevelCollection>\n')
+            outFile.write('</SokobanLevels>\n')
+    return written, skipped
+
+
+def getMapRows(level):
+    """Returns the level's rows as the game makes its map: all as wide
+    as the widest one."""
+    width = max(len(row) for row in level['rows'])
+    return [row.ljust(width) for row in level['rows']]
+
+
+def checkRoundTrip(filename):
+    """Writes the collection to every format (with and without run length
+    encoding) and reads it back. Returns the list of (format, rle, level
+    number) of the levels whose map changed, or that were lost."""
+    original = [getMapRows(level) for level in readCollection(filename)]
+    tempDir = tempfile.mkdtemp()
+    differences = []
+    try:
+        for fmt, rle in (('xsb', False), ('xsb', True), ('sok', False), ('sok', True), ('slc', False)):
+            converted = os.path.join(tempDir, 'levels.' + fmt)
+            back = os.path.join(tempDir, 'levels.txt')
+            writeCollection(readCollection(filename), converted, rle=rle)
+            writeCollection(readCollection(converted), back)
+            levels = [getMapRows(level) for level in readCollection(back)]
+            for i in range(len(original)):
+                if i >= len(levels) or levels[i] != original[i]:
+                    differences.append((fmt, rle, i + 1))
+    finally:
+        shutil.rmtree(tempDir)
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Converts Sokoban level collections (.txt, .xsb, .sok, .slc) for Star Pusher.')
+    parser.add_argument('infile', nargs='?', default=None)
+    parser.add_argument('outfile', nargs='?', default=None)
+    parser.add_argument('--extensions', choices=('keep', 'plain', 'skip'), default='keep', help='how doors and buttons are written to the other formats')
+    parser.add_argument('--letters', choices=('extensions', 'sokoban'), default='extensions', help='what p, b (and P, B) mean in the file read')
+    parser.add_argument('--rle', action='store_true', help='run length encode the rows (.xsb and .sok)')
+    parser.add_argument('--title', default=None, help='title of the collection (.slc)')
+    parser.add_argument('--check', action='store_true', help='convert IN (default: starPusherLevels.txt) to every format and back, and check the maps')
+    args = parser.parse_args()
+
+    if args.check:
+        infile = args.infile or DEFAULT_CHECK_FILE
+        differences = checkRoundTrip(infile)
+        for fmt, rle, levelNum in differences:
+            print('Level %s changed going through .%s%s' % (levelNum, fmt, ' (run length encoded)' if rle else ''))
+        print('Checked %s: %s' % (infile, '%s differences' % (len(differences)) if differences else 'every map comes back the same'))
+        return 1 if differences else 0
+    if args.outfile is None:
+        parser.error('give IN and OUT, or --check')
+
+    levels = readCollection(args.infile, args.letters)
+    try:
+        written, skipped = writeCollection(levels, args.outfile, args.extensions, args.rle, args.title)
+    except ElementTree.ParseError as error:
+        print('%s is not a valid .slc file: %s' % (args.infile, error), file=sys.stderr)
+        return 1
+    print('Wrote %s levels to %s%s' % (written, args.outfile, ', skipped %s with doors or buttons' % (skipped) if skipped else ''))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
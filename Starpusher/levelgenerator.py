@@ -0,0 +1,291 @@
+# Star Pusher level generator
+# Makes new levels in the starPusherLevels.txt format, with doors and
+# buttons, that are checked to be solvable with the game's own rules.
+#
+# Usage:
+#   python levelgenerator.py [-n 1000] [-o generated.txt] [--processes N]
+#                            [--min-actions 15] [--max-actions 60] [--stars 3]
+#
+# How a level is made:
+#   1. A random room is carved, and maybe split in two by a door with a
+#      button somewhere.
+#   2. The stars start on the goals, then the game is played backwards:
+#      the player walks to random stars, grabs them and pulls them off the
+#      goals, with the game's makeMove(), makeTurn() and makeGrab().
+#   3. The solver checks the result from its real start state. Only levels
+#      that are solvable, and whose solution (as found by the solver's
+#      weighted best first search, so often longer than the shortest) is
+#      within the difficulty target, are kept.
+# Levels are generated in parallel on all the cores, and duplicates
+# (including rotated and mirrored copies) are thrown away.
+
+import argparse, copy, multiprocessing, os, random, sys, time
+
+import gameloader, levelhash, starsolver
+
+game = gameloader.loadGame()
+
+DEFAULT_MIN_ACTIONS = 15 # difficulty target: length of the solution
+DEFAULT_MAX_ACTIONS = 60
+SCRAMBLES = 5 # scrambles tried per room
+VALIDATE_WEIGHT = 3.0 # heuristic weight of the solver's best first search
+VALIDATE_MAX_STATES = 5000 # states the solver may explore per level
+MAX_TRIES = 50 # rooms tried per level before giving up
+
+
+def makeRoom(rand, width, height):
+    """Returns a grid (a list of rows, each a list of characters) with a
+    wall all around and some random walls inside. All the floor spaces
+    are connected."""
+    grid = [['#'] * width for y in range(height)]
+    for y in range(1, height - 1):
+        for x in range(1, width - 1):
+            if rand.random() > 0.18:
+                grid[y][x] = ' '
+
+    floors = [(x, y) for y in range(height) for x in range(width) if grid[y][x] == ' ']
+    if not floors:
+        return grid
+
+    # Keep only the biggest connected area of floor.
+    seen = set()
+    biggest = set()
+    for start in floors:
+        if start in seen:
+            continue
+        area = set([start])
+        toVisit = [start]
+        while toVisit:
+            x, y = toVisit.pop()
+            for xOffset, yOffset in starsolver.OFFSETS:
+                neighbour = (x + xOffset, y + yOffset)
+                if grid[neighbour[1]][neighbour[0]] == ' ' and neighbour not in area:
+                    area.add(neighbour)
+                    toVisit.append(neighbour)
+        seen |= area
+        if len(area) > len(biggest):
+            biggest = area
+    for x, y in floors:
+        if (x, y) not in biggest:
+            grid[y][x] = '#'
+    return grid
+
+
+def isChokepoint(grid, cell):
+    """Returns True if turning cell into a wall would split the floor in
+    two or more parts."""
+    x, y = cell
+    grid[y][x] = '#'
+    floors = [(fx, fy) for fy in range(len(grid)) for fx in range(len(grid[0])) if grid[fy][fx] != '#']
+    area = set(floors[:1])
+    toVisit = list(area)
+    while toVisit:
+        fx, fy = toVisit.pop()
+        for xOffset, yOffset in starsolver.OFFSETS:
+            neighbour = (fx + xOffset, fy + yOffset)
+            if grid[neighbour[1]][neighbour[0]] != '#' and neighbour not in area:
+                area.add(neighbour)
+                toVisit.append(neighbour)
+    grid[y][x] = ' '
+    return len(area) != len(floors)
+
+
+def gridToText(grid):
+    return '\n'.join(''.join(row).rstrip() for row in grid)
+
+
+def makeLevelText(grid, goals, stars, player, door, button):
+    """Returns the level text of the grid with the pieces on it."""
+    grid = [row[:] for row in grid]
+    for x, y in goals:
+        grid[y][x] = '.'
+    for x, y in stars:
+        grid[y][x] = '*' if grid[y][x] == '.' else '$'
+    if door is not None:
+        grid[door[1]][door[0]] = 'd'
+    if button is not None:
+        x, y = button
+        grid[y][x] = 's' if grid[y][x] == '$' else 'b'
+    x, y = player
+    grid[y][x] = {'.': '+', 'b': 'p'}.get(grid[y][x], '@')
+    return gridToText(grid)
+
+
+def getWalkableSpaces(mapObj, gameStateObj):
+    """Returns the set of spaces the player can walk to without moving
+    any star (stars and closed doors are in the way)."""
+    walkable = set([gameStateObj['player']])
+    toVisit = [gameStateObj['player']]
+    while toVisit:
+        x, y = toVisit.pop()
+        for xOffset, yOffset in starsolver.OFFSETS:
+            neighbour = (x + xOffset, y + yOffset)
+            if neighbour not in walkable and not game.isBlocked(mapObj, gameStateObj, neighbour[0], neighbour[1]):
+                walkable.add(neighbour)
+                toVisit.append(neighbour)
+    return walkable
+
+
+def pullStar(rand, mapObj, gameStateObj):
+    """Plays one step of the game backwards: the player walks to a random
+    star, grabs it and pulls it a few spaces (sometimes turning with it),
+    then lets go. Every action goes through the game's rules."""
+    walkable = getWalkableSpaces(mapObj, gameStateObj)
+    star = rand.choice(gameStateObj['stars'])
+    sides = [i for i in range(4) if (star[0] - starsolver.OFFSETS[i][0], star[1] - starsolver.OFFSETS[i][1]) in walkable]
+    if not sides:
+        return
+    # Walking there doesn't move anything, so just put the player there,
+    # facing the star (turning without a star always works).
+    direction = rand.choice(sides)
+    gameStateObj['player'] = (star[0] - starsolver.OFFSETS[direction][0], star[1] - starsolver.OFFSETS[direction][1])
+    gameStateObj['playerdirection'] = direction
+    game.makeGrab(mapObj, gameStateObj)
+
+    for step in range(rand.randint(1, 8)):
+        if rand.random() < 0.2:
+            action = rand.choice(('turnleft', 'turnright'))
+        else:
+            action = starsolver.MOVEACTIONS[(gameStateObj['playerdirection'] + 2) % 4] # walk backwards
+        if not starsolver.applyAction(mapObj, gameStateObj, action):
+            break
+    game.makeGrab(mapObj, gameStateObj) # let go: the grabbed star is always in front
+
+
+def scramble(rand, levelObj, numPulls):
+    """Starts from the level's start (where all the stars are on the
+    goals), pulls stars around numPulls times, then puts the player on a
+    random space it can walk to. Returns the game state object."""
+    mapObj = levelObj['mapObj']
+    gameStateObj = copy.deepcopy(levelObj['startState'])
+    for i in range(numPulls):
+        pullStar(rand, mapObj, gameStateObj)
+    gameStateObj['player'] = rand.choice(sorted(getWalkableSpaces(mapObj, gameStateObj)))
+    return gameStateObj
+
+
+def generateLevel(seed, numStars=3, minActions=DEFAULT_MIN_ACTIONS, maxActions=DEFAULT_MAX_ACTIONS, doors=True):
+    """Tries to make a level from the random seed. Returns (levelText,
+    solution length) or None if no level within the difficulty target
+    was found."""
+    rand = random.Random(seed)
+    for tryNum in range(MAX_TRIES):
+        grid = makeRoom(rand, rand.randint(6, 10), rand.randint(6, 9))
+        floors = [(x, y) for y in range(len(grid)) for x in range(len(grid[0])) if grid[y][x] == ' ']
+        if len(floors) < numStars * 2 + 4:
+            continue
+        rand.shuffle(floors)
+
+        door = button = None
+        if doors and rand.random() < 0.5:
+            # A door on a space that splits the room, and a button.
+            for cell in floors[:10]:
+                if isChokepoint(grid, cell):
+                    door = cell
+                    break
+            if door is not None:
+                floors.remove(door)
+                button = floors.pop()
+        goals = floors[:numStars]
+        player = floors[numStars]
+
+        # Play backwards from the solved position.
+        text = makeLevelText(grid, goals, goals, player, door, button)
+        solvedLevel = game.parseLevels(text.splitlines(True), '<generated>')[0]
+        # Scrambling is cheap and the solver isn't, so only the scramble
+        # that took the stars the furthest from the goals is checked.
+        rules = starsolver.makeRules(solvedLevel)
+        scrambles = [scramble(rand, solvedLevel, rand.randint(numStars * 2, numStars * 4)) for i in range(SCRAMBLES)]
+        gameStateObj = max(scrambles, key=lambda scrambled: starsolver.getHeuristic(rules, starsolver.fromGameState(scrambled)))
+        stars = gameStateObj['stars']
+        if sorted(stars) == sorted(goals) or door in stars or gameStateObj['player'] == door:
+            continue # nothing moved, or something ended on the door (no character for that)
+
+        text = makeLevelText(grid, goals, stars, gameStateObj['player'], door, button)
+        levelObj = game.parseLevels(text.splitlines(True), '<generated>')[0]
+
+        # Check that it is solvable from its real start state, and how hard.
+        rules = starsolver.makeRules(levelObj)
+        result = starsolver.search(rules, starsolver.getStartState(levelObj), VALIDATE_WEIGHT, VALIDATE_MAX_STATES)
+        if result['solution'] is None:
+            continue
+        if minActions <= len(result['solution']) <= maxActions:
+            return text, len(result['solution'])
+    return None
+
+
+def generateTask(task):
+    """Worker function for generateLevels()."""
+    seed, numStars, minActions, maxActions = task
+    return generateLevel(seed, numStars, minActions, maxActions)
+
+
+def generateLevels(count, numStars=3, minActions=DEFAULT_MIN_ACTIONS, maxActions=DEFAULT_MAX_ACTIONS,
+                   processes=None, seed=None, knownHashes=None):
+    """Yields (levelText, solution length) for count different
+    levels, generated in parallel. Levels whose canonical hash is in
+    knownHashes (a set of levelhash.py hashes, updated as levels are
+    made) are skipped."""
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    if knownHashes is None:
+        knownHashes = set()
+    processes = processes or os.cpu_count() or 1
+
+    def tasks():
+        taskNum = 0
+        while True:
+            yield ('%s-%s' % (seed, taskNum), numStars, minActions, maxActions)
+            taskNum += 1
+
+    made = 0
+    with multiprocessing.Pool(processes) as pool:
+        for result in pool.imap_unordered(generateTask, tasks(), 4):
+            if result is None:
+                continue
+            canonicalHash = levelhash.getTextHash(result[0])
+            if canonicalHash in knownHashes:
+                continue
+            knownHashes.add(canonicalHash)
+            yield result
+            made += 1
+            if made >= count:
+                pool.terminate()
+                return
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generates solvable Star Pusher levels.')
+    parser.add_argument('-n', '--count', type=int, default=100, help='number of levels to make')
+    parser.add_argument('-o', '--output', default='-', help='level file to write (default: the screen)')
+    parser.add_argument('--stars', type=int, default=3, help='stars (and goals) per level')
+    parser.add_argument('--min-actions', type=int, default=DEFAULT_MIN_ACTIONS, help='the solution must be at least this long')
+    parser.add_argument('--max-actions', type=int, default=DEFAULT_MAX_ACTIONS, help='the solution must be at most this long')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--pack', default=None, help='level file whose levels must not be made again')
+    args = parser.parse_args()
+
+    knownHashes = set()
+    if args.pack:
+        with open(args.pack) as packFile:
+            for lineNum, commentLines, mapLines in levelhash.readLevelBlocks(packFile):
+                knownHashes.add(levelhash.hashBlock((mapLines, args.pack, 0, True))[0])
+
+    startTime = time.time()
+    outFile = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        outFile.write('; Generated by levelgenerator.py\n\n')
+        levelNum = 0
+        for text, numActions in generateLevels(args.count, args.stars, args.min_actions, args.max_actions,
+                                               args.processes, args.seed, knownHashes):
+            levelNum += 1
+            outFile.write('; %s (solved in %s actions)\n\n%s\n\n' % (levelNum, numActions, text))
+    finally:
+        if outFile is not sys.stdout:
+            outFile.close()
+    print('Made %s levels in %.1f s' % (args.count, time.time() - startTime), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
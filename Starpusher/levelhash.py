@@ -0,0 +1,244 @@
+# Star Pusher level hashing
+# Gives every level a canonical form and a content hash, and finds the
+# duplicate levels in level packs.
+#
+# Usage:
+#   python levelhash.py pack.txt [more packs...] [-o unique.txt]
+#                       [--index levels.idx] [--processes N] [--no-symmetry]
+#
+# Two levels get the same hash when they are the same puzzle:
+#   - rotated or mirrored copies (the 8 symmetries of the grid),
+#   - different decoration outside the walls, or extra wall pieces and
+#     spaces that don't touch the inside of the level,
+#   - different trailing spaces, blank margins, or 'x' instead of '#'.
+# The hash only depends on the level's map and start state (as read by the
+# game's parseLevels()), never on the comments or the file it came from,
+# so it can be used to key caches of solver results and metrics.
+#
+# The index file remembers the hash of every level seen, one
+# "hash<TAB>file:level" line per level, so later packs can be checked
+# against all the earlier ones without reading them again.
+
+import argparse, hashlib, itertools, multiprocessing, os, sys, time
+
+import gameloader
+
+game = gameloader.loadGame()
+
+HASH_VERSION = 'starpusher-level-1' # change when the canonical form changes
+WALLCHARS = ('#', 'x')
+OBJECTCHARS = ('.', '$', '*', '@', '+', 'd', 'b', 'p', 's') # everything else is floor
+BATCH_LEVELS = 4096 # levels read from a file at a time
+NEIGHBOURS = ((0, -1), (-1, 0), (0, 1), (1, 0), (-1, -1), (1, -1), (-1, 1), (1, 1))
+
+
+def getInsideCells(mapObj, startxy):
+    """Returns the set of (x, y) spaces that aren't walls and are
+    connected to startxy (the player's start)."""
+    inside = set([startxy])
+    toVisit = [startxy]
+    while toVisit:
+        x, y = toVisit.pop()
+        for xOffset, yOffset in NEIGHBOURS[:4]:
+            nx, ny = x + xOffset, y + yOffset
+            if 0 <= nx < len(mapObj) and 0 <= ny < len(mapObj[nx]) and \
+               (nx, ny) not in inside and mapObj[nx][ny] not in WALLCHARS:
+                inside.add((nx, ny))
+                toVisit.append((nx, ny))
+    return inside
+
+
+def getCanonicalRows(levelObj):
+    """Returns the level's map as a list of row strings, with everything
+    that doesn't change the puzzle taken out: only the walls that touch
+    the inside (diagonally too) are kept, all of them as '#', floor and
+    decoration become ' ', and the blank margins are cut off."""
+    mapObj = levelObj['mapObj']
+    inside = getInsideCells(mapObj, levelObj['startState']['player'])
+    width = len(mapObj)
+    height = len(mapObj[0]) if width else 0
+
+    grid = [[' '] * width for y in range(height)]
+    for x in range(width):
+        for y in range(height):
+            char = mapObj[x][y]
+            if char in OBJECTCHARS:
+                grid[y][x] = char # also kept when out of reach: it changes the puzzle
+            elif char in WALLCHARS:
+                for xOffset, yOffset in NEIGHBOURS:
+                    if (x + xOffset, y + yOffset) in inside:
+                        grid[y][x] = '#'
+                        break
+
+    rows = [''.join(row).rstrip() for row in grid]
+    while rows and rows[-1] == '':
+        del rows[-1]
+    while rows and rows[0] == '':
+        del rows[0]
+    if not rows:
+        return rows
+    left = min(len(row) - len(row.lstrip()) for row in rows if row)
+    return [row[left:] for row in rows]
+
+
+def getSymmetries(rows):
+    """Returns the 8 rotated and mirrored versions of the rows (a list of
+    strings), each as a single string with a line per row."""
+    width = max(len(row) for row in rows) if rows else 0
+    grid = [list(row.ljust(width)) for row in rows]
+    versions = []
+    for mirror in (False, True):
+        current = [row[::-1] for row in grid] if mirror else grid
+        for turn in range(4):
+            versions.append('\n'.join(''.join(row).rstrip() for row in current))
+            current = [list(row) for row in zip(*current[::-1])] # turn 90 degrees
+    return versions
+
+
+def getCanonicalText(levelObj, symmetric=True):
+    """Returns the canonical text of the level: its canonical rows and,
+    if symmetric is True, the first (in sort order) of their 8 rotated and
+    mirrored versions. The player always starts facing down, so that is
+    the one difference between a level and its rotated copies that is
+    ignored."""
+    rows = getCanonicalRows(levelObj)
+    if not symmetric:
+        return '\n'.join(rows)
+    return min(getSymmetries(rows))
+
+
+def getLevelHash(levelObj, symmetric=True):
+    """Returns the hex digest of the level's canonical text."""
+    text = HASH_VERSION + '\n' + getCanonicalText(levelObj, symmetric)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def getTextHash(text, symmetric=True):
+    """Returns the hash of the level written in text (the map lines of a
+    single level, in the level file format)."""
+    return getLevelHash(game.parseLevels(text.splitlines(True), '<text>')[0], symmetric)
+
+
+def readLevelBlocks(levelFile):
+    """Yields (lineNum, commentLines, mapLines) for each level of the open
+    level file, reading it a line at a time. commentLines are the lines
+    between the previous level and this one. Uses the same rules as the
+    game's findLevelBlocks()."""
+    commentLines = []
+    mapLines = []
+    lineNum = 0
+    for lineNum, line in enumerate(levelFile, 1):
+        text = line.rstrip('\r\n')
+        if ';' in text:
+            text = text[:text.find(';')]
+        if text != '':
+            mapLines.append(line)
+        elif mapLines:
+            yield (lineNum - len(mapLines), commentLines, mapLines)
+            commentLines = []
+            mapLines = []
+        else:
+            commentLines.append(line)
+    if mapLines:
+        yield (lineNum - len(mapLines) + 1, commentLines, mapLines)
+
+
+def readIndex(filename):
+    """Returns the dict of hash -> 'file:level' in the index file (empty if
+    the file doesn't exist yet)."""
+    index = {}
+    if os.path.exists(filename):
+        with open(filename) as indexFile:
+            for line in indexFile:
+                levelHash, _, where = line.rstrip('\n').partition('\t')
+                index.setdefault(levelHash, where)
+    return index
+
+
+def hashBlock(task):
+    """Worker function: returns (hash, None) for the level in the block's
+    map lines, or (None, error message) if it can't be parsed."""
+    mapLines, filename, levelNum, symmetric = task
+    try:
+        levelObj = game.parseLevels(mapLines, filename, levelNum)[0]
+    except AssertionError as error:
+        return (None, str(error))
+    return (getLevelHash(levelObj, symmetric), None)
+
+
+def dedupFiles(filenames, outFile=None, index=None, indexFile=None, processes=None, symmetric=True):
+    """Reads the level files in order and writes every level that wasn't
+    seen before (with its comments) to outFile, if given. index is the
+    dict of already known hashes; new ones are added to it and written to
+    indexFile, if given. Returns (levels read, duplicates found)."""
+    if index is None:
+        index = {}
+    processes = processes or os.cpu_count() or 1
+    total = duplicates = 0
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    try:
+        for filename in filenames:
+            with open(filename) as levelFile:
+                levelNum = 0
+                # The file is hashed a batch of levels at a time, so big
+                # files are never all in memory.
+                blocks = readLevelBlocks(levelFile)
+                while True:
+                    batch = list(itertools.islice(blocks, BATCH_LEVELS))
+                    if not batch:
+                        break
+                    tasks = [(batch[i][2], filename, levelNum + i, symmetric) for i in range(len(batch))]
+                    results = pool.imap(hashBlock, tasks, 64) if pool else map(hashBlock, tasks)
+                    for (lineNum, commentLines, mapLines), (levelHash, error) in zip(batch, results):
+                        levelNum += 1
+                        where = '%s:%s' % (filename, levelNum)
+                        if error is not None:
+                            # Not a valid level: keep it, it can't be compared.
+                            print(error, file=sys.stderr)
+                        elif levelHash in index:
+                            duplicates += 1
+                            print('Level %s (line %s) of %s is a duplicate of %s' % (levelNum, lineNum, filename, index[levelHash]), file=sys.stderr)
+                            continue
+                        else:
+                            index[levelHash] = where
+                            if indexFile is not None:
+                                indexFile.write('%s\t%s\n' % (levelHash, where))
+                        if outFile is not None:
+                            outFile.writelines(commentLines)
+                            outFile.writelines(mapLines)
+                            outFile.write('\n')
+                total += levelNum
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return total, duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Finds duplicate Star Pusher levels, including rotated and mirrored copies.')
+    parser.add_argument('levelfiles', nargs='+')
+    parser.add_argument('-o', '--output', default=None, help='level file to write the levels that are not duplicates to')
+    parser.add_argument('--index', default=None, help='hash index file to check against and add the new levels to')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--no-symmetry', action='store_true', help="don't count rotated and mirrored copies as duplicates")
+    args = parser.parse_args()
+
+    startTime = time.time()
+    index = readIndex(args.index) if args.index else {}
+    indexFile = open(args.index, 'a') if args.index else None
+    outFile = None
+    if args.output is not None:
+        outFile = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        total, duplicates = dedupFiles(args.levelfiles, outFile, index, indexFile, args.processes, not args.no_symmetry)
+    finally:
+        if indexFile is not None:
+            indexFile.close()
+        if outFile not in (None, sys.stdout):
+            outFile.close()
+    print('Read %s levels, found %s duplicates in %.1f s' % (total, duplicates, time.time() - startTime), file=sys.stderr)
+    sys.exit(1 if duplicates else 0)
+
+
+if __name__ == '__main__':
+    main()
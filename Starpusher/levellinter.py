@@ -0,0 +1,251 @@
+# Star Pusher level linter
+# Checks every level of level packs for design problems, without
+# searching for a solution, and reports all of them (the game's
+# readLevelsFile() stops at the first level it can't read).
+#
+# Usage:
+#   python levellinter.py pack.txt [more packs...] [--strict] [--processes N]
+#
+# It prints one line per problem, like a compiler:
+#   file:line: level N: error: message [code]
+# and exits with 1 if there are errors (or warnings, with --strict), so it
+# can run as a pre-commit step. For the pre-commit framework, in
+# .pre-commit-config.yaml:
+#   - repo: local
+#     hooks:
+#       - id: star-pusher-levels
+#         name: Star Pusher level linter
+#         entry: python Starpusher/levellinter.py
+#         language: system
+#         files: Levels.*\.txt$
+#
+# The problems (errors make the level unplayable or unsolvable):
+#   no-start, many-starts   not exactly one @, + or p
+#   no-goal, few-stars      the game's own checks
+#   unknown-character (w)   a character the game doesn't know (it is floor)
+#   ragged-row (warning)    a row shorter than the widest one that doesn't
+#                           end with a wall: the game pads it with floor
+#   open-walls              the player can walk off the edge of the map
+#   unreachable-goal        a goal outside the player's region
+#   unreachable-star (w)    a star outside the player's region
+#   outside-walls (w)       a door or button outside the player's region
+#   no-button               doors, but no buttons to open them
+#   doors-never-open        no button can be pressed before a door opens
+#   dead-star (warning)     a star that starts where no goal can be reached
+#   unsolvable              fewer stars than goals can ever reach a goal
+# The player's region is every space the player could walk to with all
+# the doors open. Dead squares are found like starsolver.getDeadSquares().
+#
+# Each level is checked in time linear in its size: the map is one string
+# with a border around it, and the checks are a few scans and flood fills
+# over it. The packs are read a batch of levels at a time, so they are
+# never all in memory.
+
+import argparse, itertools, multiprocessing, os, sys, time
+
+import levelhash
+
+WALLCHARS = ('#', 'x')
+PLAYERCHARS = ('@', '+', 'p')
+STARCHARS = ('$', '*', 's')
+GOALCHARS = ('.', '+', '*')
+BUTTONCHARS = ('b', 'p', 's')
+DOORCHAR = 'd'
+KNOWNCHARS = frozenset(' #x@+p$*s.bd')
+BORDER = '\n' # around the map, can't be in a line
+BATCH_LEVELS = 4096 # levels read from a file at a time
+
+
+def floodFill(grid, start, offsets, passDoors):
+    """Returns (a bytearray with 1 for each space of grid the player can
+    walk to from start, True if the player can walk off the map)."""
+    region = bytearray(len(grid))
+    region[start] = 1
+    toVisit = [start]
+    offMap = False
+    while toVisit:
+        i = toVisit.pop()
+        for offset in offsets:
+            j = i + offset
+            if region[j]:
+                continue
+            c = grid[j]
+            if c == BORDER:
+                offMap = True
+            elif c not in WALLCHARS and (passDoors or c != DOORCHAR):
+                region[j] = 1
+                toVisit.append(j)
+    return region, offMap
+
+
+def getAliveSquares(grid, region, goals, width):
+    """Returns a bytearray with 1 for each space of the region from which a
+    star could reach a goal (see starsolver.getDeadSquares())."""
+    alive = bytearray(len(grid))
+    toVisit = []
+    for goal in goals:
+        if region[goal]:
+            alive[goal] = 1
+            toVisit.append(goal)
+    while toVisit:
+        n = toVisit.pop()
+        for e, f in ((-width, 1), (width, 1), (-1, width), (1, width)):
+            # Could a star at c = n - e get to n? (f is at a right angle to e)
+            c = n - e
+            if not region[c] or alive[c]:
+                continue
+            if region[c - e] or region[n + e] or \
+               (region[c - f] and region[c - f + e]) or (region[c + f] and region[c + f + e]):
+                alive[c] = 1
+                toVisit.append(c)
+    return alive
+
+
+def lintLevel(mapLines):
+    """Returns the list of problems of the level in mapLines (its lines in
+    the level file), as (row, severity, code, message) tuples: row is the
+    line of the map the problem is on (0 for the first)."""
+    rows = []
+    for line in mapLines:
+        line = line.rstrip('\r\n')
+        if ';' in line:
+            line = line[:line.find(';')]
+        rows.append(line)
+    problems = []
+    mapWidth = max(len(row) for row in rows)
+    for y in range(len(rows)):
+        if len(rows[y]) < mapWidth and rows[y][-1] not in WALLCHARS:
+            problems.append((y, 'warning', 'ragged-row', 'row is %s characters long, not %s, and the game pads it with floor' % (len(rows[y]), mapWidth)))
+
+    # The map as one string, with a border all round: the neighbours of
+    # space i are i - 1, i + 1, i - width and i + width.
+    width = mapWidth + 2
+    grid = BORDER * (width + 1) + (BORDER * 2).join(row.ljust(mapWidth) for row in rows) + BORDER * (width + 1)
+    def getXY(i):
+        return '(%s, %s)' % (i % width - 1, i // width - 1)
+    def getRow(i):
+        return i // width - 1
+
+    players = []
+    goals = []
+    stars = []
+    buttons = []
+    doors = []
+    unknown = {}
+    for i, c in enumerate(grid):
+        if c == ' ' or c in WALLCHARS or c == BORDER:
+            continue
+        if c in PLAYERCHARS:
+            players.append(i)
+        if c in GOALCHARS:
+            goals.append(i)
+        if c in STARCHARS:
+            stars.append(i)
+        if c in BUTTONCHARS:
+            buttons.append(i)
+        if c == DOORCHAR:
+            doors.append(i)
+        if c not in KNOWNCHARS and c not in unknown:
+            unknown[c] = i
+    for c, i in unknown.items():
+        problems.append((getRow(i), 'warning', 'unknown-character', 'unknown character %r at %s, the game treats it as floor' % (c, getXY(i))))
+    if not goals:
+        problems.append((0, 'error', 'no-goal', 'there is no goal (. + or *)'))
+    if len(stars) < len(goals):
+        problems.append((0, 'error', 'few-stars', 'there are %s goals but only %s stars' % (len(goals), len(stars))))
+    if not players:
+        problems.append((0, 'error', 'no-start', 'there is no start point (@ + or p)'))
+        problems.sort(key=lambda problem: problem[0])
+        return problems
+    if len(players) > 1:
+        problems.append((getRow(players[1]), 'error', 'many-starts', 'there are %s start points, the game uses the last one' % (len(players))))
+
+    offsets = (-width, -1, width, 1)
+    start = players[-1]
+    region, offMap = floodFill(grid, start, offsets, True)
+    if offMap:
+        problems.append((getRow(start), 'error', 'open-walls', 'the player can walk off the edge of the map: the walls have a gap'))
+    for goal in goals:
+        if not region[goal] and grid[goal] != '*':
+            problems.append((getRow(goal), 'error', 'unreachable-goal', 'the goal at %s is outside the walls' % (getXY(goal))))
+    for star in stars:
+        if not region[star] and grid[star] != '*':
+            problems.append((getRow(star), 'warning', 'unreachable-star', 'the star at %s is outside the walls' % (getXY(star))))
+    for i in doors + buttons:
+        if not region[i]:
+            problems.append((getRow(i), 'warning', 'outside-walls', 'the %s at %s is outside the walls' % ('door' if i in doors else 'button', getXY(i))))
+
+    # The doors open while a button is pressed, by the player or a star.
+    if doors:
+        if not buttons:
+            problems.append((getRow(doors[0]), 'error', 'no-button', 'there are %s doors but no button to open them' % (len(doors))))
+        else:
+            closedRegion = floodFill(grid, start, offsets, False)[0]
+            if not any(closedRegion[i] or grid[i] == 's' for i in buttons):
+                problems.append((getRow(doors[0]), 'error', 'doors-never-open', 'no button can be pressed while the doors are closed'))
+
+    alive = getAliveSquares(grid, region, goals, width)
+    liveStars = 0
+    for star in stars:
+        if alive[star] or (grid[star] == '*' and not region[star]):
+            liveStars += 1
+        elif region[star]:
+            problems.append((getRow(star), 'warning', 'dead-star', 'the star at %s can never reach a goal' % (getXY(star))))
+    if liveStars < len(goals) <= len(stars):
+        problems.append((0, 'error', 'unsolvable', 'only %s of the stars can reach a goal, there are %s goals' % (liveStars, len(goals))))
+    problems.sort(key=lambda problem: problem[0])
+    return problems
+
+
+def lintBlock(mapLines):
+    """Worker function: returns lintLevel() for one level."""
+    return lintLevel(mapLines)
+
+
+def lintFiles(filenames, processes=None, outFile=sys.stdout):
+    """Checks every level of the level files and writes their problems to
+    outFile. Returns (levels, errors, warnings)."""
+    processes = processes or os.cpu_count() or 1
+    total = errors = warnings = 0
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    try:
+        for filename in filenames:
+            with open(filename) as levelFile:
+                levelNum = 0
+                blocks = levelhash.readLevelBlocks(levelFile)
+                while True:
+                    batch = list(itertools.islice(blocks, BATCH_LEVELS))
+                    if not batch:
+                        break
+                    mapLines = [block[2] for block in batch]
+                    results = pool.imap(lintBlock, mapLines, 256) if pool else map(lintBlock, mapLines)
+                    for (lineNum, commentLines, lines), problems in zip(batch, results):
+                        levelNum += 1
+                        for row, severity, code, message in problems:
+                            if severity == 'error':
+                                errors += 1
+                            else:
+                                warnings += 1
+                            outFile.write('%s:%s: level %s: %s: %s [%s]\n' % (filename, lineNum + row, levelNum, severity, message, code))
+                total += levelNum
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return total, errors, warnings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Checks Star Pusher level packs for design problems.')
+    parser.add_argument('levelfiles', nargs='+')
+    parser.add_argument('--strict', action='store_true', help='fail on warnings too')
+    parser.add_argument('--processes', type=int, default=1, help='worker processes (default: 1, 0 for one per core)')
+    args = parser.parse_args()
+
+    startTime = time.time()
+    total, errors, warnings = lintFiles(args.levelfiles, args.processes)
+    print('Checked %s levels in %.1f s: %s errors, %s warnings' % (total, time.time() - startTime, errors, warnings), file=sys.stderr)
+    return 1 if errors or (args.strict and warnings) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
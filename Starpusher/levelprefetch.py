@@ -0,0 +1,217 @@
+# Star Pusher level prefetcher
+# Makes going to the next or previous level (N, B, solving a level) and
+# starting a level again (Backspace) take less than a frame: everything
+# runLevel() needs to start a level is made in advance.
+#
+# A prepared level holds:
+#   * the decorated map (game.getDecoratedMap()),
+#   * the hint engine's lower bound, with the rules (lowerbound.makeBound()),
+#   * the mouse's walk graph (macromoves.makeWalkGraph()),
+#   * a copy of the start state, ready to be played,
+#   * the map chunks that can be seen at the start (with the default
+#     camera), drawn at the start state.
+# None of them is changed while the level is played (runLevel() gets its
+# own chunk cache, with the same chunk surfaces, which are never drawn on
+# again), so the level being played stays prepared for Backspace.
+#
+# The next and the previous level are prepared during the frames where
+# the player does nothing, a little at a time (at most PREFETCH_FRAME_TIME
+# per frame, one chunk or one step at a time). Up to PREFETCH_LEVELS
+# prepared levels are kept, while they take less than PREFETCH_BYTES
+# (counted as the size of their chunks, which is most of it); the least
+# recently used ones are thrown away first, but never the current, next
+# or previous level. A level replaced by the level watcher is prepared
+# again.
+
+import collections, copy, time
+import pygame
+
+import gameloader, gpurenderer, lowerbound, macromoves, starsolver
+
+game = gameloader.loadGame()
+
+PREFETCH_BYTES = 48 * 1024 * 1024 # memory prepared levels may use
+PREFETCH_LEVELS = 8 # prepared levels kept at most
+PREFETCH_FRAME_TIME = 0.004 # seconds of each idle frame used to prepare levels
+
+
+def makePrefetcher(budget=PREFETCH_BYTES):
+    """Returns a prefetcher object, with no level prepared yet."""
+    return {'budget': budget,
+            'prepared': collections.OrderedDict(), # level number -> prepared level, the last used last
+            'bytes': 0, # memory used by the prepared levels' chunks
+            'levels': None, # the level list of the last takeLevel()
+            'neighbours': (), # the level numbers of the current, next and previous level
+            'toPrefetch': [], # level numbers still to prepare, the first first
+            'task': None} # (level number, prepared level, generator) being prepared
+
+
+def makePreparedLevel(levelObj):
+    """Returns a prepared level object for the level, with nothing in it
+    yet (see prepareSteps())."""
+    return {'levelObj': levelObj,
+            'mapObj': None,
+            'boundObj': None,
+            'graphObj': None,
+            'gameStateObj': None, # a copy of the start state
+            'chunkCache': None, # the start state's chunks
+            'bytes': 0,
+            'done': False}
+
+
+def prepareSteps(prefetchObj, prepared):
+    """Generator that prepares what the prepared level doesn't have yet,
+    yielding after each step."""
+    levelObj = prepared['levelObj']
+    if prepared['mapObj'] is None:
+        prepared['mapObj'] = game.getDecoratedMap(levelObj)
+        yield
+    if prepared['boundObj'] is None:
+        prepared['boundObj'] = lowerbound.makeBound(starsolver.makeRules(levelObj))
+        yield
+    if prepared['graphObj'] is None:
+        prepared['graphObj'] = macromoves.makeWalkGraph(levelObj)
+        yield
+    if prepared['gameStateObj'] is None:
+        prepared['gameStateObj'] = copy.deepcopy(levelObj['startState'])
+    if prepared['chunkCache'] is None:
+        prepared['chunkCache'] = game.makeChunkCache(prepared['mapObj'], levelObj['goals'])
+        yield
+    chunkCache = prepared['chunkCache']
+    startState = levelObj['startState']
+    for chunkx, chunky in getStartChunks(chunkCache):
+        if (chunkx, chunky) in chunkCache['chunks']:
+            continue
+        chunkBytes = game.getChunkBytes(chunkCache, chunkx, chunky)
+        if prefetchObj is not None:
+            trimPrepared(prefetchObj, chunkBytes)
+            if prefetchObj['bytes'] + chunkBytes > prefetchObj['budget']:
+                break # the other chunks are drawn when they are first seen
+        if game.GPU is not None:
+            chunkCache['chunks'][(chunkx, chunky)] = gpurenderer.drawChunk(game.GPU, chunkCache, startState, chunkx, chunky)
+        else:
+            chunkCache['chunks'][(chunkx, chunky)] = game.drawChunk(chunkCache, startState, chunkx, chunky)
+        chunkCache['bytes'] += chunkBytes
+        prepared['bytes'] += chunkBytes
+        if prefetchObj is not None:
+            prefetchObj['bytes'] += chunkBytes
+        yield
+    prepared['done'] = True
+
+
+def getStartChunks(chunkCache):
+    """Returns the list of the chunks seen at the start of the level (the
+    camera isn't moved yet, see game.getMapTopLeft())."""
+    mapSurfRect = pygame.Rect(0, 0, chunkCache['width'], chunkCache['height'])
+    mapSurfRect.center = (game.HALF_WINWIDTH, game.HALF_WINHEIGHT)
+    return game.getVisibleChunks(chunkCache, pygame.Rect(0, 0, game.WINWIDTH, game.WINHEIGHT), mapSurfRect.topleft)
+
+
+def getPrepared(prefetchObj, levels, levelNum):
+    """Returns the prepared level object of levels[levelNum] (made now,
+    empty, if there is none yet). A prepared level made for another level
+    object (the level file was edited) is thrown away."""
+    prepared = prefetchObj['prepared'].get(levelNum)
+    if prepared is not None and prepared['levelObj'] is not levels[levelNum]:
+        forget(prefetchObj, levelNum, prepared)
+        prepared = None
+    if prepared is None:
+        prepared = makePreparedLevel(levels[levelNum])
+        prefetchObj['prepared'][levelNum] = prepared
+    return prepared
+
+
+def forget(prefetchObj, levelNum, prepared):
+    """Throws away the prepared level of levelNum, if it is still kept
+    (it may have been trimmed or replaced already), and stops preparing
+    it."""
+    if prefetchObj['prepared'].get(levelNum) is prepared:
+        del prefetchObj['prepared'][levelNum]
+        prefetchObj['bytes'] -= prepared['bytes']
+    if prefetchObj['task'] is not None and prefetchObj['task'][1] is prepared:
+        prefetchObj['task'] = None
+
+
+def takeLevel(prefetchObj, levels, levelNum):
+    """Returns the prepared level object of levels[levelNum] for
+    runLevel() to play, finishing it first if needed, and lets the
+    prefetcher prepare the levels next to it. prefetchObj may be None, to
+    prepare the level without a prefetcher. runLevel() gets the prepared
+    level's start state copy (a new one is made later) and its own chunk
+    cache (see getChunkCache())."""
+    if prefetchObj is None:
+        prepared = makePreparedLevel(levels[levelNum])
+        for step in prepareSteps(None, prepared):
+            pass
+        return prepared
+
+    # Prepare the next level, then the previous one, as main() goes to
+    # them (from the last level back to the first one, and the other way).
+    prefetchObj['levels'] = levels
+    prefetchObj['neighbours'] = (levelNum, (levelNum + 1) % len(levels), (levelNum - 1) % len(levels))
+    prefetchObj['toPrefetch'] = [(levelNum + 1) % len(levels), (levelNum - 1) % len(levels), levelNum]
+
+    prepared = getPrepared(prefetchObj, levels, levelNum)
+    prefetchObj['prepared'].move_to_end(levelNum)
+    if prefetchObj['task'] is not None and prefetchObj['task'][1] is prepared:
+        prefetchObj['task'] = None # finished here instead
+    if not prepared['done']:
+        for step in prepareSteps(prefetchObj, prepared):
+            pass
+    trimPrepared(prefetchObj)
+
+    # runLevel() gets this copy, the next one is made in advance.
+    taken = dict(prepared)
+    prepared['gameStateObj'] = None
+    prepared['done'] = False
+    return taken
+
+
+def getChunkCache(prepared):
+    """Returns a new chunk cache for the prepared level, starting with its
+    start state's chunks (the surfaces are shared, they are never drawn
+    on again)."""
+    chunkCache = dict(prepared['chunkCache'])
+    chunkCache['chunks'] = collections.OrderedDict(prepared['chunkCache']['chunks'])
+    return chunkCache
+
+
+def trimPrepared(prefetchObj, extraBytes=0):
+    """Throws away the least recently used prepared levels while there are
+    more than PREFETCH_LEVELS, or they (and extraBytes more) use more than
+    the budget, but never the current, next or previous one."""
+    for levelNum in list(prefetchObj['prepared']):
+        if len(prefetchObj['prepared']) <= PREFETCH_LEVELS and \
+           prefetchObj['bytes'] + extraBytes <= prefetchObj['budget']:
+            break
+        if levelNum not in prefetchObj['neighbours']:
+            forget(prefetchObj, levelNum, prefetchObj['prepared'][levelNum])
+
+
+def prefetchStep(prefetchObj, frameTime=PREFETCH_FRAME_TIME):
+    """Prepares the levels next to the current one for up to frameTime
+    seconds (or one step, if a step takes longer). Call it during the
+    frames where nothing else happens."""
+    if prefetchObj is None:
+        return
+    levels = prefetchObj['levels']
+    deadline = time.perf_counter() + frameTime
+    while time.perf_counter() < deadline:
+        if prefetchObj['task'] is None:
+            if not prefetchObj['toPrefetch']:
+                return
+            levelNum = prefetchObj['toPrefetch'].pop(0)
+            if levelNum >= len(levels):
+                continue
+            prepared = getPrepared(prefetchObj, levels, levelNum)
+            if prepared['done']:
+                continue
+            prefetchObj['task'] = (levelNum, prepared, prepareSteps(prefetchObj, prepared))
+        levelNum, prepared, steps = prefetchObj['task']
+        if levelNum >= len(levels) or prepared['levelObj'] is not levels[levelNum]:
+            forget(prefetchObj, levelNum, prepared) # the level file was edited
+            continue
+        try:
+            next(steps)
+        except StopIteration:
+            prefetchObj['task'] = None
@@ -0,0 +1,378 @@
+# Star Pusher level select screen
+# Shows every level of the pack as a small picture in a grid, to pick the
+# level to play (L in the game) instead of going through them one by one
+# with N and B.
+#
+# The pictures (thumbnails) are drawn by a background thread, so the
+# screen never waits for them: a level whose thumbnail isn't ready yet
+# shows an empty frame until it is. They are drawn with the game's own
+# tiles (getTileImages()), scaled down once to a small tile size, from the
+# level's decorated map and start state.
+#
+# Only the thumbnails of the rows on the screen (and PREFETCH_ROWS rows
+# above and below) are asked for, and the thread skips the ones that
+# scrolled away before it got to them, so the grid stays smooth with
+# thousands of levels. The last MEMORY_THUMBNAILS thumbnails drawn are
+# kept in memory, and every thumbnail is saved as a PNG file in
+# THUMBNAIL_DIR, named after the level's key (game.getLevelKey()), so two
+# levels with the same map share it and an edited level gets a new one.
+# The least recently used files are deleted when there are more than
+# DISK_THUMBNAILS.
+
+import collections, hashlib, math, os, tempfile, threading, pygame
+from pygame.locals import *
+
+import gameloader
+
+game = gameloader.loadGame()
+
+THUMBNAIL_VERSION = 1 # change it when thumbnails are drawn differently
+THUMBNAIL_DIR = os.path.join(gameloader.GAMEDIR, 'starpusher-thumbnails')
+MEMORY_THUMBNAILS = 256 # thumbnails kept in memory
+DISK_THUMBNAILS = 10000 # thumbnail files kept in THUMBNAIL_DIR
+
+CELL_WIDTH = 200 # size of a level's place in the grid, in pixels
+CELL_HEIGHT = 140
+THUMB_WIDTH = 184 # largest size of a thumbnail
+THUMB_HEIGHT = 106
+MAX_THUMB_TILEWIDTH = 12 # width of a tile in a thumbnail of a small level
+MIN_THUMB_TILEWIDTH = 2 # bigger levels are drawn with these and scaled down
+HEADER_HEIGHT = 40 # the text at the top of the screen
+PREFETCH_ROWS = 1 # rows above and below the screen drawn in advance
+SCROLL_SPEED = 0.35 # part of the distance left scrolled each frame
+WHEEL_PIXELS = 60 # scrolled by one step of the mouse wheel
+
+PLACEHOLDERCOLOR = (20, 90, 100)
+
+
+def makeThumbnailer(cacheDir=THUMBNAIL_DIR):
+    """Returns a thumbnailer object and starts its thread. pygame and the
+    game's images must be loaded first."""
+    thumbObj = {'cacheDir': cacheDir,
+                'condition': threading.Condition(),
+                'wanted': [], # (name, levelObj) still to draw, the first first
+                'memory': collections.OrderedDict(), # name -> Surface, the last used last
+                'disk': None, # name -> None for the files in cacheDir, the last used last
+                'tiles': {}, # tile width -> {id of a game image: scaled image}
+                'generation': 0, # increased every time a thumbnail is ready
+                'stopping': False}
+    thumbObj['thread'] = threading.Thread(target=runThumbnailer, args=(thumbObj,))
+    thumbObj['thread'].daemon = True # don't keep the game running when it quits
+    thumbObj['thread'].start()
+    return thumbObj
+
+
+def getThumbnailName(levelObj):
+    """Returns the name of the level's thumbnail file. It depends on the
+    level's map and on how thumbnails and decorations are made."""
+    settings = '%s:%s:%sx%s:%s' % (THUMBNAIL_VERSION, game.getDecorationVersion(), THUMB_WIDTH, THUMB_HEIGHT, MAX_THUMB_TILEWIDTH)
+    return '%s-%s.png' % (game.getLevelKey(levelObj), hashlib.sha1(settings.encode('utf-8')).hexdigest()[:8])
+
+
+def requestThumbnails(thumbObj, levelObjs):
+    """Asks the thread for the thumbnails of these levels, in this order.
+    The ones asked for before and not drawn yet are forgotten."""
+    wanted = [(getThumbnailName(levelObj), levelObj) for levelObj in levelObjs]
+    with thumbObj['condition']:
+        thumbObj['wanted'] = [item for item in wanted if item[0] not in thumbObj['memory']]
+        thumbObj['condition'].notify()
+
+
+def getThumbnail(thumbObj, levelObj):
+    """Returns the level's thumbnail, or None if it isn't ready."""
+    name = getThumbnailName(levelObj)
+    with thumbObj['condition']:
+        thumbSurf = thumbObj['memory'].get(name)
+        if thumbSurf is not None:
+            thumbObj['memory'].move_to_end(name)
+        return thumbSurf
+
+
+def runThumbnailer(thumbObj):
+    """The thumbnailer thread: draws (or loads) the wanted thumbnails, one
+    at a time, until stopThumbnailer() is called."""
+    scanDiskCache(thumbObj)
+    condition = thumbObj['condition']
+    while True:
+        with condition:
+            while not thumbObj['wanted'] and not thumbObj['stopping']:
+                condition.wait()
+            if thumbObj['stopping']:
+                return
+            name, levelObj = thumbObj['wanted'].pop(0)
+            if name in thumbObj['memory']:
+                continue
+
+        thumbSurf = loadThumbnail(thumbObj, name)
+        if thumbSurf is None:
+            thumbSurf = drawThumbnail(thumbObj, levelObj)
+            saveThumbnail(thumbObj, name, thumbSurf)
+        thumbSurf = thumbSurf.convert(game.DISPLAYSURF) # faster to blit
+
+        with condition:
+            thumbObj['memory'][name] = thumbSurf
+            while len(thumbObj['memory']) > MEMORY_THUMBNAILS:
+                thumbObj['memory'].popitem(last=False)
+            thumbObj['generation'] += 1
+
+
+def stopThumbnailer(thumbObj):
+    """Stops the thumbnailer thread (after the thumbnail it is drawing)."""
+    with thumbObj['condition']:
+        thumbObj['stopping'] = True
+        thumbObj['condition'].notify()
+    thumbObj['thread'].join()
+
+
+def scanDiskCache(thumbObj):
+    """Fills thumbObj['disk'] with the thumbnail files, the least recently
+    used first."""
+    files = []
+    try:
+        with os.scandir(thumbObj['cacheDir']) as entries:
+            for entry in entries:
+                if entry.name.endswith('.png'):
+                    files.append((entry.stat().st_mtime, entry.name))
+    except OSError:
+        pass # no thumbnails saved yet
+    files.sort()
+    thumbObj['disk'] = collections.OrderedDict((name, None) for mtime, name in files)
+
+
+def loadThumbnail(thumbObj, name):
+    """Returns the thumbnail saved in the file name, or None."""
+    if name not in thumbObj['disk']:
+        return None
+    filename = os.path.join(thumbObj['cacheDir'], name)
+    try:
+        thumbSurf = pygame.image.load(filename)
+        os.utime(filename) # the file's time says when it was last used
+    except (OSError, pygame.error):
+        del thumbObj['disk'][name]
+        return None
+    thumbObj['disk'].move_to_end(name)
+    return thumbSurf
+
+
+def saveThumbnail(thumbObj, name, thumbSurf):
+    """Saves the thumbnail in the file name, and deletes the least
+    recently used files if there are too many. The file is written under
+    another name first and then renamed, so it is never half written."""
+    try:
+        os.makedirs(thumbObj['cacheDir'], exist_ok=True)
+        fd, tempName = tempfile.mkstemp(suffix='.png', dir=thumbObj['cacheDir'])
+        os.close(fd)
+        pygame.image.save(thumbSurf, tempName)
+        os.replace(tempName, os.path.join(thumbObj['cacheDir'], name))
+    except (OSError, pygame.error):
+        return # not being able to save thumbnails isn't a problem
+    thumbObj['disk'][name] = None
+    thumbObj['disk'].move_to_end(name)
+    while len(thumbObj['disk']) > DISK_THUMBNAILS:
+        oldName = thumbObj['disk'].popitem(last=False)[0]
+        try:
+            os.remove(os.path.join(thumbObj['cacheDir'], oldName))
+        except OSError:
+            pass
+
+
+def getThumbTileWidth(mapObj):
+    """Returns the tile width the map is drawn with: the largest that fits
+    the thumbnail, between MIN_THUMB_TILEWIDTH and MAX_THUMB_TILEWIDTH."""
+    # A tile is TILEWIDTH wide, and a column of them is TILEFLOORHEIGHT
+    # high for each space and TILEHEIGHT - TILEFLOORHEIGHT more.
+    mapWidth = len(mapObj) * game.TILEWIDTH
+    mapHeight = (len(mapObj[0]) - 1) * game.TILEFLOORHEIGHT + game.TILEHEIGHT
+    tileWidth = int(game.TILEWIDTH * min(THUMB_WIDTH / mapWidth, THUMB_HEIGHT / mapHeight))
+    return max(MIN_THUMB_TILEWIDTH, min(MAX_THUMB_TILEWIDTH, tileWidth))
+
+
+def getThumbTiles(thumbObj, tileWidth):
+    """Returns a dict that maps the id of each of the game's images to the
+    image scaled for tiles tileWidth wide. They are only scaled the first
+    time a tile width is used."""
+    if tileWidth not in thumbObj['tiles']:
+        scale = tileWidth / game.TILEWIDTH
+        tiles = {}
+        for image in list(game.IMAGESDICT.values()) + game.PLAYERIMAGES:
+            width, height = image.get_size()
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            if image.get_bitsize() in (24, 32):
+                tiles[id(image)] = pygame.transform.smoothscale(image, size)
+            else:
+                tiles[id(image)] = pygame.transform.scale(image, size)
+        thumbObj['tiles'][tileWidth] = tiles
+    return thumbObj['tiles'][tileWidth]
+
+
+def getThumbMap(levelObj):
+    """Returns the level's decorated map, without changing the game's
+    DECORATEDMAPS (getDecoratedMap() saves it to a file, which can't be
+    done from the thread). The decorations are the same as in the game,
+    since their seed is the level's key."""
+    if 'decoratedMap' in levelObj:
+        return levelObj['decoratedMap']
+    key = game.getLevelKey(levelObj)
+    columns = game.DECORATEDMAPS.get(key)
+    if columns is not None:
+        return [list(column) for column in columns]
+    return game.decorateMap(levelObj['mapObj'], levelObj['startState']['player'], int(key[:16], 16))
+
+
+def drawThumbnail(thumbObj, levelObj):
+    """Returns a Surface with the level's map at its start, no larger than
+    THUMB_WIDTH x THUMB_HEIGHT."""
+    mapObj = getThumbMap(levelObj)
+    tileWidth = getThumbTileWidth(mapObj)
+    tiles = getThumbTiles(thumbObj, tileWidth)
+    scale = tileWidth / game.TILEWIDTH
+    floorHeight = game.TILEFLOORHEIGHT * scale
+    width = len(mapObj) * tileWidth
+    height = int(math.ceil((len(mapObj[0]) - 1) * floorHeight + game.TILEHEIGHT * scale))
+    thumbSurf = pygame.Surface((width, height))
+    thumbSurf.fill(game.BGCOLOR)
+    for x in range(len(mapObj)):
+        for y in range(len(mapObj[x])):
+            topleft = (x * tileWidth, int(y * floorHeight))
+            for image in game.getTileImages(mapObj, levelObj['startState'], levelObj['goals'], x, y):
+                thumbSurf.blit(tiles[id(image)], topleft)
+
+    # Big levels are drawn with the smallest tiles, then scaled to fit.
+    if width > THUMB_WIDTH or height > THUMB_HEIGHT:
+        fit = min(THUMB_WIDTH / width, THUMB_HEIGHT / height)
+        size = (max(1, int(width * fit)), max(1, int(height * fit)))
+        thumbSurf = pygame.transform.smoothscale(thumbSurf, size)
+    return thumbSurf
+
+
+def getCellRect(levelNum, columns, scrollY):
+    """Returns the screen Rect of the level's place in the grid."""
+    left = (game.WINWIDTH - columns * CELL_WIDTH) // 2
+    row, column = divmod(levelNum, columns)
+    return pygame.Rect(left + column * CELL_WIDTH, HEADER_HEIGHT + row * CELL_HEIGHT - scrollY, CELL_WIDTH, CELL_HEIGHT)
+
+
+def getVisibleRows(numLevels, columns, scrollY):
+    """Returns the range of the grid's rows that are on the screen."""
+    numRows = (numLevels + columns - 1) // columns
+    firstRow = int(scrollY) // CELL_HEIGHT
+    lastRow = (int(scrollY) + game.WINHEIGHT - HEADER_HEIGHT - 1) // CELL_HEIGHT
+    return range(max(0, firstRow), min(numRows, lastRow + 1))
+
+
+def getMaxScroll(numLevels, columns):
+    """Returns the largest scrollY, which shows the last row at the
+    bottom of the screen."""
+    numRows = (numLevels + columns - 1) // columns
+    return max(0, numRows * CELL_HEIGHT - (game.WINHEIGHT - HEADER_HEIGHT))
+
+
+def drawSelectScreen(thumbObj, levels, selected, columns, scrollY):
+    """Draws the grid of the levels on the screen onto DISPLAYSURF."""
+    surf = game.DISPLAYSURF
+    surf.fill(game.BGCOLOR)
+    for row in getVisibleRows(len(levels), columns, scrollY):
+        for levelNum in range(row * columns, min(len(levels), (row + 1) * columns)):
+            cellRect = getCellRect(levelNum, columns, scrollY)
+            thumbRect = pygame.Rect(0, 0, THUMB_WIDTH, THUMB_HEIGHT)
+            thumbRect.midtop = (cellRect.centerx, cellRect.top + 6)
+            thumbSurf = getThumbnail(thumbObj, levels[levelNum])
+            if thumbSurf is None:
+                pygame.draw.rect(surf, PLACEHOLDERCOLOR, thumbRect)
+            else:
+                surf.blit(thumbSurf, thumbSurf.get_rect(center=thumbRect.center))
+            if levelNum == selected:
+                pygame.draw.rect(surf, game.SELECTCOLOR, thumbRect.inflate(8, 8), 3)
+            numberSurf = game.BASICFONT.render(str(levelNum + 1), 1, game.TEXTCOLOR)
+            surf.blit(numberSurf, numberSurf.get_rect(midtop=(cellRect.centerx, thumbRect.bottom + 6)))
+
+    # The header is drawn last, over the rows scrolled under it.
+    pygame.draw.rect(surf, game.BGCOLOR, (0, 0, game.WINWIDTH, HEADER_HEIGHT))
+    headerText = 'Level %s of %s - Enter to play, Esc to go back' % (selected + 1, len(levels))
+    headerSurf = game.BASICFONT.render(headerText, 1, game.TEXTCOLOR)
+    surf.blit(headerSurf, headerSurf.get_rect(center=(game.HALF_WINWIDTH, HEADER_HEIGHT // 2)))
+
+
+def selectLevel(thumbObj, levels, levelNum):
+    """Shows the level select screen, starting on levelNum, until the
+    player picks a level (Enter, or a click) or goes back (Esc or L).
+    Returns the index of the level picked, or None."""
+    columns = max(1, game.WINWIDTH // CELL_WIDTH)
+    viewHeight = game.WINHEIGHT - HEADER_HEIGHT
+    selected = levelNum
+    # Start with the selected level in the middle of the screen.
+    targetY = getCellRect(selected, columns, 0).centery - HEADER_HEIGHT - viewHeight // 2
+    targetY = max(0, min(getMaxScroll(len(levels), columns), targetY))
+    scrollY = targetY
+    requested = None # the rows whose thumbnails were last asked for
+    drawnGeneration = None # thumbObj['generation'] when last drawn
+    needsRedraw = True
+
+    while True:
+        oldSelected = selected
+        for event in pygame.event.get():
+            if event.type == QUIT:
+                game.terminate()
+            elif event.type == KEYDOWN:
+                if event.key in (K_ESCAPE, K_l):
+                    return None
+                elif event.key in (K_RETURN, K_KP_ENTER, K_SPACE):
+                    return selected
+                elif event.key == K_LEFT:
+                    selected -= 1
+                elif event.key == K_RIGHT:
+                    selected += 1
+                elif event.key == K_UP:
+                    selected -= columns
+                elif event.key == K_DOWN:
+                    selected += columns
+                elif event.key == K_PAGEUP:
+                    selected -= columns * (viewHeight // CELL_HEIGHT)
+                elif event.key == K_PAGEDOWN:
+                    selected += columns * (viewHeight // CELL_HEIGHT)
+                elif event.key == K_HOME:
+                    selected = 0
+                elif event.key == K_END:
+                    selected = len(levels) - 1
+            elif event.type == MOUSEWHEEL:
+                targetY -= event.y * WHEEL_PIXELS
+            elif event.type == MOUSEBUTTONDOWN and event.button == 1 and event.pos[1] >= HEADER_HEIGHT:
+                for row in getVisibleRows(len(levels), columns, scrollY):
+                    for i in range(row * columns, min(len(levels), (row + 1) * columns)):
+                        if getCellRect(i, columns, scrollY).collidepoint(event.pos):
+                            return i
+
+        selected = max(0, min(len(levels) - 1, selected))
+        if selected != oldSelected:
+            # Scroll just enough to show the selected level.
+            cellRect = getCellRect(selected, columns, 0)
+            targetY = max(min(targetY, cellRect.top - HEADER_HEIGHT), cellRect.bottom - game.WINHEIGHT)
+            needsRedraw = True
+        targetY = max(0, min(getMaxScroll(len(levels), columns), targetY))
+        if scrollY != targetY:
+            step = (targetY - scrollY) * SCROLL_SPEED
+            if abs(targetY - scrollY) <= 1:
+                scrollY = targetY
+            else:
+                scrollY += step if abs(step) >= 1 else math.copysign(1, step)
+            needsRedraw = True
+
+        # Ask for the thumbnails of the rows on the screen, then of the
+        # rows just off it.
+        rows = getVisibleRows(len(levels), columns, scrollY)
+        if (rows, len(levels)) != requested:
+            requested = (rows, len(levels))
+            numRows = (len(levels) + columns - 1) // columns
+            nearRows = [row for i in range(1, PREFETCH_ROWS + 1) for row in (rows.start - i, rows.stop - 1 + i) if 0 <= row < numRows]
+            levelObjs = [levels[i] for row in list(rows) + nearRows
+                         for i in range(row * columns, min(len(levels), (row + 1) * columns))]
+            requestThumbnails(thumbObj, levelObjs)
+
+        if thumbObj['generation'] != drawnGeneration:
+            drawnGeneration = thumbObj['generation']
+            needsRedraw = True
+        if needsRedraw:
+            drawSelectScreen(thumbObj, levels, selected, columns, scrollY)
+            game.updateDisplay(wholeSurface=True)
+            needsRedraw = False
+        game.FPSCLOCK.tick(game.FPS)
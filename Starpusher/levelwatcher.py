@@ -0,0 +1,179 @@
+# Star Pusher level file watcher
+# Lets level designers edit the level file while the game runs: when the
+# file is saved, the levels are updated within a second, and the level
+# being played starts again if it was the one that changed.
+#
+# The file is watched with inotify on Linux (through ctypes, no extra
+# module needed), or else by calling os.stat() every WATCH_INTERVAL
+# seconds; either way, checkWatcher() is cheap enough to call every frame.
+# When the file changed, it is read again and split into level blocks (the
+# game's findLevelBlocks()), and only the blocks whose text has a new hash
+# are parsed: the other levels keep their level objects.
+#
+# If the new file has a level that can't be parsed (the designer is in the
+# middle of an edit), the error is printed and the old levels are kept
+# until the next save.
+
+import ctypes, ctypes.util, hashlib, os, struct, sys, time
+
+import gameloader
+
+game = gameloader.loadGame()
+
+WATCH_INTERVAL = 0.5 # seconds between two os.stat() calls, without inotify
+
+# From <sys/inotify.h>.
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII') # wd, mask, cookie, length of the name
+
+
+def makeWatcher(filename, levels):
+    """Returns a watcher object for the level file, whose levels (as read
+    by readLevelsFile()) are the first ones of levels."""
+    content = readLines(filename)
+    blocks = game.findLevelBlocks(content)
+    return {'filename': filename,
+            'stat': getStat(filename),
+            'hashes': [getBlockHash(content, start, end) for start, end in blocks],
+            'levels': list(levels[:len(blocks)]), # the level object of each block
+            'inotify': openInotify(filename),
+            'nextPoll': time.time() + WATCH_INTERVAL}
+
+
+def readLines(filename):
+    """Returns the lines of the file, like readLevelsFile() reads them."""
+    with open(filename, 'r') as levelFile:
+        return levelFile.readlines()
+
+
+def getStat(filename):
+    """Returns what os.stat() says about the file that changes when it is
+    written, or None if it doesn't exist (an editor may be replacing it)."""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def getBlockHash(content, start, end):
+    """Returns the hash of the text of a level block."""
+    return hashlib.sha1(''.join(content[start:end]).encode('utf-8')).digest()
+
+
+def openInotify(filename):
+    """Returns an inotify file descriptor watching the file's folder (editors
+    often save by writing a new file and renaming it), or None if inotify
+    isn't available."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError, TypeError):
+        return None # not Linux
+    if fd < 0:
+        return None
+    folder = os.path.dirname(os.path.abspath(filename))
+    if libc.inotify_add_watch(fd, folder.encode(sys.getfilesystemencoding()),
+                              IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def readInotify(watcherObj):
+    """Returns True if inotify saw the level file being written since the
+    last call."""
+    name = os.path.basename(watcherObj['filename']).encode(sys.getfilesystemencoding())
+    written = False
+    while True:
+        try:
+            data = os.read(watcherObj['inotify'], 65536)
+        except BlockingIOError:
+            return written
+        offset = 0
+        while offset < len(data):
+            length = INOTIFY_EVENT.unpack_from(data, offset)[3]
+            offset += INOTIFY_EVENT.size
+            if data[offset:offset + length].rstrip(b'\0') == name:
+                written = True
+            offset += length
+
+
+def hasChanged(watcherObj):
+    """Returns True if the level file is not the same as when it was last
+    read."""
+    if watcherObj['inotify'] is not None:
+        if not readInotify(watcherObj):
+            return False
+    else:
+        now = time.time()
+        if now < watcherObj['nextPoll']:
+            return False
+        watcherObj['nextPoll'] = now + WATCH_INTERVAL
+    stat = getStat(watcherObj['filename'])
+    if stat is None or stat == watcherObj['stat']:
+        return False
+    watcherObj['stat'] = stat
+    return True
+
+
+def checkWatcher(watcherObj, levels):
+    """Updates the levels of the level file at the start of levels (the
+    generated levels after them stay) if the file changed, parsing only
+    the levels whose text changed. Returns the set of level indexes whose
+    level object is a new one (empty if nothing changed)."""
+    if not hasChanged(watcherObj):
+        return set()
+    filename = watcherObj['filename']
+    startTime = time.time()
+    try:
+        content = readLines(filename)
+    except (OSError, UnicodeDecodeError):
+        return set()
+    blocks = game.findLevelBlocks(content)
+
+    # The level objects of the old blocks, by hash (the same text can be
+    # in more than one block).
+    unchanged = {}
+    for levelHash, levelObj in zip(watcherObj['hashes'], watcherObj['levels']):
+        unchanged.setdefault(levelHash, []).append(levelObj)
+    hashes = []
+    newLevels = []
+    for levelNum in range(len(blocks)):
+        start, end = blocks[levelNum]
+        levelHash = getBlockHash(content, start, end)
+        if unchanged.get(levelHash):
+            levelObj = unchanged[levelHash].pop(0)
+        else:
+            try:
+                levelObj = game.parseLevels(content[start:end], filename, levelNum)[0]
+            except AssertionError as error:
+                print('Not reloading %s, the level at line %s has an error: %s' % (filename, start + 1, error))
+                return set()
+        hashes.append(levelHash)
+        newLevels.append(levelObj)
+    if not newLevels:
+        return set()
+
+    numOld = len(watcherObj['levels'])
+    changed = set(levelNum for levelNum in range(len(newLevels)) if levelNum >= numOld or newLevels[levelNum] is not levels[levelNum])
+    changed.update(range(len(newLevels), numOld)) # removed levels, the generated ones move down
+    levels[:numOld] = newLevels
+    watcherObj['hashes'] = hashes
+    watcherObj['levels'] = newLevels
+    if changed:
+        print('Reloaded %s in %.0f ms (%s levels), changed: %s' % (
+              filename, (time.time() - startTime) * 1000, len(newLevels), ', '.join(str(levelNum + 1) for levelNum in sorted(changed))))
+    return changed
+
+
+def stopWatcher(watcherObj):
+    """Closes the watcher's inotify file descriptor."""
+    if watcherObj['inotify'] is not None:
+        os.close(watcherObj['inotify'])
+        watcherObj['inotify'] = None
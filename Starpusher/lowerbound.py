@@ -0,0 +1,328 @@
+# Star Pusher lower bound heuristic
+# Gives a lower bound on the number of actions left to solve a state, that
+# the solver, the hint engine and the analyzer can use: an A* search
+# ordered by it (starsolver.search() with weight 1) finds shortest
+# solutions, and a state whose bound is None can never be solved.
+#
+# Usage (prints how many evaluations per second it makes):
+#   python lowerbound.py [levelfile] [--level N] [--states N] [--check]
+#
+# For every goal, a table gives each space's star distance: the fewest
+# actions that can take a star from that space to the goal, if no other
+# star was in the way and all the doors were open. In one action a star
+# can move one space:
+#   * pushed (the player, or a star the player pushes or carries, is
+#     behind it),
+#   * pulled or carried (the player holds it and walks),
+# as long as the player has room to do it, or one space diagonally:
+#   * turned (the player holds it and turns; it goes round the corner).
+# The stars are matched to the goals by a min-cost bipartite matching
+# (the Hungarian algorithm) of their star distances; the extra stars, if
+# there are more stars than goals, go to dummy goals at no cost. When an
+# action moves stars, only the rows of the stars that moved are solved
+# again (one augmenting path each), instead of the whole matching.
+#
+# One action can move up to MAX_STARS_PER_ACTION stars by one space each
+# (the grabbed star, a star it pushes and a star the player pushes, see
+# moveStar() and makeMove()), so the matching cost divided by that, rounded
+# up, is a lower bound on the actions left.
+
+import argparse, collections, random, sys, time
+
+import gameloader, starsolver
+
+game = gameloader.loadGame()
+
+MAX_STARS_PER_ACTION = 3
+UNREACHABLE = 10 ** 6 # star distance of a space that can't reach the goal
+
+
+def getStarMoves(rules):
+    """Returns a dict that maps each inside space to the list of spaces a
+    lone star there can get to in one action."""
+    inside = rules['inside']
+    starMoves = {}
+    for cx, cy in inside:
+        moves = []
+        for ex, ey in starsolver.OFFSETS:
+            nx, ny = cx + ex, cy + ey
+            if (nx, ny) not in inside:
+                continue
+            # Pushed from behind, pulled by a player walking on ahead, or
+            # carried by a player walking beside it.
+            canMove = (cx - ex, cy - ey) in inside or (nx + ex, ny + ey) in inside
+            for fx, fy in ((ey, ex), (-ey, -ex)): # the two right angles to e
+                if (cx - fx, cy - fy) in inside and (cx - fx + ex, cy - fy + ey) in inside:
+                    canMove = True
+                    # Turned by a player at c - f: round the corner n, to c - f + e.
+                    moves.append((cx - fx + ex, cy - fy + ey))
+            if canMove:
+                moves.append((nx, ny))
+        starMoves[(cx, cy)] = moves
+    return starMoves
+
+
+def getDistanceTable(rules, starMoves, goal):
+    """Returns a dict that maps each inside space to its star distance to
+    the goal (spaces that can't reach it are left out)."""
+    # Search backwards from the goal.
+    cameFrom = collections.defaultdict(list)
+    for cell, moves in starMoves.items():
+        for newCell in moves:
+            cameFrom[newCell].append(cell)
+    distances = {goal: 0}
+    toVisit = collections.deque([goal])
+    while toVisit:
+        cell = toVisit.popleft()
+        for previous in cameFrom[cell]:
+            if previous not in distances:
+                distances[previous] = distances[cell] + 1
+                toVisit.append(previous)
+    return distances
+
+
+def makeBound(rules):
+    """Returns a bound object for the level: its distance tables, and for
+    each space the row of the cost matrix for a star on it."""
+    starMoves = getStarMoves(rules)
+    goals = [goal for goal in rules['goals'] if goal in rules['inside']]
+    tables = [getDistanceTable(rules, starMoves, goal) for goal in goals]
+    size = max(rules['numStars'], len(rules['goals']))
+    costRows = {}
+    for cell in rules['cells']:
+        costRows[cell] = tuple([table.get(cell, UNREACHABLE) for table in tables] +
+                               [UNREACHABLE] * (len(rules['goals']) - len(goals)) + # goals outside: never reached
+                               [0] * (size - len(rules['goals']))) # dummy goals for the extra stars
+    return {'rules': rules,
+            'tables': tables,
+            'costRows': costRows,
+            'size': size}
+
+
+def getStars(state):
+    """Returns the list of the spaces of the state's stars, the grabbed
+    one included."""
+    if state[3] is None:
+        return list(state[2])
+    return list(state[2]) + [state[3]]
+
+
+def augment(matchingObj, row):
+    """Matches the row (1 based), which is the only one without a goal,
+    with the shortest augmenting path. The row's potential must keep its
+    reduced costs from being negative."""
+    costs = matchingObj['costs']
+    u = matchingObj['u']
+    v = matchingObj['v']
+    p = matchingObj['p']
+    size = len(costs)
+    infinity = float('inf')
+    minv = [infinity] * (size + 1)
+    used = [False] * (size + 1)
+    way = [0] * (size + 1)
+    p[0] = row
+    j0 = 0
+    while True:
+        used[j0] = True
+        i0 = p[j0]
+        rowCosts = costs[i0 - 1]
+        ui0 = u[i0]
+        delta = infinity
+        j1 = 0
+        for j in range(1, size + 1):
+            if not used[j]:
+                current = rowCosts[j - 1] - ui0 - v[j]
+                if current < minv[j]:
+                    minv[j] = current
+                    way[j] = j0
+                if minv[j] < delta:
+                    delta = minv[j]
+                    j1 = j
+        for j in range(size + 1):
+            if used[j]:
+                u[p[j]] += delta
+                v[j] -= delta
+            else:
+                minv[j] -= delta
+        j0 = j1
+        if p[j0] == 0:
+            break
+    while j0:
+        j1 = way[j0]
+        p[j0] = p[j1]
+        j0 = j1
+
+
+def getMatchingCost(matchingObj):
+    """Returns the sum of the star distances of the matching, or None if
+    a goal can't get a star (the state can't be solved)."""
+    costs = matchingObj['costs']
+    p = matchingObj['p']
+    total = sum(costs[p[j] - 1][j - 1] for j in range(1, len(costs) + 1))
+    if total >= UNREACHABLE:
+        return None
+    return total
+
+
+def makeMatching(boundObj, state):
+    """Returns a matching object for the state, solved from scratch."""
+    size = boundObj['size']
+    stars = getStars(state)
+    # Missing stars (more goals than stars) can never reach their goal.
+    costs = [boundObj['costRows'][star] for star in stars] + [(UNREACHABLE,) * size] * (size - len(stars))
+    matchingObj = {'stars': stars + [None] * (size - len(stars)),
+                   'costs': costs,
+                   'u': [0] * (size + 1),
+                   'v': [0] * (size + 1),
+                   'p': [0] * (size + 1)} # p[goal column] = star row, 1 based
+    for row in range(1, size + 1):
+        augment(matchingObj, row)
+    matchingObj['cost'] = getMatchingCost(matchingObj)
+    return matchingObj
+
+
+def updateMatching(boundObj, matchingObj, state):
+    """Returns the matching object for the state, made from the matching
+    of a state that differs only by a few stars (such as the state before
+    an action). Only the rows of the stars that moved are solved again.
+    matchingObj itself isn't changed."""
+    # No two stars are ever on the same space.
+    stars = set(getStars(state))
+    oldStars = matchingObj['stars']
+    newCells = stars.difference(oldStars)
+    if not newCells:
+        return matchingObj
+    movedRows = [row for row in range(len(oldStars)) if oldStars[row] is not None and oldStars[row] not in stars]
+
+    newMatching = {'stars': list(oldStars),
+                   'costs': list(matchingObj['costs']),
+                   'u': list(matchingObj['u']),
+                   'v': list(matchingObj['v']),
+                   'p': list(matchingObj['p'])}
+    v = newMatching['v']
+    p = newMatching['p']
+    for row, cell in zip(movedRows, newCells):
+        rowCosts = boundObj['costRows'][cell]
+        newMatching['stars'][row] = cell
+        newMatching['costs'][row] = rowCosts
+        # Take the row's goal away and make its potential fit its new
+        # costs, then match it again.
+        p[p.index(row + 1, 1)] = 0
+        newMatching['u'][row + 1] = min(rowCosts[j - 1] - v[j] for j in range(1, len(v)))
+        augment(newMatching, row + 1)
+    newMatching['cost'] = getMatchingCost(newMatching)
+    return newMatching
+
+
+def getLowerBound(matchingObj):
+    """Returns the lower bound on the actions left to solve the matching's
+    state, or None if it can never be solved."""
+    if matchingObj['cost'] is None:
+        return None
+    return -(-matchingObj['cost'] // MAX_STARS_PER_ACTION)
+
+
+def getStateBound(boundObj, state):
+    """Returns the lower bound of a state, computed from scratch."""
+    return getLowerBound(makeMatching(boundObj, state))
+
+
+def getExactDistances(rules, startState, maxStates):
+    """Returns a dict that maps every state reachable from startState to
+    the fewest actions left to solve it (unsolvable states are left
+    out), or None if there are more than maxStates states."""
+    successors = {}
+    toVisit = collections.deque([startState])
+    successors[startState] = None
+    while toVisit:
+        state = toVisit.popleft()
+        if starsolver.isSolved(rules, state):
+            successors[state] = []
+            continue
+        successors[state] = [newState for action, newState in starsolver.getSuccessors(rules, state)]
+        for newState in successors[state]:
+            if newState not in successors:
+                if len(successors) >= maxStates:
+                    return None
+                successors[newState] = None
+                toVisit.append(newState)
+
+    cameFrom = collections.defaultdict(list)
+    for state, newStates in successors.items():
+        for newState in newStates:
+            cameFrom[newState].append(state)
+    distances = dict((state, 0) for state in successors if starsolver.isSolved(rules, state))
+    toVisit = collections.deque(distances)
+    while toVisit:
+        state = toVisit.popleft()
+        for previous in cameFrom[state]:
+            if previous not in distances:
+                distances[previous] = distances[state] + 1
+                toVisit.append(previous)
+    return distances
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks (and checks) the Star Pusher lower bound heuristic.')
+    parser.add_argument('levelfile', nargs='?', default=gameloader.LEVELFILE)
+    parser.add_argument('--level', type=int, default=11, help='level to use')
+    parser.add_argument('--states', type=int, default=20000, help='states to evaluate')
+    parser.add_argument('--check', action='store_true', help='check the bound against the exact distances of every reachable state')
+    args = parser.parse_args()
+
+    levelObj = game.readLevelsFile(args.levelfile)[args.level - 1]
+    rules = starsolver.makeRules(levelObj)
+    startState = starsolver.getStartState(levelObj)
+    startTime = time.perf_counter()
+    boundObj = makeBound(rules)
+    print('Level %s: distance tables made in %.1f ms, start state bound %s' % (
+          args.level, (time.perf_counter() - startTime) * 1000, getStateBound(boundObj, startState)))
+
+    # Pairs of (state, successor) from a random walk, as a search sees
+    # them; only the actions that move a star, the others cost nothing.
+    rand = random.Random(1)
+    pairs = []
+    state = startState
+    while len(pairs) < args.states:
+        successors = starsolver.getSuccessors(rules, state)
+        if not successors or starsolver.isSolved(rules, state):
+            state = startState
+            continue
+        newState = rand.choice(successors)[1]
+        if sorted(getStars(state)) != sorted(getStars(newState)):
+            pairs.append((state, newState))
+        state = newState
+    matchings = [makeMatching(boundObj, state) for state, newState in pairs]
+
+    timings = [('starsolver.getHeuristic()', lambda: [starsolver.getHeuristic(rules, newState) for state, newState in pairs]),
+               ('matching from scratch', lambda: [makeMatching(boundObj, newState) for state, newState in pairs]),
+               ('incremental matching', lambda: [updateMatching(boundObj, matchings[i], pairs[i][1]) for i in range(len(pairs))])]
+    for name, function in timings:
+        startTime = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - startTime
+        print('%-28s %10.0f evaluations/s' % (name, len(pairs) / elapsed))
+
+    if args.check:
+        distances = getExactDistances(rules, startState, 2000000)
+        if distances is None:
+            print('Too many states to check.')
+            return 0
+        tooHigh = 0
+        for state, distance in distances.items():
+            bound = getStateBound(boundObj, state)
+            if bound is None or bound > distance:
+                tooHigh += 1
+        wrong = 0
+        for state, newState in pairs:
+            if updateMatching(boundObj, makeMatching(boundObj, state), newState)['cost'] != makeMatching(boundObj, newState)['cost']:
+                wrong += 1
+        print('Checked %s solvable states: %s with a bound above their distance (or None)' % (len(distances), tooHigh))
+        print('Checked %s incremental matchings: %s wrong' % (len(pairs), wrong))
+        bad = tooHigh + wrong
+        return 1 if bad else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
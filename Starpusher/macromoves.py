@@ -0,0 +1,177 @@
+# Star Pusher macro moves
+# Plans a whole list of actions from one mouse click:
+#   walkTo()      the shortest walk to a space, that never pushes a star (a
+#                 grabbed star is carried along, as an arrow key would)
+#   moveStarTo()  the shortest list of actions (walks, pushes, grabs, pulls
+#                 and turns) that takes one star to a space, without moving
+#                 any other star
+# runLevel() then plays the actions, either all in one frame or a few per
+# frame so the player can watch.
+#
+# walkTo() is a breadth first search over the open spaces, with their
+# neighbours worked out once per level by makeWalkGraph(), and with the
+# same wall, star and door checks as makeMove() and moveStar(). It takes
+# well under a millisecond on the levels of starPusherLevels.txt.
+#
+# moveStarTo() searches through whole game states, which can take seconds
+# on a big level, so runLevel() runs it a little per frame instead (see
+# makeStarMove() and starMoveStep()).
+
+import collections, time
+
+import gameloader, starsolver
+
+game = gameloader.loadGame()
+
+MACRO_MAX_STATES = 100000 # states moveStarTo() may look at before giving up
+MACRO_FRAME_TIME = 0.008 # seconds of each frame starMoveStep() may use
+
+
+def makeWalkGraph(levelObj):
+    """Returns a walk graph object for the level: the rules object (see
+    starsolver.makeRules()) plus the neighbours of every open space, as
+    space numbers (-1 for a wall or the edge of the map)."""
+    rules = starsolver.makeRules(levelObj)
+    cells = rules['cells']
+    cellIndex = rules['cellIndex']
+    neighbours = []
+    for x, y in cells:
+        neighbours.append(tuple(cellIndex.get((x + xOffset, y + yOffset), -1) for xOffset, yOffset in starsolver.OFFSETS))
+    return {'rules': rules,
+            'cells': cells,
+            'cellIndex': cellIndex,
+            'neighbours': neighbours,
+            'isDoor': [cell in rules['doors'] for cell in cells],
+            'isButton': [cell in rules['buttons'] for cell in cells]}
+
+
+def walkTo(graphObj, gameStateObj, target):
+    """Returns the list of moves ('up', 'left'...) that takes the player
+    to the target (x, y) space in the fewest steps without pushing any
+    star, [] if the player is already there, or None if it can't be done."""
+    cellIndex = graphObj['cellIndex']
+    if target not in cellIndex or gameStateObj['player'] not in cellIndex:
+        return None
+    neighbours = graphObj['neighbours']
+    isDoor = graphObj['isDoor']
+    isButton = graphObj['isButton']
+    start = cellIndex[gameStateObj['player']]
+    goal = cellIndex[target]
+    stars = set(cellIndex[star] for star in gameStateObj['stars'] if star in cellIndex)
+    # The doors are open while a button is pressed. The stars that aren't
+    # grabbed don't move on a walk, so if one of them is on a button, the
+    # doors are open all the time.
+    starsPress = any(isButton[star] for star in stars)
+    # A grabbed star is always on the space the player faces.
+    grab = bool(gameStateObj['grabstar'])
+    facing = gameStateObj['playerdirection']
+
+    parents = {start: None}
+    toVisit = collections.deque([start])
+    while toVisit:
+        player = toVisit.popleft()
+        if player == goal:
+            break
+        grabbed = neighbours[player][facing] if grab else -1
+        pressed = starsPress or isButton[player] or (grabbed >= 0 and isButton[grabbed])
+        for direction in range(4):
+            nextPlayer = neighbours[player][direction]
+            if nextPlayer < 0 or nextPlayer in stars or nextPlayer in parents:
+                continue
+            # A closed door only lets in something that is already on it.
+            if isDoor[nextPlayer] and not pressed and nextPlayer != grabbed:
+                continue
+            if grab:
+                # The grabbed star moves the same way first.
+                nextGrabbed = neighbours[grabbed][direction]
+                if nextGrabbed < 0 or nextGrabbed in stars:
+                    continue
+                if isDoor[nextGrabbed] and not pressed and nextGrabbed != player:
+                    continue
+            parents[nextPlayer] = (player, direction)
+            toVisit.append(nextPlayer)
+
+    if goal not in parents:
+        return None
+    moves = []
+    cell = goal
+    while parents[cell] is not None:
+        cell, direction = parents[cell]
+        moves.append(starsolver.MOVEACTIONS[direction])
+    moves.reverse()
+    return moves
+
+
+def getAllStars(state):
+    """Returns the set of stars of the state tuple, grabbed or not."""
+    if state[3] is None:
+        return set(state[2])
+    return set(state[2]) | set([state[3]])
+
+
+def makeStarMove(graphObj, gameStateObj, star, target, maxStates=MACRO_MAX_STATES):
+    """Returns a star move object: the search for the shortest list of
+    actions that takes the star (the (x, y) of a star, grabbed or not) to
+    the target space and lets go of it, with all the other stars left
+    where they are. starMoveStep() runs it."""
+    startState = starsolver.fromGameState(gameStateObj)
+    others = getAllStars(startState)
+    others.discard(star)
+    moveObj = {'rules': graphObj['rules'],
+               'others': others,
+               'target': target,
+               'maxStates': maxStates,
+               'parents': {startState: None},
+               'toVisit': collections.deque([startState]),
+               'done': False,
+               'actions': None} # the result, once done
+    if star not in getAllStars(startState) or target not in graphObj['cellIndex'] or target in others:
+        moveObj['done'] = True
+    return moveObj
+
+
+def starMoveStep(moveObj, frameTime=MACRO_FRAME_TIME):
+    """Goes on with the star move's breadth first search for up to
+    frameTime seconds (None: until it's over). Returns True once it's
+    over: moveObj['actions'] is then the list of actions, or None if there
+    is none (within maxStates states)."""
+    rules = moveObj['rules']
+    others = moveObj['others']
+    target = moveObj['target']
+    parents = moveObj['parents']
+    toVisit = moveObj['toVisit']
+    deadline = time.perf_counter() + frameTime if frameTime is not None else None
+    expanded = 0
+    while not moveObj['done']:
+        if not toVisit or len(parents) >= moveObj['maxStates']:
+            moveObj['done'] = True
+            break
+        if deadline is not None and expanded % 64 == 63 and time.perf_counter() >= deadline:
+            break
+        expanded += 1
+        state = toVisit.popleft()
+        if state[3] is None and target in state[2] and target not in others:
+            actions = []
+            while parents[state] is not None:
+                state, action = parents[state]
+                actions.append(action)
+            actions.reverse()
+            moveObj['actions'] = actions
+            moveObj['done'] = True
+            break
+        for action, newState in starsolver.getSuccessors(rules, state):
+            if newState in parents or not others <= getAllStars(newState):
+                continue
+            parents[newState] = (state, action)
+            toVisit.append(newState)
+    return moveObj['done']
+
+
+def moveStarTo(graphObj, gameStateObj, star, target, maxStates=MACRO_MAX_STATES):
+    """Returns the shortest list of actions that takes the star (the (x, y)
+    of a star, grabbed or not) to the target space and lets go of it, with
+    all the other stars left where they are; or None if there is none
+    (within maxStates states). This runs the whole search at once."""
+    moveObj = makeStarMove(graphObj, gameStateObj, star, target, maxStates)
+    starMoveStep(moveObj, None)
+    return moveObj['actions']
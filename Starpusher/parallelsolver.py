@@ -0,0 +1,336 @@
+# Star Pusher parallel solver
+# Searches one level with several processes, for levels too hard for
+# starsolver.py's single search.
+#
+# Usage:
+#   python parallelsolver.py [levelfile] [--level N] [--processes N]
+#                            [--weight W] [--table-size N] [--exhaustive]
+#                            [--scaling]
+#
+# Every worker runs its own best first search (ordered like starsolver's
+# search(), by actions so far + weight * heuristic) with starsolver's
+# getSuccessors(), so the game's own move, turn, grab and door rules are
+# used. The workers share one transposition table of the states seen so
+# far, in multiprocessing.shared_memory:
+#   header    I per stripe        number of slots used in each stripe
+#   slots     B B I + state       used flag, action (index in
+#                                 starsolver.ACTIONS), parent slot number
+#                                 (NO_PARENT for the start state), then
+#                                 the state as starsolver.encodeState()
+# The table is split into STRIPES stripes, each with its own lock: a
+# state's stripe comes from the CRC-32 of its bytes and it is stored in
+# that stripe by linear probing, so two workers only wait for each other
+# when they add states to the same stripe at the same time. The parent
+# slots let the main process read the solution back from the table.
+#
+# Work stealing: a worker whose frontier runs out raises its hungry flag
+# and waits on its inbox queue. Every SHARE_EVERY expansions, the busy
+# workers look at the flags and send every other state of their frontier
+# to a hungry worker. The search has run out of states when every worker
+# is hungry and no states are on their way to one.
+#
+# With more than one worker, the states are not expanded in exactly the
+# same order as by one search, so the solution may be a bit longer than
+# starsolver's (and with --weight 0 it isn't always the shortest).
+
+import argparse, heapq, multiprocessing, os, queue, struct, sys, time, zlib
+from multiprocessing import shared_memory
+
+import gameloader, starsolver
+
+game = gameloader.loadGame()
+
+DEFAULT_TABLE_SIZE = 1 << 22 # slots in the transposition table
+STRIPES = 256 # locks of the transposition table
+MAX_LOAD = 0.9 # a stripe is full when this much of its slots are used
+SHARE_EVERY = 64 # expansions between looks at the hungry flags
+STEAL_TIMEOUT = 0.01 # seconds a hungry worker waits on its inbox at a time
+
+SLOT = struct.Struct('<BBI')
+COUNT = struct.Struct('<I')
+NO_PARENT = 0xFFFFFFFF
+
+
+def makeTable(rules, tableSize, name=None):
+    """Returns a transposition table object for the level's states, in
+    new shared memory (or in the shared memory called name, made by
+    another process)."""
+    # See starsolver.encodeState(): 3 numbers plus one per star.
+    stateSize = (3 + rules['numStars']) * (2 if rules['wideCells'] else 1)
+    stripeSize = max(1, tableSize // STRIPES)
+    slotSize = SLOT.size + stateSize
+    size = COUNT.size * STRIPES + slotSize * stripeSize * STRIPES
+    if name is None:
+        memory = shared_memory.SharedMemory(create=True, size=size)
+        memory.buf[:size] = bytes(size) # the memory isn't always zeroed
+    else:
+        memory = shared_memory.SharedMemory(name=name)
+    return {'memory': memory,
+            'buf': memory.buf,
+            'stateSize': stateSize,
+            'slotSize': slotSize,
+            'stripeSize': stripeSize,
+            'maxUsed': max(1, int(stripeSize * MAX_LOAD)),
+            'firstSlot': COUNT.size * STRIPES} # byte offset of slot 0
+
+
+def addState(tableObj, locks, data, parentSlot, action):
+    """Adds the encoded state to the table if it isn't in it. Returns
+    (slot number, True if it was added); the slot number is -1 if the
+    state's stripe is full."""
+    stripeSize = tableObj['stripeSize']
+    slotSize = tableObj['slotSize']
+    buf = tableObj['buf']
+    crc = zlib.crc32(data)
+    stripe = crc % STRIPES
+    position = (crc // STRIPES) % stripeSize
+    with locks[stripe]:
+        for i in range(stripeSize):
+            slot = stripe * stripeSize + position
+            offset = tableObj['firstSlot'] + slot * slotSize
+            if buf[offset] == 0:
+                used = COUNT.unpack_from(buf, stripe * COUNT.size)[0]
+                if used >= tableObj['maxUsed']:
+                    return -1, False
+                COUNT.pack_into(buf, stripe * COUNT.size, used + 1)
+                buf[offset + SLOT.size:offset + slotSize] = data
+                SLOT.pack_into(buf, offset, 1, action, parentSlot)
+                return slot, True
+            if buf[offset + SLOT.size:offset + slotSize] == data:
+                return slot, False
+            position += 1
+            if position == stripeSize:
+                position = 0
+    return -1, False
+
+
+def getSlotParent(tableObj, slot):
+    """Returns (parent slot, action) of the state in the slot."""
+    used, action, parentSlot = SLOT.unpack_from(tableObj['buf'], tableObj['firstSlot'] + slot * tableObj['slotSize'])
+    return parentSlot, action
+
+
+def countStates(tableObj):
+    """Returns the number of states in the table."""
+    return sum(COUNT.unpack_from(tableObj['buf'], stripe * COUNT.size)[0] for stripe in range(STRIPES))
+
+
+def getSlotPath(tableObj, slot):
+    """Returns the list of actions that lead from the start state to the
+    state in the slot."""
+    actions = []
+    parentSlot, action = getSlotParent(tableObj, slot)
+    while parentSlot != NO_PARENT:
+        actions.append(starsolver.ACTIONS[action])
+        slot = parentSlot
+        parentSlot, action = getSlotParent(tableObj, slot)
+    actions.reverse()
+    return actions
+
+
+def runWorker(workerNum, levelObj, tableName, tableSize, weight, exhaustive, sharedObj):
+    """Worker process: searches from the states in its frontier (the start
+    state for worker 0) and from the states it steals, until the level is
+    solved, the table is full or every worker has run out of states."""
+    rules = starsolver.makeRules(levelObj)
+    tableObj = makeTable(rules, tableSize, tableName)
+    locks = sharedObj['locks']
+    hungry = sharedObj['hungry']
+    inboxes = sharedObj['inboxes']
+    done = sharedObj['done']
+    control = sharedObj['control']
+    numWorkers = len(inboxes)
+    for inbox in inboxes:
+        inbox.cancel_join_thread() # don't wait for states nobody will read
+
+    counter = 0 # breaks ties in the heap, in the order states were found
+    frontier = []
+    if workerNum == 0:
+        startState = starsolver.getStartState(levelObj)
+        frontier.append((0, 0, counter, sharedObj['startSlot'], startState))
+    expanded = 0
+
+    try:
+        while not done.is_set():
+            if not frontier:
+                frontier = stealStates(workerNum, sharedObj)
+                if frontier is None:
+                    break
+                continue
+
+            priority, depth, tie, slot, state = heapq.heappop(frontier)
+            expanded += 1
+            for action, newState in starsolver.getSuccessors(rules, state):
+                newSlot, added = addState(tableObj, locks, starsolver.encodeState(rules, newState), slot, starsolver.ACTIONS.index(action))
+                if newSlot < 0:
+                    finish(sharedObj, 'full')
+                    break
+                if not added:
+                    continue
+                if starsolver.isSolved(rules, newState):
+                    # The game ends there, so the state isn't expanded.
+                    with control.get_lock():
+                        if sharedObj['solvedSlot'].value < 0:
+                            sharedObj['solvedSlot'].value = newSlot
+                    if not exhaustive:
+                        finish(sharedObj, 'solved')
+                        break
+                    continue
+                counter += 1
+                heuristic = starsolver.getHeuristic(rules, newState)
+                heapq.heappush(frontier, (depth + 1 + weight * heuristic, depth + 1, counter, newSlot, newState))
+
+            if expanded % SHARE_EVERY == 0 and len(frontier) > 1:
+                for thief in range(numWorkers):
+                    if hungry[thief] and len(frontier) > 1:
+                        # Give away every other state, so both workers
+                        # keep some of the most promising ones.
+                        stolen = frontier[1::2]
+                        frontier = frontier[0::2]
+                        heapq.heapify(frontier)
+                        hungry[thief] = 0
+                        with control.get_lock():
+                            sharedObj['inFlight'].value += 1
+                        inboxes[thief].put(stolen)
+    except:
+        finish(sharedObj, 'error') # don't leave the other workers waiting
+        raise
+    finally:
+        sharedObj['results'].put((workerNum, expanded))
+        tableObj['buf'] = None
+        tableObj['memory'].close()
+
+
+def stealStates(workerNum, sharedObj):
+    """Waits until another worker sends states to this one. Returns the
+    new frontier, or None if the search is over."""
+    control = sharedObj['control']
+    numWorkers = len(sharedObj['inboxes'])
+    with control.get_lock():
+        control.value += 1 # one more idle worker
+    sharedObj['hungry'][workerNum] = 1
+    while True:
+        try:
+            stolen = sharedObj['inboxes'][workerNum].get(timeout=STEAL_TIMEOUT)
+        except queue.Empty:
+            if sharedObj['done'].is_set():
+                return None
+            with control.get_lock():
+                if control.value == numWorkers and sharedObj['inFlight'].value == 0:
+                    finish(sharedObj, 'exhausted')
+                    return None
+            sharedObj['hungry'][workerNum] = 1 # in case a sender cleared it and gave nothing
+            continue
+        with control.get_lock():
+            control.value -= 1
+            sharedObj['inFlight'].value -= 1
+        sharedObj['hungry'][workerNum] = 0
+        heapq.heapify(stolen)
+        return stolen
+
+
+def finish(sharedObj, status):
+    """Stops every worker. The first status given is kept."""
+    with sharedObj['control'].get_lock():
+        if not sharedObj['status'].value:
+            sharedObj['status'].value = status.encode('ascii')
+    sharedObj['done'].set()
+
+
+def solveParallel(levelObj, processes=None, weight=1.0, tableSize=DEFAULT_TABLE_SIZE, exhaustive=False):
+    """Searches the level with processes worker processes (one per core
+    by default). Returns a dict like starsolver.search()'s, with:
+        'solution': the list of actions, or None
+        'seen': how many different states were seen
+        'expanded': how many states had their successors generated
+        'complete': True if the search ran until it found a solution or
+                    ran out of states (so None means unsolvable)
+        'processes': how many worker processes were used"""
+    processes = processes or os.cpu_count() or 1
+    rules = starsolver.makeRules(levelObj)
+    startState = starsolver.getStartState(levelObj)
+    if starsolver.isSolved(rules, startState):
+        return {'solution': [], 'seen': 1, 'expanded': 0, 'complete': True, 'processes': processes}
+    tableObj = makeTable(rules, tableSize)
+    try:
+        locks = [multiprocessing.Lock() for i in range(STRIPES)]
+        startSlot, added = addState(tableObj, locks, starsolver.encodeState(rules, startState), NO_PARENT, 0)
+        sharedObj = {'locks': locks,
+                     'hungry': multiprocessing.Array('b', processes, lock=False),
+                     'inboxes': [multiprocessing.Queue() for i in range(processes)],
+                     'results': multiprocessing.Queue(),
+                     'done': multiprocessing.Event(),
+                     'control': multiprocessing.Value('i', 0), # idle workers; its lock guards the shared values
+                     'inFlight': multiprocessing.Value('i', 0, lock=False), # states sent but not received
+                     'status': multiprocessing.Array('c', 16, lock=False),
+                     'solvedSlot': multiprocessing.Value('q', -1, lock=False),
+                     'startSlot': startSlot}
+        workers = [multiprocessing.Process(target=runWorker, args=(i, levelObj, tableObj['memory'].name, tableSize,
+                                                                   weight, exhaustive, sharedObj))
+                   for i in range(processes)]
+        for worker in workers:
+            worker.start()
+        expanded = 0
+        for i in range(processes):
+            expanded += sharedObj['results'].get()[1]
+        for worker in workers:
+            worker.join()
+
+        status = sharedObj['status'].value.decode('ascii')
+        solvedSlot = sharedObj['solvedSlot'].value
+        return {'solution': getSlotPath(tableObj, solvedSlot) if solvedSlot >= 0 else None,
+                'seen': countStates(tableObj),
+                'expanded': expanded,
+                'complete': status in ('solved', 'exhausted'),
+                'processes': processes}
+    finally:
+        tableObj['buf'] = None
+        tableObj['memory'].close()
+        tableObj['memory'].unlink()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Solves one Star Pusher level with several processes.')
+    parser.add_argument('levelfile', nargs='?', default=gameloader.LEVELFILE)
+    parser.add_argument('--level', type=int, default=11, help='level to solve')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--weight', type=float, default=1.0, help='heuristic weight (0: breadth first)')
+    parser.add_argument('--table-size', type=int, default=DEFAULT_TABLE_SIZE, help='slots in the shared transposition table')
+    parser.add_argument('--exhaustive', action='store_true', help="don't stop at the first solution, see every reachable state")
+    parser.add_argument('--scaling', action='store_true', help='run with 1, 2, 4... processes and print the speedups')
+    args = parser.parse_args()
+
+    levelObj = game.readLevelsFile(args.levelfile)[args.level - 1]
+    rules = starsolver.makeRules(levelObj)
+    maxProcesses = args.processes or os.cpu_count() or 1
+    if args.scaling:
+        counts = [1]
+        while counts[-1] * 2 <= maxProcesses:
+            counts.append(counts[-1] * 2)
+        if counts[-1] != maxProcesses:
+            counts.append(maxProcesses)
+    else:
+        counts = [maxProcesses]
+
+    firstTime = None
+    for processes in counts:
+        startTime = time.time()
+        result = solveParallel(levelObj, processes, args.weight, args.table_size, args.exhaustive)
+        elapsed = time.time() - startTime
+        if firstTime is None:
+            firstTime = elapsed
+        solution = result['solution']
+        if solution is not None and not starsolver.isSolved(rules, starsolver.playActions(rules, starsolver.getStartState(levelObj), solution)[-1]):
+            print('The solution found is wrong!', file=sys.stderr)
+            return 1
+        print('Level %s, %s processes: %s, %s states seen, %s expanded, %.2f s (%.0f states/s, speedup %.2f)' % (
+              args.level, processes,
+              '%s actions' % (len(solution)) if solution is not None else ('no solution' if result['complete'] else 'stopped (table full)'),
+              result['seen'], result['expanded'], elapsed, result['seen'] / elapsed, firstTime / elapsed))
+        if solution is not None and not args.scaling:
+            print(' '.join(solution))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
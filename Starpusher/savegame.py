@@ -0,0 +1,216 @@
+# Star Pusher save games
+# Saves the session (the level being played, its game state and the list
+# of actions done in it) to a small binary file, and loads it again.
+#
+# The file is written by a background thread: autosave() only packs the
+# session into bytes (a few microseconds) and hands them over, so the
+# frame loop never waits for the disk. The file is replaced atomically,
+# so a crash while saving leaves the previous save.
+#
+# File format (all numbers little endian):
+#   header    4s B I I 20s I   'SPSV', FORMAT_VERSION, level number,
+#                              number of generated levels, SHA-1 of the
+#                              level's map (game.getLevelKey()), steps
+#   state     H H B B H H      player x, y, direction, flags (1: a star
+#                              is grabbed, 2: 'buttonPressed?'), grabbed
+#                              star x, y
+#   stars     I + 2H per star  in the same order as gameStateObj['stars']
+#   actions   I + 1 byte each  index in ACTIONS
+#   generated (I + UTF-8) each the text of the levels made by --endless
+
+import copy, os, struct, tempfile, threading
+
+import gameloader
+
+game = gameloader.loadGame()
+
+MAGIC = b'SPSV'
+FORMAT_VERSION = 1
+ACTIONS = ('up', 'left', 'down', 'right', 'turnleft', 'turnright', 'grab') # same as starsolver.ACTIONS
+
+HEADER = struct.Struct('<4sBII20sI')
+STATE = struct.Struct('<HHBBHH')
+COUNT = struct.Struct('<I')
+
+# The autosave thread's state.
+_lock = threading.Lock()
+_wakeUp = threading.Event()
+_thread = None
+_filename = None
+_sessionObj = None # the last session given to autosave()
+_pending = None # bytes waiting to be written
+_stopping = False
+
+
+def makeSession(levels, levelNum, gameStateObj, moveLog):
+    """Returns a session object. It holds the game's own objects (not
+    copies), so it is always up to date."""
+    return {'levels': levels,
+            'levelNum': levelNum,
+            'gameStateObj': gameStateObj,
+            'moveLog': moveLog}
+
+
+def packSession(sessionObj):
+    """Returns the session as bytes, in the save file format."""
+    levels = sessionObj['levels']
+    gameStateObj = sessionObj['gameStateObj']
+    generated = [levelObj['text'].encode('utf-8') for levelObj in levels if levelObj.get('generated')]
+
+    flags = 0
+    grabx = graby = 0
+    if gameStateObj['grabstar']:
+        flags |= 1
+        grabx, graby = gameStateObj['grabstar'][0]
+    if gameStateObj['buttonPressed?']:
+        flags |= 2
+    stars = gameStateObj['stars']
+    coordinates = [value for star in stars for value in star]
+
+    parts = [HEADER.pack(MAGIC, FORMAT_VERSION, sessionObj['levelNum'], len(generated),
+                         bytes.fromhex(game.getLevelKey(levels[sessionObj['levelNum']])),
+                         gameStateObj['stepCounter']),
+             STATE.pack(gameStateObj['player'][0], gameStateObj['player'][1], gameStateObj['playerdirection'],
+                        flags, grabx, graby),
+             COUNT.pack(len(stars)),
+             struct.pack('<%sH' % len(coordinates), *coordinates),
+             COUNT.pack(len(sessionObj['moveLog'])),
+             bytes(ACTIONS.index(action) for action in sessionObj['moveLog'])]
+    for text in generated:
+        parts.append(COUNT.pack(len(text)))
+        parts.append(text)
+    return b''.join(parts)
+
+
+def unpackSession(data):
+    """Returns a saved session object made from the bytes: a dict with
+    the 'levelNum', 'levelKey', 'moveLog', 'generated' (the texts of the
+    generated levels) and the parts of the game state that change."""
+    magic, version, levelNum, numGenerated, levelKey, stepCounter = HEADER.unpack_from(data, 0)
+    assert magic == MAGIC and version == FORMAT_VERSION, 'Not a Star Pusher save file of version %s.' % FORMAT_VERSION
+    offset = HEADER.size
+    playerx, playery, direction, flags, grabx, graby = STATE.unpack_from(data, offset)
+    offset += STATE.size
+
+    numStars = COUNT.unpack_from(data, offset)[0]
+    offset += COUNT.size
+    coordinates = struct.unpack_from('<%sH' % (numStars * 2), data, offset)
+    offset += numStars * 4
+    numActions = COUNT.unpack_from(data, offset)[0]
+    offset += COUNT.size
+    moveLog = [ACTIONS[code] for code in data[offset:offset + numActions]]
+    offset += numActions
+
+    generated = []
+    for i in range(numGenerated):
+        length = COUNT.unpack_from(data, offset)[0]
+        offset += COUNT.size
+        generated.append(data[offset:offset + length].decode('utf-8'))
+        offset += length
+    assert offset == len(data), 'The save file has the wrong length.'
+
+    return {'levelNum': levelNum,
+            'levelKey': levelKey.hex(),
+            'player': (playerx, playery),
+            'playerdirection': direction,
+            'stepCounter': stepCounter,
+            'stars': [(coordinates[i], coordinates[i + 1]) for i in range(0, len(coordinates), 2)],
+            'grabstar': [(grabx, graby)] if flags & 1 else [],
+            'buttonPressed?': bool(flags & 2),
+            'moveLog': moveLog,
+            'generated': generated}
+
+
+def restoreGameState(levelObj, savedObj):
+    """Returns the game state object of the saved session, or None if it
+    was saved on a level that isn't the same as levelObj any more."""
+    if savedObj is None or savedObj['levelKey'] != game.getLevelKey(levelObj):
+        return None
+    gameStateObj = copy.deepcopy(levelObj['startState'])
+    for key in ('player', 'playerdirection', 'stepCounter', 'stars', 'grabstar', 'buttonPressed?'):
+        gameStateObj[key] = copy.deepcopy(savedObj[key])
+    return gameStateObj
+
+
+def loadSession(filename):
+    """Returns the saved session object in the file, or None if there is
+    no save file or it can't be read."""
+    try:
+        with open(filename, 'rb') as saveFile:
+            return unpackSession(saveFile.read())
+    except (OSError, AssertionError, struct.error, IndexError, UnicodeDecodeError):
+        return None
+
+
+def writeFile(filename, data):
+    """Writes the bytes to the file atomically: to a temporary file in
+    the same folder first, which then replaces the file."""
+    fd, tempName = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tempFile:
+            tempFile.write(data)
+            tempFile.flush()
+            os.fsync(tempFile.fileno())
+        os.replace(tempName, filename)
+    except OSError:
+        if os.path.exists(tempName):
+            os.remove(tempName)
+        raise
+
+
+def startAutosave(filename):
+    """Starts the autosave thread, which writes to filename."""
+    global _thread, _filename, _stopping
+    _filename = filename
+    _stopping = False
+    _thread = threading.Thread(target=runAutosave)
+    _thread.daemon = True
+    _thread.start()
+
+
+def autosave(sessionObj):
+    """Packs the session and lets the autosave thread write it. Never
+    waits for the disk; if the thread is still busy with an older save,
+    only the newest one is written after it."""
+    global _sessionObj, _pending
+    data = packSession(sessionObj)
+    with _lock:
+        _sessionObj = sessionObj
+        _pending = data
+    _wakeUp.set()
+
+
+def runAutosave():
+    """The autosave thread: writes the pending bytes whenever there are
+    some."""
+    global _pending
+    while True:
+        _wakeUp.wait()
+        _wakeUp.clear()
+        with _lock:
+            data = _pending
+            _pending = None
+            stopping = _stopping
+        if data is not None:
+            try:
+                writeFile(_filename, data)
+            except OSError:
+                pass # try again with the next save
+        if stopping:
+            return
+
+
+def stopAutosave():
+    """Stops the autosave thread and saves the last session as it is now
+    (it may have changed since its last autosave()). Does nothing if the
+    autosave thread isn't running."""
+    global _thread, _stopping
+    if _thread is None:
+        return
+    with _lock:
+        _stopping = True
+    _wakeUp.set()
+    _thread.join()
+    _thread = None
+    if _sessionObj is not None:
+        writeFile(_filename, packSession(_sessionObj))
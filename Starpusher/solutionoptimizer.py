@@ -0,0 +1,301 @@
+# Star Pusher solution optimizer
+# Takes the lists of actions players solved levels with (which are rarely
+# the shortest) and makes them shorter, by looking for shortcuts along the
+# way. Many lists are optimized at once, one per worker process.
+#
+# Usage:
+#   python solutionoptimizer.py SEQUENCES [--levelfile FILE] [-o FILE]
+#                               [--window N] [--max-states N] [--processes N]
+#   python solutionoptimizer.py --save starpusher.sav [--levelfile FILE]
+#
+# The sequence file has one list of actions per line: the level number,
+# then the actions (the names in starsolver.ACTIONS), separated by spaces.
+# Empty lines and lines starting with # are skipped. -o writes the shorter
+# lists in the same format. --save takes the actions of the level being
+# played in a save file instead (see savegame.py).
+#
+# A list is made shorter in passes, until a pass finds nothing more:
+#   * the actions between two visits of the same state are cut, and so
+#     are the actions that change nothing (walking into a wall...), and
+#     the actions after the level is solved,
+#   * each turn (W, X) and grab or let go (SPACE) is left out, alone or
+#     with the next one that undoes it, if the player is back on the
+#     old path within --window actions,
+#   * from each state of the list, a breadth first search of up to
+#     --window actions (and --max-states states) looks for a later state
+#     of the list (or any solved state, if the list solves the level) that
+#     can be reached in fewer actions than the list takes.
+# The new list is played again from the start with the game's rules; if it
+# doesn't end in the same state (or a solved one), the old list is kept.
+
+import argparse, multiprocessing, os, sys, time
+
+import gameloader, levelanalyzer, savegame, starsolver
+
+game = gameloader.loadGame()
+
+DEFAULT_WINDOW = 12 # actions a shortcut may be found within
+DEFAULT_MAX_STATES = 2000 # states each shortcut search may look at
+UNDOES = {'turnleft': 'turnright', 'turnright': 'turnleft', 'grab': 'grab'}
+
+
+def doAction(rules, state, action):
+    """Returns the state after the action, with the game's rules (the
+    same state if the action changes nothing)."""
+    gameStateObj = starsolver.toGameState(rules, state)
+    starsolver.applyAction(rules['mapObj'], gameStateObj, action)
+    return starsolver.fromGameState(gameStateObj)
+
+
+def isDone(rules, state, endState, solves):
+    """Returns True if the state is where a list of actions should end."""
+    if solves:
+        return starsolver.isSolved(rules, state)
+    return state == endState
+
+
+def cutLoops(rules, states, actions, solves):
+    """Returns (states, actions) without the actions after the end, the
+    ones that change nothing, and the loops back to an earlier state."""
+    end = len(actions)
+    if solves:
+        end = min(i for i in range(len(states)) if starsolver.isSolved(rules, states[i]))
+    # Jump from each state to the last time the list is in it.
+    lastVisit = {}
+    for i in range(end + 1):
+        lastVisit[states[i]] = i
+    newStates = [states[0]]
+    newActions = []
+    i = lastVisit[states[0]]
+    while i < end:
+        newActions.append(actions[i])
+        i = lastVisit[states[i + 1]]
+        newStates.append(states[i])
+    return newStates, newActions
+
+
+def dropActions(rules, states, actions, window):
+    """Returns (states, actions) with the turns and grabs that are not
+    needed left out: a turn or grab (and maybe the next action that undoes
+    it) is not needed if the player still gets back to a state of the
+    list within window actions."""
+    i = 0
+    newActions = []
+    while i < len(actions):
+        rejoin = None
+        if actions[i] in UNDOES:
+            skips = [(i,)]
+            for j in range(i + 1, min(len(actions), i + window)):
+                if actions[j] == UNDOES[actions[i]]:
+                    skips.append((i, j))
+                    break
+            for skip in skips:
+                rejoin = getRejoin(rules, states, actions, skip, window)
+                if rejoin is not None:
+                    break
+        if rejoin is None:
+            newActions.append(actions[i])
+            i += 1
+        else:
+            newActions.extend(actions[k] for k in range(i, rejoin) if k not in skip)
+            i = rejoin
+    return starsolver.playActions(rules, states[0], newActions), newActions
+
+
+def getRejoin(rules, states, actions, skip, window):
+    """Returns the index of the list's state that the player is in after
+    doing the actions from skip[0] on without the ones in skip, if it is
+    the same as where the list itself is then, within window actions; or
+    None."""
+    state = states[skip[0]]
+    for k in range(skip[0], min(len(actions), skip[0] + window)):
+        if k in skip:
+            continue
+        state = doAction(rules, state, actions[k])
+        if k > skip[-1] and state == states[k + 1]:
+            return k + 1
+    return None
+
+
+def findShortcut(rules, states, start, stateIndex, solves, window, maxStates):
+    """Returns (index, actions): the actions that go from the list's state
+    number start to its state number index (the end, if they solve the
+    level) in fewer actions than the list takes, saving the most actions;
+    or None if the search finds no shortcut."""
+    end = len(states) - 1
+    parents = {states[start]: None}
+    layer = [states[start]]
+    best = None # (actions saved, index, state)
+    for depth in range(1, window + 1):
+        nextLayer = []
+        for state in layer:
+            for action, newState in starsolver.getSuccessors(rules, state):
+                if newState in parents:
+                    continue
+                parents[newState] = (state, action)
+                nextLayer.append(newState)
+                if solves and starsolver.isSolved(rules, newState):
+                    index = end
+                else:
+                    index = stateIndex.get(newState, -1)
+                if index - start - depth > 0 and (best is None or index - start - depth > best[0]):
+                    best = (index - start - depth, index, newState)
+            if len(parents) >= maxStates:
+                break
+        if len(parents) >= maxStates:
+            break
+        layer = nextLayer
+    if best is None:
+        return None
+    shortcut = []
+    state = best[2]
+    while parents[state] is not None:
+        state, action = parents[state]
+        shortcut.append(action)
+    shortcut.reverse()
+    return best[1], shortcut
+
+
+def takeShortcuts(rules, states, actions, solves, window, maxStates):
+    """Returns (states, actions) with every shortcut findShortcut() finds
+    taken, going from the start to the end."""
+    stateIndex = dict((states[i], i) for i in range(len(states)))
+    newActions = []
+    i = 0
+    while i < len(actions):
+        shortcut = findShortcut(rules, states, i, stateIndex, solves, window, maxStates)
+        if shortcut is None:
+            newActions.append(actions[i])
+            i += 1
+        else:
+            i, shortcutActions = shortcut
+            newActions.extend(shortcutActions)
+    return starsolver.playActions(rules, states[0], newActions), newActions
+
+
+def optimizeSequence(levelObj, actions, window=DEFAULT_WINDOW, maxStates=DEFAULT_MAX_STATES):
+    """Returns a dict with a list of actions for the level that ends where
+    the given list does (or solves the level, if it does), but is shorter
+    if the optimizer can make it:
+        'actions': the new list
+        'before', 'after': the number of actions of the old and new list
+        'countsBefore', 'countsAfter': (moves, pushes, grabs, turns) of
+                         each (see levelanalyzer.countActions())
+        'solves': True if the list solves the level
+        'verified': True if the new list was played again and ends in the
+                    right state (if not, it is the old list)"""
+    rules = starsolver.makeRules(levelObj)
+    startState = starsolver.getStartState(levelObj)
+    states = starsolver.playActions(rules, startState, actions)
+    solves = any(starsolver.isSolved(rules, state) for state in states)
+    endState = states[-1]
+
+    newStates, newActions = cutLoops(rules, states, actions, solves)
+    while True:
+        length = len(newActions)
+        newStates, newActions = dropActions(rules, newStates, newActions, window)
+        newStates, newActions = cutLoops(rules, newStates, newActions, solves)
+        newStates, newActions = takeShortcuts(rules, newStates, newActions, solves, window, maxStates)
+        newStates, newActions = cutLoops(rules, newStates, newActions, solves)
+        if len(newActions) >= length:
+            break
+
+    # Check the new list with the game's rules, from the start.
+    verified = isDone(rules, starsolver.playActions(rules, startState, newActions)[-1], endState, solves)
+    if not verified or len(newActions) > len(actions):
+        newActions = list(actions)
+    return {'actions': newActions,
+            'before': len(actions),
+            'after': len(newActions),
+            'countsBefore': levelanalyzer.countActions(rules, startState, list(actions)),
+            'countsAfter': levelanalyzer.countActions(rules, startState, newActions),
+            'solves': solves,
+            'verified': verified}
+
+
+def optimizeTask(task):
+    """Worker function: optimizes one list of actions."""
+    levelObj, actions, window, maxStates = task
+    return optimizeSequence(levelObj, actions, window, maxStates)
+
+
+def optimizeSequences(levels, sequences, processes=None, window=DEFAULT_WINDOW, maxStates=DEFAULT_MAX_STATES):
+    """Optimizes a list of (level number, actions), each with
+    optimizeSequence(), in parallel. Yields the results, in order."""
+    tasks = [(levels[levelNum - 1], actions, window, maxStates) for levelNum, actions in sequences]
+    processes = processes or os.cpu_count() or 1
+    if processes == 1:
+        for task in tasks:
+            yield optimizeTask(task)
+        return
+    with multiprocessing.Pool(processes) as pool:
+        for result in pool.imap(optimizeTask, tasks):
+            yield result
+
+
+def readSequences(filename):
+    """Returns the list of (level number, actions) in a sequence file."""
+    sequences = []
+    with open(filename) as sequenceFile:
+        for lineNum, line in enumerate(sequenceFile, 1):
+            words = line.split()
+            if not words or words[0].startswith('#'):
+                continue
+            assert words[0].isdigit(), 'Line %s: the line must start with a level number.' % (lineNum)
+            for action in words[1:]:
+                assert action in starsolver.ACTIONS, 'Line %s: unknown action %r.' % (lineNum, action)
+            sequences.append((int(words[0]), words[1:]))
+    return sequences
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Makes lists of actions that solve Star Pusher levels shorter.')
+    parser.add_argument('sequences', nargs='?', help='file of lists of actions, one per line: level number, then actions')
+    parser.add_argument('--save', default=None, help='optimize the actions of a save file instead')
+    parser.add_argument('--levelfile', default=gameloader.LEVELFILE)
+    parser.add_argument('-o', '--output', default=None, help='file to write the shorter lists to')
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW, help='actions a shortcut may be found within')
+    parser.add_argument('--max-states', type=int, default=DEFAULT_MAX_STATES, help='states each shortcut search may look at')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes (default: one per core)')
+    args = parser.parse_args()
+
+    levels = game.readLevelsFile(args.levelfile)
+    try:
+        if args.save is not None:
+            savedObj = savegame.loadSession(args.save)
+            assert savedObj is not None, 'Could not read the save file %s.' % (args.save)
+            assert savedObj['levelNum'] < len(levels), 'The save file is on a generated level.'
+            sequences = [(savedObj['levelNum'] + 1, savedObj['moveLog'])]
+        elif args.sequences is not None:
+            sequences = readSequences(args.sequences)
+        else:
+            parser.error('give a sequence file or --save')
+        for levelNum, actions in sequences:
+            assert 1 <= levelNum <= len(levels), 'There is no level %s in %s.' % (levelNum, args.levelfile)
+    except AssertionError as error:
+        print(error, file=sys.stderr)
+        return 1
+
+    startTime = time.time()
+    outFile = open(args.output, 'w') if args.output is not None else None
+    try:
+        saved = 0
+        results = optimizeSequences(levels, sequences, args.processes, args.window, args.max_states)
+        for (levelNum, actions), result in zip(sequences, results):
+            saved += result['before'] - result['after']
+            counts = ', '.join('%s %s -> %s' % (name, before, after) for name, before, after in
+                               zip(('moves', 'pushes', 'grabs', 'turns'), result['countsBefore'], result['countsAfter']))
+            print('Level %s: %s -> %s actions (%+d)%s: %s' % (
+                  levelNum, result['before'], result['after'], result['after'] - result['before'],
+                  '' if result['solves'] else ', not solved', counts))
+            if outFile is not None:
+                outFile.write('%s %s\n' % (levelNum, ' '.join(result['actions'])))
+    finally:
+        if outFile is not None:
+            outFile.close()
+    print('%s actions saved in %s lists, %.1f s' % (saved, len(sequences), time.time() - startTime))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,9 +3,11 @@
 # http://inventwithpython.com/pygame
 # Released under a "Simplified BSD" license
 
-import random, sys, copy, os, pygame
+import random, sys, copy, os, time, hashlib, json, tempfile, threading, pygame
+from collections import OrderedDict
 from pygame.locals import *
 from pygame import mixer
+import frameprofiler, gpurenderer, hintengine, levelformats, levelgenerator, levelprefetch, levelselect, levelwatcher, macromoves, savegame, starsolver
 
 
 FPS = 30 # frames per second to update the screen
@@ -21,15 +23,101 @@ TILEFLOORHEIGHT = 40
 
 CAM_MOVE_SPEED = 5 # how many pixels per frame the camera moves
 
+# The map is drawn in square chunks of CHUNK_TILES x CHUNK_TILES tiles so
+# that huge levels never need one giant Surface. Only the chunks that are
+# on the screen (or within CHUNK_MARGIN pixels of it) are drawn, and the
+# least recently used chunks are thrown away once the cached chunks use
+# more than CHUNK_CACHE_BYTES of memory.
+CHUNK_TILES = 8
+CHUNK_MARGIN = 100
+CHUNK_CACHE_BYTES = 16 * 1024 * 1024
+
+# + and - (or the mouse wheel) zoom the map in and out, through
+# ZOOM_LEVELS. Each zoom has its own chunk cache, whose chunks are drawn
+# with a copy of the tiles scaled once for that zoom (see getScaledTiles()),
+# and cover more tiles when zoomed out (up to twice CHUNK_TILES) so that
+# fewer of them are blitted. The chunk caches of the last ZOOM_CACHES
+# zooms used are kept, so going back to a zoom doesn't draw its chunks
+# again, and so are the scaled tiles of the last SCALED_TILE_SETS zooms.
+# A chunk cache made by zooming draws its new chunks for CHUNK_DRAW_TIME
+# seconds per frame and leaves the rest to the next frames, as zoomed out
+# there can be too many chunks on the screen to draw them in one frame.
+ZOOM_LEVELS = (0.25, 0.35, 0.5, 0.7, 1.0, 1.4)
+DEFAULT_ZOOM = 4 # the index of 1.0 in ZOOM_LEVELS
+ZOOM_CACHES = 3
+SCALED_TILE_SETS = 4
+CHUNK_DRAW_TIME = 0.008
+
+# While the camera stays still, a frame only redraws (and passes to
+# pygame.display.update()) the parts of the window that changed: the
+# spaces whose pieces changed and the text, outlines and images over the
+# map that changed or moved. A frame where nothing changed costs nothing.
+
+# F3 shows the profiler overlay. F4 writes the section times of the next
+# PROFILE_FRAMES frames to a CSV file and F5 runs cProfile over them.
+PROFILE_FRAMES = 300
+
 # The percentage of outdoor tiles that have additional
 # decoration on them, such as a tree or rock.
 OUTSIDE_DECORATION_PCT = 20
 
+# Each level is decorated once, with a random seed that comes from the
+# level's map, so the scenery stays the same when the level is reset or
+# visited again. The decorated maps are also saved in a file next to the
+# level file (the level file name + DECORATION_FILE_SUFFIX) so that they
+# don't have to be computed again the next time the game starts; the file
+# is written when the game quits. Set it to None to only keep them in
+# memory.
+DECORATION_FILE_SUFFIX = '.deco'
+
+# The session (the level, where everything is on it and the actions done)
+# is saved to SAVE_FILE every AUTOSAVE_MOVES actions, at the start of each
+# level and when the game quits, and is resumed when the game starts
+# again. Start with --new on the command line to ignore the saved session.
+SAVE_FILE = 'starpusher.sav'
+AUTOSAVE_MOVES = 10
+
+# Clicking a space walks the player there. Clicking a star selects it, and
+# clicking a space after that takes the star there (see macromoves.py; its
+# search runs a little per frame, so a long one doesn't stop the game).
+# The actions are played one every MACRO_STEP_TIME seconds, or all at once
+# (with a single redraw) if Shift is held while clicking. A right click, or
+# any key that moves the player, cancels them.
+MACRO_STEP_TIME = 0.08
+
+# Start with --gpu on the command line to draw with SDL2's renderer and
+# textures (see gpurenderer.py) instead of blitting Surface objects. If
+# no renderer can be made, the game draws with Surfaces as usual.
+GPU = None # the gpurenderer object, when drawing with --gpu
+
+# The level file is watched while the game runs (see levelwatcher.py):
+# when it is saved, the levels that changed are read again, and the level
+# being played starts again if it is one of them.
+LEVELWATCHER = None # the levelwatcher object
+
+# L shows the level select screen (see levelselect.py). Its thumbnails are
+# drawn by a thread, started the first time the screen is shown.
+THUMBNAILER = None # the levelselect thumbnailer object
+
+# The next and previous levels are made ready in advance, during the frames
+# where the player does nothing, so going to them takes less than a frame
+# (see levelprefetch.py).
+PREFETCHER = None # the levelprefetch object
+
+# With --endless, the level after the last one is generated by a thread
+# while the last one is played, so going to it doesn't wait for the level
+# generator. The generator is given ENDLESS_TRIES seeds; if none of them
+# makes a level, the game goes back to the first level.
+ENDLESS_TRIES = 5
+ENDLESSLEVEL = None # the endless level object being made (see startEndlessLevel())
+
 BRIGHTBLUE = (  0, 170, 255)
 DARKBLUE = (27, 120, 133)
 WHITE      = (255, 255, 255)
 BGCOLOR = DARKBLUE
 TEXTCOLOR = WHITE
+HINTCOLOR = (255, 255, 0)
+SELECTCOLOR = BRIGHTBLUE
 
 UP = 'up'
 DOWN = 'down'
@@ -38,7 +126,7 @@ RIGHT = 'right'
 
 
 def main():
-    global FPSCLOCK, DISPLAYSURF, IMAGESDICT, TILEMAPPING, OUTSIDEDECOMAPPING, BASICFONT, PLAYERIMAGES, currentImage
+    global FPSCLOCK, DISPLAYSURF, BASICFONT, PROFILERFONT, showProfiler, GPU, LEVELWATCHER, THUMBNAILER, PREFETCHER
     # Starting the mixer
     mixer.init()
     # Loading the song
@@ -51,14 +139,151 @@ def main():
     pygame.init()
     FPSCLOCK = pygame.time.Clock()
 
-    # Because the Surface object stored in DISPLAYSURF was returned
-    # from the pygame.display.set_mode() function, this is the
-    # Surface object that is drawn to the actual computer screen
-    # when pygame.display.update() is called.
-    DISPLAYSURF = pygame.display.set_mode((WINWIDTH, WINHEIGHT))
+    if '--gpu' in sys.argv[1:]:
+        GPU = gpurenderer.makeGpu('Star Pusher', (WINWIDTH, WINHEIGHT))
+        if GPU is None:
+            print('No SDL2 renderer could be made, drawing with Surfaces.')
+    if GPU is not None:
+        # The GPU renderer has its own window. DISPLAYSURF is only used by
+        # the screens that aren't levels, and is copied to the window by
+        # updateDisplay().
+        DISPLAYSURF = pygame.Surface((WINWIDTH, WINHEIGHT))
+    else:
+        # Because the Surface object stored in DISPLAYSURF was returned
+        # from the pygame.display.set_mode() function, this is the
+        # Surface object that is drawn to the actual computer screen
+        # when pygame.display.update() is called.
+        DISPLAYSURF = pygame.display.set_mode((WINWIDTH, WINHEIGHT))
+        pygame.display.set_caption('Star Pusher')
 
-    pygame.display.set_caption('Star Pusher')
     BASICFONT = pygame.font.Font('freesansbold.ttf', 18)
+    PROFILERFONT = pygame.font.Font('freesansbold.ttf', 12)
+    showProfiler = False # toggled with F3 in runLevel()
+
+    loadImages()
+
+    startScreen() # show the title screen until the user presses a key
+
+    # Read in the levels from the text file. See the readLevelsFile() for
+    # details on the format of this file and how to make your own levels.
+    # --levels FILE plays another level file, or a collection in another
+    # Sokoban program's format (see levelformats.py).
+    levelFile = 'starPusherLevels.txt'
+    if '--levels' in sys.argv[1:-1]:
+        levelFile = sys.argv[sys.argv.index('--levels') + 1]
+    levels = readLevelsFile(levelFile)
+    loadDecorations(levelFile)
+    if levelformats.getFormat(levelFile) == 'txt':
+        LEVELWATCHER = levelwatcher.makeWatcher(levelFile, levels)
+    PREFETCHER = levelprefetch.makePrefetcher()
+    currentLevelIndex = 0
+
+    # With --endless on the command line, new levels are generated after
+    # the last one instead of going back to the first level.
+    endless = '--endless' in sys.argv[1:]
+
+    # Resume the saved session, if there is one.
+    savedObj = None
+    if '--new' not in sys.argv[1:]:
+        savedObj = savegame.loadSession(SAVE_FILE)
+    if savedObj is not None:
+        for text in savedObj['generated']:
+            levelObj = parseLevels(text.splitlines(True), 'the endless mode', len(levels))[0]
+            levelObj['generated'] = True
+            levelObj['text'] = text
+            levels.append(levelObj)
+        currentLevelIndex = min(savedObj['levelNum'], len(levels) - 1)
+    savegame.startAutosave(SAVE_FILE)
+
+    # The main game loop. This loop runs a single level, when the user
+    # finishes that level, the next/previous level is loaded.
+    while True: # main game loop
+        if endless and currentLevelIndex == len(levels) - 1:
+            startEndlessLevel(levels) # the next level is made while this one is played
+
+        # Run the level to actually start playing the game:
+        result = runLevel(levels, currentLevelIndex, savedObj)
+        savedObj = None # only the first level is resumed
+
+        if result in ('solved', 'next'):
+            # Go to the next level.
+            currentLevelIndex += 1
+            if currentLevelIndex >= len(levels):
+                levelObj = takeEndlessLevel(levels) if endless else None
+                if levelObj is not None:
+                    levels.append(levelObj)
+                else:
+                    # If there are no more levels, go back to the first one.
+                    currentLevelIndex = 0
+        elif result == 'back':
+            # Go to the previous level.
+            currentLevelIndex -= 1
+            if currentLevelIndex < 0:
+                # If there are no previous levels, go to the last one.
+                currentLevelIndex = len(levels)-1
+        elif result == 'reset':
+            pass # Do nothing. Loop re-calls runLevel() to reset the level
+        elif result == 'reload':
+            # The level changed in the level file, play the new one (or the
+            # last level, if levels were taken out).
+            currentLevelIndex = min(currentLevelIndex, len(levels) - 1)
+        elif result == 'select':
+            # Let the player pick the level on the level select screen.
+            if THUMBNAILER is None:
+                THUMBNAILER = levelselect.makeThumbnailer()
+            levelNum = levelselect.selectLevel(THUMBNAILER, levels, currentLevelIndex)
+            if levelNum is not None:
+                currentLevelIndex = levelNum
+
+
+def startEndlessLevel(levels):
+    """Starts a thread that makes the next level of the endless mode with
+    the level generator (so it is solvable), unless one is already being
+    made. The more levels have been generated, the more stars they have."""
+    global ENDLESSLEVEL
+
+    if ENDLESSLEVEL is not None:
+        return
+    numGenerated = len([levelObj for levelObj in levels if levelObj.get('generated')])
+    numStars = min(5, 2 + numGenerated // 5)
+    ENDLESSLEVEL = {'text': None} # the level's text, once it is made
+    ENDLESSLEVEL['thread'] = threading.Thread(target=runEndlessLevel, args=(ENDLESSLEVEL, numStars))
+    ENDLESSLEVEL['thread'].daemon = True # don't keep the game running when it quits
+    ENDLESSLEVEL['thread'].start()
+
+
+def runEndlessLevel(endlessObj, numStars):
+    """The endless level thread: tries up to ENDLESS_TRIES seeds."""
+    for tryNum in range(ENDLESS_TRIES):
+        result = levelgenerator.generateLevel(random.randrange(2 ** 32), numStars)
+        if result is not None:
+            endlessObj['text'] = result[0]
+            return
+
+
+def takeEndlessLevel(levels):
+    """Returns the new level object for the endless mode made by the
+    thread (waiting for it if it isn't done yet), or None if the level
+    generator didn't make one."""
+    global ENDLESSLEVEL
+
+    startEndlessLevel(levels)
+    ENDLESSLEVEL['thread'].join()
+    text = ENDLESSLEVEL['text']
+    ENDLESSLEVEL = None
+    if text is None:
+        return None
+    levelObj = parseLevels(text.splitlines(True), 'the endless mode', len(levels))[0]
+    levelObj['generated'] = True
+    levelObj['text'] = text # for the save file
+    return levelObj
+
+
+def loadImages():
+    """Loads the tile and sprite images into the IMAGESDICT, TILEMAPPING,
+    OUTSIDEDECOMAPPING and PLAYERIMAGES global variables. pygame must be
+    initialized first."""
+    global IMAGESDICT, TILEMAPPING, OUTSIDEDECOMAPPING, PLAYERIMAGES, currentImage
 
     # A global dict value that will contain all the Pygame
     # Surface objects returned by pygame.image.load().
@@ -111,53 +336,40 @@ def main():
                     IMAGESDICT['down'],
                     IMAGESDICT['right']]
 
-    startScreen() # show the title screen until the user presses a key
-
-    # Read in the levels from the text file. See the readLevelsFile() for
-    # details on the format of this file and how to make your own levels.
-    levels = readLevelsFile('starPusherLevels.txt')
-    currentLevelIndex = 0
-
-    # The main game loop. This loop runs a single level, when the user
-    # finishes that level, the next/previous level is loaded.
-    while True: # main game loop
-        # Run the level to actually start playing the game:
-        result = runLevel(levels, currentLevelIndex)
-
-        if result in ('solved', 'next'):
-            # Go to the next level.
-            currentLevelIndex += 1
-            if currentLevelIndex >= len(levels):
-                # If there are no more levels, go back to the first one.
-                currentLevelIndex = 0
-        elif result == 'back':
-            # Go to the previous level.
-            currentLevelIndex -= 1
-            if currentLevelIndex < 0:
-                # If there are no previous levels, go to the last one.
-                currentLevelIndex = len(levels)-1
-        elif result == 'reset':
-            pass # Do nothing. Loop re-calls runLevel() to reset the level
-
 
-def runLevel(levels, levelNum):
-    global currentImage
+def runLevel(levels, levelNum, savedObj=None):
+    global showProfiler
     levelObj = levels[levelNum]
-    mapObj = decorateMap(levelObj['mapObj'], levelObj['startState']['player'])
-    gameStateObj = copy.deepcopy(levelObj['startState'])
-    mapNeedsRedraw = True # set to True to call drawMap()
-    levelSurf = BASICFONT.render('Level %s of %s' % (levelNum + 1, len(levels)), 1, TEXTCOLOR)
-    levelRect = levelSurf.get_rect()
-    levelRect.bottomleft = (20, WINHEIGHT - 35)
-    mapWidth = len(mapObj) * TILEWIDTH
-    mapHeight = (len(mapObj[0]) - 1) * TILEFLOORHEIGHT + TILEHEIGHT
-    MAX_CAM_X_PAN = abs(HALF_WINHEIGHT - int(mapHeight / 2)) + TILEWIDTH
-    MAX_CAM_Y_PAN = abs(HALF_WINWIDTH - int(mapWidth / 2)) + TILEHEIGHT
-
-    levelIsComplete = False
-    # Track how much the camera has moved:
-    cameraOffsetX = 0
-    cameraOffsetY = 0
+    # The decorated map, the hint engine's bound, the walk graph and the
+    # start's chunks, made in advance if the level was prefetched.
+    preparedObj = levelprefetch.takeLevel(PREFETCHER, levels, levelNum)
+    hintObj = hintengine.makeHintEngine(levelObj, preparedObj['boundObj'])
+    showHint = False # H shows the hint for the next move
+    mapObj = preparedObj['mapObj']
+    # Start where the saved session (if any) was, or at the start.
+    gameStateObj = savegame.restoreGameState(levelObj, savedObj)
+    moveLog = list(savedObj['moveLog']) if gameStateObj is not None else [] # actions done, as in savegame.ACTIONS
+    chunkCache = None
+    if gameStateObj is None:
+        gameStateObj = preparedObj['gameStateObj']
+        chunkCache = levelprefetch.getChunkCache(preparedObj)
+    sessionObj = savegame.makeSession(levels, levelNum, gameStateObj, moveLog)
+    savegame.autosave(sessionObj)
+    savedMoves = len(moveLog) # actions in the last autosave
+    viewObj = makeLevelView(levels, levelNum, mapObj, gameStateObj, chunkCache)
+    mapNeedsRedraw = False # set to True to redraw the chunks that changed
+
+    # The mouse's macro moves.
+    graphObj = preparedObj['graphObj']
+    selectedStar = None # the (x, y) of the star clicked on, if any
+    macroActions = [] # actions still to play
+    macroSearch = None # the star move being searched (see macromoves.makeStarMove())
+    macroTime = 0 # time.time() at which to play the next one
+    macroAll = False # True to play them all in one frame
+
+    # A session saved on the "Solved!" screen resumes there, so any key
+    # goes on to the next level.
+    levelIsComplete = isLevelFinished(levelObj, gameStateObj)
     # Track if the keys to move the camera are being held down:
     cameraUp = False
     cameraDown = False
@@ -165,6 +377,10 @@ def runLevel(levels, levelNum):
     cameraRight = False
 
     while True: # main game loop
+        frameprofiler.startFrame()
+        if LEVELWATCHER is not None and levelNum in levelwatcher.checkWatcher(LEVELWATCHER, levels):
+            hintengine.stopHintEngine(hintObj)
+            return 'reload'
         # Reset these variables:
         playerTurn = None
         playerMoveTo = -1
@@ -204,9 +420,14 @@ def runLevel(levels, levelNum):
                     playerTurn = RIGHT    
 
                 elif event.key == K_n:
+                    hintengine.stopHintEngine(hintObj)
                     return 'next'
                 elif event.key == K_b:
+                    hintengine.stopHintEngine(hintObj)
                     return 'back'
+                elif event.key == K_l:
+                    hintengine.stopHintEngine(hintObj)
+                    return 'select'
 
                 elif event.key == K_SPACE:
                     Grab = True
@@ -214,8 +435,50 @@ def runLevel(levels, levelNum):
                 elif event.key == K_ESCAPE:
                     terminate() # Esc key quits.
                 elif event.key == K_BACKSPACE:
+                    hintengine.stopHintEngine(hintObj)
                     return 'reset' # Reset the level.
-                
+
+                elif event.key == K_h:
+                    showHint = not showHint
+
+                elif event.key in (K_PLUS, K_EQUALS, K_KP_PLUS):
+                    setZoom(viewObj, viewObj['zoom'] + 1)
+                elif event.key in (K_MINUS, K_KP_MINUS):
+                    setZoom(viewObj, viewObj['zoom'] - 1)
+
+                # Profiling keys.
+                elif event.key == K_F3:
+                    showProfiler = not showProfiler
+                elif event.key == K_F4:
+                    frameprofiler.exportFrames(time.strftime('frametimes-%Y%m%d-%H%M%S.csv'), PROFILE_FRAMES)
+                elif event.key == K_F5:
+                    frameprofiler.profileFrames(time.strftime('frameprofile-%Y%m%d-%H%M%S.prof'), PROFILE_FRAMES)
+
+            elif event.type == MOUSEWHEEL:
+                setZoom(viewObj, viewObj['zoom'] + (1 if event.y > 0 else -1))
+
+            elif event.type == MOUSEBUTTONDOWN and not levelIsComplete:
+                if event.button == 3:
+                    # Right click cancels the selection and the macro move.
+                    selectedStar = None
+                    macroActions = []
+                    macroSearch = None
+                elif event.button == 1:
+                    cell = getCellAtPixel(viewObj, event.pos)
+                    allStars = macromoves.getAllStars(starsolver.fromGameState(gameStateObj))
+                    actions = None
+                    macroSearch = None
+                    if cell in allStars and cell != selectedStar:
+                        selectedStar = cell
+                    elif selectedStar is not None:
+                        # Its actions are found over the next frames.
+                        macroSearch = macromoves.makeStarMove(graphObj, gameStateObj, selectedStar, cell)
+                        selectedStar = None
+                    else:
+                        actions = macromoves.walkTo(graphObj, gameStateObj, cell)
+                    macroActions = actions or []
+                    macroAll = bool(pygame.key.get_mods() & KMOD_SHIFT)
+                    macroTime = time.time()
 
             elif event.type == KEYUP:
                 # Unset the camera move mode.
@@ -228,6 +491,33 @@ def runLevel(levels, levelNum):
                 elif event.key == K_s:
                     cameraDown = False
 
+        frameprofiler.mark('events')
+
+        if playerMoveTo != -1 or playerTurn != None or Grab:
+            # The keys take over from the mouse.
+            selectedStar = None
+            macroActions = []
+            macroSearch = None
+
+        if macroSearch is not None and macromoves.starMoveStep(macroSearch):
+            macroActions = macroSearch['actions'] or []
+            macroSearch = None
+
+        if macroActions and not levelIsComplete and (macroAll or time.time() >= macroTime):
+            # Play the next action of the macro move (or all of them).
+            while macroActions:
+                action = macroActions.pop(0)
+                if starsolver.applyAction(mapObj, gameStateObj, action):
+                    moveLog.append(action)
+                    mapNeedsRedraw = True
+                if isLevelFinished(levelObj, gameStateObj):
+                    levelIsComplete = True
+                    keyPressed = False
+                    macroActions = []
+                if not macroAll:
+                    break
+            macroTime = time.time() + MACRO_STEP_TIME
+
         if playerMoveTo != -1 and not levelIsComplete:
             # If the player pushed a key to move, make the move
             # (if possible) and push any stars that are pushable.
@@ -237,6 +527,7 @@ def runLevel(levels, levelNum):
                 # increment the step counter.
                 gameStateObj['stepCounter'] += 1
                 print(gameStateObj['stepCounter'] )
+                moveLog.append(savegame.ACTIONS[playerMoveTo])
                 mapNeedsRedraw = True
 
             if isLevelFinished(levelObj, gameStateObj):
@@ -250,6 +541,7 @@ def runLevel(levels, levelNum):
             turned = makeTurn(mapObj, gameStateObj, playerTurn)
 
             if turned:
+                moveLog.append('turnleft' if playerTurn == LEFT else 'turnright')
                 mapNeedsRedraw = True
 
             if isLevelFinished(levelObj, gameStateObj):
@@ -263,6 +555,7 @@ def runLevel(levels, levelNum):
             grabbed = makeGrab(mapObj,gameStateObj)
 
             if grabbed:
+                moveLog.append('grab')
                 mapNeedsRedraw = True
 
             if isLevelFinished(levelObj, gameStateObj):
@@ -270,46 +563,312 @@ def runLevel(levels, levelNum):
                 levelIsComplete = True
                 keyPressed = False
 
-        DISPLAYSURF.fill(BGCOLOR)
+        if len(moveLog) - savedMoves >= AUTOSAVE_MOVES:
+            savegame.autosave(sessionObj) # written by another thread
+            savedMoves = len(moveLog)
+        frameprofiler.mark('rules')
 
         if mapNeedsRedraw:
-            mapSurf = drawMap(mapObj, gameStateObj, levelObj['goals'])
+            updateLevelView(viewObj, gameStateObj)
             mapNeedsRedraw = False
+        moveCamera(viewObj, cameraUp, cameraDown, cameraLeft, cameraRight)
 
-        if cameraUp and cameraOffsetY < MAX_CAM_X_PAN:
-            cameraOffsetY += CAM_MOVE_SPEED
-        elif cameraDown and cameraOffsetY > -MAX_CAM_X_PAN:
-            cameraOffsetY -= CAM_MOVE_SPEED
-        if cameraLeft and cameraOffsetX < MAX_CAM_Y_PAN:
-            cameraOffsetX += CAM_MOVE_SPEED
-        elif cameraRight and cameraOffsetX > -MAX_CAM_Y_PAN:
-            cameraOffsetX -= CAM_MOVE_SPEED
-
-        # Adjust mapSurf's Rect object based on the camera offset.
-        mapSurfRect = mapSurf.get_rect()
-        mapSurfRect.center = (HALF_WINWIDTH + cameraOffsetX, HALF_WINHEIGHT + cameraOffsetY)
-
-        # Draw mapSurf to the DISPLAYSURF Surface object.
-        DISPLAYSURF.blit(mapSurf, mapSurfRect)
-
-        DISPLAYSURF.blit(levelSurf, levelRect)
-        stepSurf = BASICFONT.render('Steps: %s' % (gameStateObj['stepCounter']), 1, TEXTCOLOR)
-        stepRect = stepSurf.get_rect()
-        stepRect.bottomleft = (20, WINHEIGHT - 10)
-        DISPLAYSURF.blit(stepSurf, stepRect)
-
-        if levelIsComplete:
-            # is solved, show the "Solved!" image until the player
-            # has pressed a key.
-            solvedRect = IMAGESDICT['solved'].get_rect()
-            solvedRect.center = (HALF_WINWIDTH, HALF_WINHEIGHT)
-            DISPLAYSURF.blit(IMAGESDICT['solved'], solvedRect)
-
-            if keyPressed:
-                return 'solved'
-
-        pygame.display.update() # draw DISPLAYSURF to the screen.
+        # The "Solved!" image is shown until the player has pressed a key.
+        dirtyRects = drawLevelView(viewObj, gameStateObj, levelIsComplete, hintObj if showHint else None, selectedStar)
+
+        if levelIsComplete and keyPressed:
+            hintengine.stopHintEngine(hintObj)
+            return 'solved'
+
+        updateDisplay(dirtyRects) # draw the changed parts of the frame to the screen.
+        frameprofiler.mark('update')
+        if not keyPressed and not macroActions and macroSearch is None:
+            # Nothing happened: use the rest of the frame to prepare the
+            # next and previous levels (it counts as waiting).
+            levelprefetch.prefetchStep(PREFETCHER)
         FPSCLOCK.tick()
+        frameprofiler.mark('wait')
+        frameprofiler.endFrame()
+
+
+def makeLevelView(levels, levelNum, mapObj, gameStateObj, chunkCache=None):
+    """Returns a view object for drawing levels[levelNum] with
+    drawLevelView(): the map's chunk cache (a new one, unless the chunk
+    cache of the map at gameStateObj is given), the camera and the level
+    number text. The map is shown at the default zoom."""
+    if chunkCache is None:
+        chunkCache = makeChunkCache(mapObj, levels[levelNum]['goals'])
+    levelText = 'Level %s of %s' % (levelNum + 1, len(levels))
+    levelSurf = BASICFONT.render(levelText, 1, TEXTCOLOR)
+    levelRect = levelSurf.get_rect()
+    levelRect.bottomleft = (20, WINHEIGHT - 35)
+    viewObj = {'chunkCache': chunkCache,
+               'zoom': DEFAULT_ZOOM, # index in ZOOM_LEVELS
+               'chunkCaches': OrderedDict([(DEFAULT_ZOOM, chunkCache)]), # zoom -> chunk cache, the last used last
+               'pieceCells': getPieceCells(gameStateObj),
+               'levelText': levelText,
+               'levelSurf': levelSurf,
+               'levelRect': levelRect,
+               # Track how much the camera has moved, and how far it can go:
+               'cameraOffsetX': 0,
+               'cameraOffsetY': 0,
+               # What was drawn on the last frame, to find what changed:
+               'lastTopLeft': None, # None to draw the whole window
+               'lastOverlay': [], # (signature, Rect) of each overlay item
+               'dirtyCells': set()} # spaces changed since the last frame
+    setCameraPan(viewObj)
+    return viewObj
+
+
+def setCameraPan(viewObj):
+    """Sets how far the camera can move for the chunk cache's zoom."""
+    chunkCache = viewObj['chunkCache']
+    viewObj['maxCamXPan'] = abs(HALF_WINWIDTH - int(chunkCache['width'] / 2)) + chunkCache['tileHeight']
+    viewObj['maxCamYPan'] = abs(HALF_WINHEIGHT - int(chunkCache['height'] / 2)) + chunkCache['tileWidth']
+
+
+def setZoom(viewObj, zoom):
+    """Shows the map at ZOOM_LEVELS[zoom] (if there is such a zoom), with
+    the camera on the same part of the map. The chunk cache of the zoom
+    is made if it isn't one of the last ZOOM_CACHES used."""
+    if zoom < 0 or zoom >= len(ZOOM_LEVELS) or zoom == viewObj['zoom']:
+        return
+    oldCache = viewObj['chunkCache']
+    chunkCaches = viewObj['chunkCaches']
+    if zoom in chunkCaches:
+        chunkCaches.move_to_end(zoom)
+    else:
+        chunkCaches[zoom] = makeChunkCache(oldCache['mapObj'], oldCache['goals'], ZOOM_LEVELS[zoom], CHUNK_DRAW_TIME)
+        while len(chunkCaches) > ZOOM_CACHES:
+            chunkCaches.popitem(last=False)
+    chunkCache = chunkCaches[zoom]
+    viewObj['zoom'] = zoom
+    viewObj['chunkCache'] = chunkCache
+    setCameraPan(viewObj)
+    scale = chunkCache['tileWidth'] / oldCache['tileWidth']
+    viewObj['cameraOffsetX'] = max(-viewObj['maxCamXPan'], min(viewObj['maxCamXPan'], int(viewObj['cameraOffsetX'] * scale)))
+    viewObj['cameraOffsetY'] = max(-viewObj['maxCamYPan'], min(viewObj['maxCamYPan'], int(viewObj['cameraOffsetY'] * scale)))
+    viewObj['lastTopLeft'] = None # draw the whole window
+
+
+def updateLevelView(viewObj, gameStateObj):
+    """Call after the game state changed: throws away the map chunks with
+    a space that looks different, at every zoom."""
+    newPieceCells = getPieceCells(gameStateObj)
+    changedCells = getChangedCells(viewObj['pieceCells'], newPieceCells)
+    for chunkCache in viewObj['chunkCaches'].values():
+        invalidateChunks(chunkCache, changedCells)
+    viewObj['dirtyCells'] |= changedCells
+    viewObj['pieceCells'] = newPieceCells
+
+
+def moveCamera(viewObj, cameraUp, cameraDown, cameraLeft, cameraRight):
+    """Moves the camera by CAM_MOVE_SPEED in the directions whose keys
+    are held down, as far as the map allows."""
+    if cameraUp and viewObj['cameraOffsetY'] < viewObj['maxCamYPan']:
+        viewObj['cameraOffsetY'] += CAM_MOVE_SPEED
+    elif cameraDown and viewObj['cameraOffsetY'] > -viewObj['maxCamYPan']:
+        viewObj['cameraOffsetY'] -= CAM_MOVE_SPEED
+    if cameraLeft and viewObj['cameraOffsetX'] < viewObj['maxCamXPan']:
+        viewObj['cameraOffsetX'] += CAM_MOVE_SPEED
+    elif cameraRight and viewObj['cameraOffsetX'] > -viewObj['maxCamXPan']:
+        viewObj['cameraOffsetX'] -= CAM_MOVE_SPEED
+
+
+def getMapTopLeft(viewObj):
+    """Returns the (left, top) pixel of the map on the screen, which
+    depends on the camera offset."""
+    chunkCache = viewObj['chunkCache']
+    mapSurfRect = pygame.Rect(0, 0, chunkCache['width'], chunkCache['height'])
+    mapSurfRect.center = (HALF_WINWIDTH + viewObj['cameraOffsetX'], HALF_WINHEIGHT + viewObj['cameraOffsetY'])
+    return mapSurfRect.topleft
+
+
+def getCellAtPixel(viewObj, pos):
+    """Returns the (x, y) space of the map under the (x, y) pixel of the
+    screen. A space is picked by its floor, the middle TILEFLOORHEIGHT
+    pixels of its tile (scaled to the zoom)."""
+    chunkCache = viewObj['chunkCache']
+    left, top = getMapTopLeft(viewObj)
+    x = (pos[0] - left) // chunkCache['tileWidth']
+    y = (pos[1] - top - (chunkCache['tileHeight'] - chunkCache['floorHeight']) // 2) // chunkCache['floorHeight']
+    return (x, y)
+
+
+def drawLevelView(viewObj, gameStateObj, levelIsComplete, hintObj=None, selectedStar=None):
+    """Draws the level on DISPLAYSURF (or with the GPU renderer): the map
+    and what getLevelOverlay() puts over it. Only the parts of the window
+    that changed since the last frame are drawn again. Returns the list
+    of the Rects that were drawn, to pass to updateDisplay() (None for
+    the whole window)."""
+    if GPU is not None:
+        gpurenderer.drawLevelView(GPU, viewObj, gameStateObj, levelIsComplete, hintObj, selectedStar)
+        return None
+
+    mapTopLeft = getMapTopLeft(viewObj)
+    overlay = getLevelOverlay(viewObj, gameStateObj, levelIsComplete, hintObj, selectedStar)
+    lastOverlay = [(getOverlaySignature(item), item[2]) for item in overlay]
+    if mapTopLeft != viewObj['lastTopLeft']:
+        # The camera moved (or this is the first frame): draw everything.
+        dirtyRects = [DISPLAYSURF.get_rect()]
+    else:
+        dirtyRects = [getSpaceRect(viewObj['chunkCache'], mapTopLeft, x, y) for x, y in viewObj['dirtyCells']]
+        # An overlay item that is new, gone or always changing (its
+        # signature is None) must be drawn, or drawn over.
+        oldSignatures = set(signature for signature, rect in viewObj['lastOverlay'])
+        newSignatures = set(signature for signature, rect in lastOverlay)
+        for signature, rect in viewObj['lastOverlay']:
+            if signature is None or signature not in newSignatures:
+                dirtyRects.append(rect)
+        for signature, rect in lastOverlay:
+            if signature is None or signature not in oldSignatures:
+                dirtyRects.append(rect)
+        dirtyRects = mergeRects(dirtyRects, DISPLAYSURF.get_rect())
+    viewObj['lastTopLeft'] = mapTopLeft
+    viewObj['lastOverlay'] = lastOverlay
+    viewObj['dirtyCells'] = set()
+
+    chunksLeft = False
+    for dirtyRect in dirtyRects:
+        # Everything is drawn as usual, but only inside the dirty Rect.
+        DISPLAYSURF.set_clip(dirtyRect)
+        DISPLAYSURF.fill(BGCOLOR)
+        frameprofiler.mark('blits')
+
+        # Draw the visible chunks of the map to the DISPLAYSURF Surface object.
+        if drawMapChunks(viewObj['chunkCache'], gameStateObj, DISPLAYSURF, mapTopLeft):
+            chunksLeft = True
+        frameprofiler.mark('drawMap')
+
+        for kind, value, rect, key in overlay:
+            if not dirtyRect.colliderect(rect):
+                continue
+            if kind == 'outline':
+                pygame.draw.rect(DISPLAYSURF, value, rect, 3)
+            else:
+                DISPLAYSURF.blit(value, rect)
+        frameprofiler.mark('blits')
+    DISPLAYSURF.set_clip(None)
+    if chunksLeft:
+        viewObj['lastTopLeft'] = None # draw the whole window again next frame
+    return dirtyRects
+
+
+def getOverlaySignature(item):
+    """Returns what tells if an overlay item (see getLevelOverlay()) looks
+    the same as on the last frame, or None for an item that changes every
+    frame."""
+    kind, value, rect, key = item
+    if kind == 'outline':
+        return (kind, value, tuple(rect))
+    if key is None:
+        return None
+    return (kind, key, tuple(rect))
+
+
+def mergeRects(rects, screenRect):
+    """Returns the Rects clipped to screenRect, with the ones that overlap
+    merged into one, so no part of the window is drawn twice."""
+    merged = []
+    for rect in rects:
+        rect = rect.clip(screenRect)
+        if rect.width == 0 or rect.height == 0:
+            continue
+        i = rect.collidelist(merged)
+        while i != -1:
+            rect = rect.union(merged.pop(i))
+            i = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
+
+def getLevelOverlay(viewObj, gameStateObj, levelIsComplete, hintObj=None, selectedStar=None):
+    """Returns what is drawn over the map, in order: the hint from hintObj
+    (if not None), the outline of the selected star (if not None), the
+    level number and steps, the "Solved!" image if levelIsComplete and the
+    profiler overlay if it is on. Each item is a tuple: ('outline', color,
+    Rect, None) for a 3 pixel wide outline, or ('image', Surface, Rect,
+    key), where the key names what the image shows (None if it changes
+    every frame), so that the GPU renderer can reuse its texture."""
+    mapTopLeft = getMapTopLeft(viewObj)
+    overlay = []
+    if hintObj is not None and not levelIsComplete:
+        # Asking for the hint never waits for the solver.
+        overlay.extend(getHintOverlay(hintengine.getHint(hintObj, gameStateObj), gameStateObj, viewObj['chunkCache'], mapTopLeft))
+
+    if selectedStar is not None:
+        overlay.append(('outline', SELECTCOLOR, getSpaceRect(viewObj['chunkCache'], mapTopLeft, selectedStar[0], selectedStar[1]), None))
+
+    overlay.append(('image', viewObj['levelSurf'], viewObj['levelRect'], viewObj['levelText']))
+    stepText = 'Steps: %s' % (gameStateObj['stepCounter'])
+    stepSurf = BASICFONT.render(stepText, 1, TEXTCOLOR)
+    stepRect = stepSurf.get_rect()
+    stepRect.bottomleft = (20, WINHEIGHT - 10)
+    overlay.append(('image', stepSurf, stepRect, stepText))
+
+    if levelIsComplete:
+        solvedRect = IMAGESDICT['solved'].get_rect()
+        solvedRect.center = (HALF_WINWIDTH, HALF_WINHEIGHT)
+        overlay.append(('image', IMAGESDICT['solved'], solvedRect, 'solved'))
+
+    if showProfiler:
+        profilerSurf = frameprofiler.makeOverlay(PROFILERFONT)
+        overlay.append(('image', profilerSurf, profilerSurf.get_rect(), None))
+    return overlay
+
+
+def getSpaceRect(chunkCache, mapTopLeft, x, y):
+    """Returns the Rect of the tile of the (x, y) space on the screen, at
+    the chunk cache's zoom."""
+    return pygame.Rect(mapTopLeft[0] + x * chunkCache['tileWidth'], mapTopLeft[1] + y * chunkCache['floorHeight'],
+                       chunkCache['tileWidth'], chunkCache['tileHeight'])
+
+
+def getHintOverlay(hint, gameStateObj, chunkCache, mapTopLeft):
+    """Returns the getLevelOverlay() items of the hint (an (action,
+    isFinal) tuple from hintengine.getHint() or None): the space to move
+    to (or the player, for a turn or a grab) is outlined and the action
+    is written in the corner."""
+    overlay = []
+    if hint is None:
+        hintText = 'Hint: thinking...'
+    else:
+        action, isFinal = hint
+        hintText = 'Hint: %s%s' % (HINTNAMES[action], '' if isFinal else ' ?')
+
+        x, y = gameStateObj['player']
+        if action in ('up', 'left', 'down', 'right'):
+            xOffset, yOffset = {'up': (0, -1), 'left': (-1, 0), 'down': (0, 1), 'right': (1, 0)}[action]
+            x, y = x + xOffset, y + yOffset
+        overlay.append(('outline', HINTCOLOR, getSpaceRect(chunkCache, mapTopLeft, x, y), None))
+
+    hintSurf = BASICFONT.render(hintText, 1, HINTCOLOR)
+    hintRect = hintSurf.get_rect()
+    hintRect.bottomright = (WINWIDTH - 20, WINHEIGHT - 10)
+    overlay.append(('image', hintSurf, hintRect, hintText))
+    return overlay
+
+
+def updateDisplay(dirtyRects=None, wholeSurface=False):
+    """Shows the frame on the screen: calls pygame.display.update() with
+    the dirtyRects (the whole window if None), or with the GPU renderer,
+    shows what was drawn with it (after copying all of DISPLAYSURF to it
+    if wholeSurface is True, for the screens that are only drawn on
+    DISPLAYSURF)."""
+    if GPU is None:
+        if dirtyRects is None:
+            pygame.display.update()
+        else:
+            pygame.display.update(dirtyRects)
+        return
+    if wholeSurface:
+        gpurenderer.drawSurface(GPU, DISPLAYSURF)
+    GPU['renderer'].present()
+
+
+HINTNAMES = {'up': 'up', 'left': 'left', 'down': 'down', 'right': 'right',
+             'turnleft': 'turn left (W)', 'turnright': 'turn right (X)',
+             'grab': 'grab/let go (SPACE)'}
 
 
 def isWall(mapObj, x, y):
@@ -324,16 +883,19 @@ def isWall(mapObj, x, y):
     return False
 
 
-def decorateMap(mapObj, startxy):
+def decorateMap(mapObj, startxy, seed=None):
     """Makes a copy of the given map object and modifies it.
     Here is what is done to it:
         * Walls that are corners are turned into corner pieces.
         * The outside/inside floor tile distinction is made.
         * Tree/rock decorations are randomly added to the outside tiles.
 
+    If seed is given, the same seed always gives the same decorations.
+
     Returns the decorated map object."""
 
     startx, starty = startxy # Syntactic sugar
+    rand = random.Random(seed) if seed is not None else random
 
     # Copy the map object so we don't modify the original passed
     mapObjCopy = copy.deepcopy(mapObj)
@@ -358,12 +920,101 @@ def decorateMap(mapObj, startxy):
                    (isWall(mapObjCopy, x-1, y) and isWall(mapObjCopy, x, y-1)):
                     mapObjCopy[x][y] = 'x'
 
-            elif mapObjCopy[x][y] == ' ' and random.randint(0, 99) < OUTSIDE_DECORATION_PCT:
-                mapObjCopy[x][y] = random.choice(list(OUTSIDEDECOMAPPING.keys()))
+            elif mapObjCopy[x][y] == ' ' and rand.randint(0, 99) < OUTSIDE_DECORATION_PCT:
+                mapObjCopy[x][y] = rand.choice(list(OUTSIDEDECOMAPPING.keys()))
 
     return mapObjCopy
 
 
+def getLevelKey(levelObj):
+    """Returns a string that identifies the level's map: two levels with
+    the same map have the same key."""
+    if 'key' not in levelObj:
+        mapText = '\n'.join(''.join(column) for column in levelObj['mapObj'])
+        levelObj['key'] = hashlib.sha1(mapText.encode('utf-8')).hexdigest()
+    return levelObj['key']
+
+
+def getDecorationVersion():
+    """Returns what the decorations depend on besides the map. Saved
+    decorations made with other settings are not used."""
+    return '%s:%s' % (OUTSIDE_DECORATION_PCT, ''.join(sorted(OUTSIDEDECOMAPPING.keys())))
+
+
+def getDecoratedMap(levelObj):
+    """Returns the decorated map object of the level. It is only made
+    the first time, after that (and across runs of the game if the
+    decorations file is used) the same one is returned.
+
+    The returned map object is shared, so it must not be modified."""
+    global decorationsChanged
+
+    if 'decoratedMap' in levelObj:
+        return levelObj['decoratedMap']
+
+    key = getLevelKey(levelObj)
+    if key in DECORATEDMAPS:
+        levelObj['decoratedMap'] = [list(column) for column in DECORATEDMAPS[key]]
+        return levelObj['decoratedMap']
+
+    # The seed comes from the level's key, so it is the same every time.
+    seed = int(key[:16], 16)
+    levelObj['decoratedMap'] = decorateMap(levelObj['mapObj'], levelObj['startState']['player'], seed)
+    DECORATEDMAPS[key] = [''.join(column) for column in levelObj['decoratedMap']]
+    # Written by terminate(): saving here would rewrite the whole file
+    # for every level, inside the frame loop when a level is prefetched.
+    decorationsChanged = True
+    return levelObj['decoratedMap']
+
+
+# Maps level keys to decorated maps (a list of strings, one per column).
+DECORATEDMAPS = {}
+decorationFile = None # where saveDecorations() writes DECORATEDMAPS
+decorationsChanged = False # True if DECORATEDMAPS has maps the file doesn't have
+
+
+def loadDecorations(levelFilename):
+    """Loads the decorated maps saved next to the given level file. The
+    decorated maps made from now on will be saved to that file too."""
+    global decorationFile
+
+    if DECORATION_FILE_SUFFIX is None:
+        return
+    decorationFile = levelFilename + DECORATION_FILE_SUFFIX
+    if not os.path.exists(decorationFile):
+        return
+    try:
+        with open(decorationFile, 'r') as decoFile:
+            data = json.load(decoFile)
+    except (OSError, ValueError):
+        return # a broken file is simply made again
+    if data.get('version') == getDecorationVersion():
+        DECORATEDMAPS.update(data['maps'])
+
+
+def saveDecorations():
+    """Writes DECORATEDMAPS to the decorations file, if new maps were made
+    since it was loaded or written. The file is written under another
+    name first and then renamed, so a crash never leaves a half written
+    file."""
+    global decorationsChanged
+
+    if decorationFile is None or not decorationsChanged:
+        return
+    data = {'version': getDecorationVersion(), 'maps': DECORATEDMAPS}
+    tempName = None
+    try:
+        fd, tempName = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(decorationFile)))
+        with os.fdopen(fd, 'w') as decoFile:
+            json.dump(data, decoFile)
+        os.replace(tempName, decorationFile)
+        decorationsChanged = False
+    except OSError:
+        # Not being able to save the decorations isn't a problem.
+        if tempName is not None and os.path.exists(tempName):
+            os.remove(tempName)
+
+
 def isBlocked(mapObj, gameStateObj, x, y):
     """Returns True if the (x, y) position on the map is
     blocked by a wall or star or closed door, otherwise return False."""
@@ -598,7 +1249,8 @@ def startScreen():
                        'Utilisez les flèches pour bouger, et ZQSD pour maneuvrer la caméra.',
                        'Appuyez sur ESPACE devant une boite pour la saisir, et W et X pour tourner.',
                        'Backspace pour réinitialiser le niveau et Esc pour le quitter.',
-                       'N pour sauter le niveau et B pour retourner au niveau précedent.']
+                       'N pour sauter le niveau et B pour retourner au niveau précedent.',
+                       'L pour choisir un niveau dans la liste, + et - pour zoomer.']
 
     # Start with drawing a blank color to the entire window:
     DISPLAYSURF.fill(BGCOLOR)
@@ -626,19 +1278,30 @@ def startScreen():
                 return # user has pressed a key, so return.
 
         # Display the DISPLAYSURF contents to the actual screen.
-        pygame.display.update()
+        updateDisplay(wholeSurface=True)
         FPSCLOCK.tick()
 
 
 def readLevelsFile(filename):
     assert os.path.exists(filename), 'Cannot find the level file: %s' % (filename)
+    if levelformats.getFormat(filename) != 'txt':
+        # A .xsb, .sok or .slc collection, made by another Sokoban program.
+        return parseLevels(levelformats.getLevelLines(filename), filename)
     mapFile = open(filename, 'r')
-    # Each level must end with a blank line
-    content = mapFile.readlines() + ['\r\n']
+    content = mapFile.readlines()
     mapFile.close()
+    return parseLevels(content, filename)
+
+
+def parseLevels(content, filename, firstLevelNum=0):
+    """Returns the list of level objects made from content, the list of
+    lines of a level file. filename and firstLevelNum (the number of the
+    first level in content) are only used in the error messages."""
+    # Each level must end with a blank line
+    content = content + ['\r\n']
 
     levels = [] # Will contain a list of level objects.
-    levelNum = 0
+    levelNum = firstLevelNum
     mapTextLines = [] # contains the lines for a single level's map.
     mapObj = [] # the map object made from the data in mapTextLines
     for lineNum in range(len(content)):
@@ -733,26 +1396,56 @@ def readLevelsFile(filename):
     return levels
 
 
+def findLevelBlocks(content):
+    """Returns a list of (start, end) tuples, one per level in content (the
+    list of lines of a level file), such that content[start:end] are the
+    lines of that level's map. Uses the same rules as parseLevels()."""
+    blocks = []
+    start = None
+    for lineNum in range(len(content)):
+        line = content[lineNum].rstrip('\r\n')
+        if ';' in line:
+            line = line[:line.find(';')]
+        if line != '' and start is None:
+            start = lineNum
+        elif line == '' and start is not None:
+            blocks.append((start, lineNum))
+            start = None
+    if start is not None:
+        blocks.append((start, len(content)))
+    return blocks
+
+
 def floodFill(mapObj, x, y, oldCharacter, newCharacter):
     """Changes any values matching oldCharacter on the map object to
     newCharacter at the (x, y) position, and does the same for the
-    positions to the left, right, down, and up of (x, y), recursively."""
+    positions to the left, right, down, and up of (x, y)."""
 
     # In this game, the flood fill algorithm creates the inside/outside
-    # floor distinction. This is a "recursive" function.
+    # floor distinction. Instead of calling itself recursively (which
+    # hits Python's recursion limit on big maps), this version keeps a
+    # list of the positions that still need to be visited.
     # For more info on the Flood Fill algorithm, see:
     #   http://en.wikipedia.org/wiki/Flood_fill
-    if mapObj[x][y] == oldCharacter:
-        mapObj[x][y] = newCharacter
-
-    if x < len(mapObj) - 1 and (mapObj[x+1][y] == oldCharacter or mapObj[x+1][y] == 'd'):
-        floodFill(mapObj, x+1, y, oldCharacter, newCharacter) # call right
-    if x > 0 and (mapObj[x-1][y] == oldCharacter or mapObj[x-1][y] == 'd'):
-        floodFill(mapObj, x-1, y, oldCharacter, newCharacter) # call left
-    if y < len(mapObj[x]) - 1 and (mapObj[x][y+1] == oldCharacter or mapObj[x][y+1] == 'd'):
-        floodFill(mapObj, x, y+1, oldCharacter, newCharacter) # call down
-    if y > 0 and (mapObj[x][y-1] == oldCharacter or mapObj[x][y-1] == 'd'):
-        floodFill(mapObj, x, y-1, oldCharacter, newCharacter) # call up
+    toVisit = [(x, y)]
+    visited = set()
+    while toVisit:
+        x, y = toVisit.pop()
+        if (x, y) in visited:
+            continue
+        visited.add((x, y))
+
+        if mapObj[x][y] == oldCharacter:
+            mapObj[x][y] = newCharacter
+
+        if x < len(mapObj) - 1 and (mapObj[x+1][y] == oldCharacter or mapObj[x+1][y] == 'd'):
+            toVisit.append((x+1, y)) # visit right
+        if x > 0 and (mapObj[x-1][y] == oldCharacter or mapObj[x-1][y] == 'd'):
+            toVisit.append((x-1, y)) # visit left
+        if y < len(mapObj[x]) - 1 and (mapObj[x][y+1] == oldCharacter or mapObj[x][y+1] == 'd'):
+            toVisit.append((x, y+1)) # visit down
+        if y > 0 and (mapObj[x][y-1] == oldCharacter or mapObj[x][y-1] == 'd'):
+            toVisit.append((x, y-1)) # visit up
 
 
 def drawMap(mapObj, gameStateObj, goals):
@@ -772,65 +1465,298 @@ def drawMap(mapObj, gameStateObj, goals):
     for x in range(len(mapObj)):
         for y in range(len(mapObj[x])):
             spaceRect = pygame.Rect((x * TILEWIDTH, y * TILEFLOORHEIGHT, TILEWIDTH, TILEHEIGHT))
-            if mapObj[x][y] in TILEMAPPING:
-                baseTile = TILEMAPPING[mapObj[x][y]]
-            elif mapObj[x][y] in OUTSIDEDECOMAPPING:
-                baseTile = TILEMAPPING[' ']
-
-            # First draw the base ground/wall tile.
-            mapSurf.blit(baseTile, spaceRect)
-
-            if mapObj[x][y] in OUTSIDEDECOMAPPING:
-                # Draw any tree/rock decorations that are on this tile.
-                mapSurf.blit(OUTSIDEDECOMAPPING[mapObj[x][y]], spaceRect)
-            elif (x, y) in gameStateObj['stars']:
-                if (x, y) in goals:
-                    # A goal AND star are on this space, draw goal first.
-                    mapSurf.blit(IMAGESDICT['covered goal'], spaceRect)
-                elif (x,y) in gameStateObj['buttons']:
-                    mapSurf.blit(IMAGESDICT['button'], spaceRect)
-                elif (x,y) in gameStateObj['doors']:
-                    mapSurf.blit(IMAGESDICT['opendoor'], spaceRect)
-                # Then draw the star sprite.
-                mapSurf.blit(IMAGESDICT['star'], spaceRect)
-            elif (x, y) in gameStateObj['grabstar']:
-                if (x, y) in goals:
-                    # A goal AND star are on this space, draw goal first.
-                    mapSurf.blit(IMAGESDICT['covered goal'], spaceRect)
-                elif (x,y) in gameStateObj['buttons']:
-                    mapSurf.blit(IMAGESDICT['button'], spaceRect)
-                elif (x,y) in gameStateObj['doors']:
-                    mapSurf.blit(IMAGESDICT['opendoor'], spaceRect)
-                # Then draw the star sprite.
-                mapSurf.blit(IMAGESDICT['grabstar'], spaceRect)
-            elif (x,y) in gameStateObj['doors']:
-                if isDoorOpen(gameStateObj,x,y):
-                    mapSurf.blit(IMAGESDICT['opendoor'], spaceRect)
-                else:
-                    mapSurf.blit(IMAGESDICT['closeddoor'], spaceRect)
-            elif (x,y) in gameStateObj['buttons']:
-                mapSurf.blit(IMAGESDICT['buttoff'], spaceRect)
-            elif (x, y) in goals:
-                # Draw a goal without a star on it.
-                mapSurf.blit(IMAGESDICT['uncovered goal'], spaceRect)
-
-
-            # Last draw the player on the board.
-            if (x, y) == gameStateObj['player']:
-                if (x,y) in gameStateObj['buttons']:
-                    mapSurf.blit(IMAGESDICT['button'], spaceRect)
-                elif (x,y) in gameStateObj['doors']:
-                    mapSurf.blit(IMAGESDICT['opendoor'], spaceRect)
-                # Note: The value "currentImage" refers
-                # to a key in "PLAYERIMAGES" which has the
-                # specific player image we want to show.
-                varAnything = gameStateObj['playerdirection']
-                print(varAnything)
-                mapSurf.blit(PLAYERIMAGES[gameStateObj['playerdirection']], spaceRect)
+            drawTile(mapSurf, mapObj, gameStateObj, goals, x, y, spaceRect)
 
     return mapSurf
 
 
+def drawTile(surf, mapObj, gameStateObj, goals, x, y, spaceRect, scaledTiles=None):
+    """Draws the (x, y) space of the map (ground, decoration, star, door,
+    button and player) onto surf at spaceRect, with the scaled images of
+    scaledTiles (see getScaledTiles()) if it isn't None."""
+    for image in getTileImages(mapObj, gameStateObj, goals, x, y):
+        if scaledTiles is not None:
+            image = scaledTiles[id(image)]
+        surf.blit(image, spaceRect)
+
+
+def getScaledTiles(zoom):
+    """Returns a dict that maps the id of each image of IMAGESDICT to the
+    image scaled to zoom times its size, or None for a zoom of 1. The
+    images are scaled the first time a zoom is used, and kept for the
+    last SCALED_TILE_SETS zooms used."""
+    if zoom == 1:
+        return None
+    if zoom in SCALEDTILES:
+        SCALEDTILES.move_to_end(zoom)
+        return SCALEDTILES[zoom]
+    scaledTiles = {}
+    for image in IMAGESDICT.values():
+        width, height = image.get_size()
+        size = (max(1, round(width * zoom)), max(1, round(height * zoom)))
+        if image.get_bitsize() in (24, 32):
+            scaledTiles[id(image)] = pygame.transform.smoothscale(image, size)
+        else:
+            scaledTiles[id(image)] = pygame.transform.scale(image, size)
+    SCALEDTILES[zoom] = scaledTiles
+    while len(SCALEDTILES) > SCALED_TILE_SETS:
+        SCALEDTILES.popitem(last=False)
+    return scaledTiles
+
+
+# Maps zooms to their scaled images (see getScaledTiles()), the last used last.
+SCALEDTILES = OrderedDict()
+
+
+def getTileImages(mapObj, gameStateObj, goals, x, y):
+    """Returns the list of images that make up the (x, y) space of the
+    map, in the order they are drawn."""
+
+    if mapObj[x][y] in TILEMAPPING:
+        baseTile = TILEMAPPING[mapObj[x][y]]
+    elif mapObj[x][y] in OUTSIDEDECOMAPPING:
+        baseTile = TILEMAPPING[' ']
+    else:
+        # Doors and buttons ('d', 'b', 'p' and 's') stand on inside floor.
+        baseTile = TILEMAPPING['o']
+
+    # First draw the base ground/wall tile.
+    images = [baseTile]
+
+    if mapObj[x][y] in OUTSIDEDECOMAPPING:
+        # Draw any tree/rock decorations that are on this tile.
+        images.append(OUTSIDEDECOMAPPING[mapObj[x][y]])
+    elif (x, y) in gameStateObj['stars']:
+        if (x, y) in goals:
+            # A goal AND star are on this space, draw goal first.
+            images.append(IMAGESDICT['covered goal'])
+        elif (x,y) in gameStateObj['buttons']:
+            images.append(IMAGESDICT['button'])
+        elif (x,y) in gameStateObj['doors']:
+            images.append(IMAGESDICT['opendoor'])
+        # Then draw the star sprite.
+        images.append(IMAGESDICT['star'])
+    elif (x, y) in gameStateObj['grabstar']:
+        if (x, y) in goals:
+            # A goal AND star are on this space, draw goal first.
+            images.append(IMAGESDICT['covered goal'])
+        elif (x,y) in gameStateObj['buttons']:
+            images.append(IMAGESDICT['button'])
+        elif (x,y) in gameStateObj['doors']:
+            images.append(IMAGESDICT['opendoor'])
+        # Then draw the star sprite.
+        images.append(IMAGESDICT['grabstar'])
+    elif (x,y) in gameStateObj['doors']:
+        if isDoorOpen(gameStateObj,x,y):
+            images.append(IMAGESDICT['opendoor'])
+        else:
+            images.append(IMAGESDICT['closeddoor'])
+    elif (x,y) in gameStateObj['buttons']:
+        images.append(IMAGESDICT['buttoff'])
+    elif (x, y) in goals:
+        # Draw a goal without a star on it.
+        images.append(IMAGESDICT['uncovered goal'])
+
+    # Last draw the player on the board.
+    if (x, y) == gameStateObj['player']:
+        if (x,y) in gameStateObj['buttons']:
+            images.append(IMAGESDICT['button'])
+        elif (x,y) in gameStateObj['doors']:
+            images.append(IMAGESDICT['opendoor'])
+        # The player image depends on the direction the player faces.
+        images.append(PLAYERIMAGES[gameStateObj['playerdirection']])
+    return images
+
+
+def makeChunkCache(mapObj, goals, zoom=1, drawTime=None):
+    """Returns a chunk cache object for the given (decorated) map, drawn
+    with its tiles scaled to zoom times their size. The chunk surfaces
+    themselves are only drawn when drawMapChunks() needs them, for at
+    most drawTime seconds per frame if it isn't None."""
+
+    tileWidth = max(1, round(TILEWIDTH * zoom))
+    tileHeight = max(1, round(TILEHEIGHT * zoom))
+    floorHeight = max(1, round(TILEFLOORHEIGHT * zoom))
+    chunkTiles = max(CHUNK_TILES, min(2 * CHUNK_TILES, round(CHUNK_TILES / zoom))) # zoomed out, more tiles per chunk
+    mapWidth = len(mapObj) * tileWidth
+    mapHeight = (len(mapObj[0]) - 1) * floorHeight + tileHeight
+    chunkWidth = chunkTiles * tileWidth
+    chunkHeight = chunkTiles * floorHeight
+    return {'mapObj': mapObj,
+            'goals': goals,
+            'zoom': zoom,
+            'scaledTiles': getScaledTiles(zoom),
+            'tileWidth': tileWidth,
+            'tileHeight': tileHeight,
+            'floorHeight': floorHeight,
+            'chunkTiles': chunkTiles,
+            'drawTime': drawTime,
+            'width': mapWidth,
+            'height': mapHeight,
+            'columns': (mapWidth + chunkWidth - 1) // chunkWidth,
+            'rows': (mapHeight + chunkHeight - 1) // chunkHeight,
+            'chunks': OrderedDict(), # (chunkx, chunky) -> Surface, oldest first
+            'bytes': 0} # memory used by the cached chunk surfaces
+
+
+def getChunkRect(chunkCache, chunkx, chunky):
+    """Returns the Rect of the (chunkx, chunky) chunk, in map pixels."""
+    chunkWidth = chunkCache['chunkTiles'] * chunkCache['tileWidth']
+    chunkHeight = chunkCache['chunkTiles'] * chunkCache['floorHeight']
+    left = chunkx * chunkWidth
+    top = chunky * chunkHeight
+    width = min(chunkWidth, chunkCache['width'] - left)
+    height = min(chunkHeight, chunkCache['height'] - top)
+    return pygame.Rect(left, top, width, height)
+
+
+def getChunkTiles(chunkCache, chunkx, chunky):
+    """Returns a list of (x, y, spaceRect) for the spaces whose tiles are
+    drawn on the (chunkx, chunky) chunk, with spaceRect relative to the
+    chunk, in the order they are drawn."""
+    mapObj = chunkCache['mapObj']
+    chunkRect = getChunkRect(chunkCache, chunkx, chunky)
+    tileWidth = chunkCache['tileWidth']
+    tileHeight = chunkCache['tileHeight']
+    floorHeight = chunkCache['floorHeight']
+
+    # Tiles are taller than the rows they stand on, so the tiles of the
+    # rows just above this chunk poke into it and must be drawn as well.
+    firstRow = max(0, (chunkRect.top - tileHeight) // floorHeight + 1)
+    lastRow = min(len(mapObj[0]), (chunkRect.bottom + floorHeight - 1) // floorHeight)
+    firstColumn = chunkx * chunkCache['chunkTiles']
+    lastColumn = min(len(mapObj), firstColumn + chunkCache['chunkTiles'])
+    tiles = []
+    for x in range(firstColumn, lastColumn):
+        for y in range(firstRow, lastRow):
+            spaceRect = pygame.Rect((x * tileWidth - chunkRect.left, y * floorHeight - chunkRect.top, tileWidth, tileHeight))
+            tiles.append((x, y, spaceRect))
+    return tiles
+
+
+def drawChunk(chunkCache, gameStateObj, chunkx, chunky):
+    """Draws one chunk of the map to a new Surface object and returns it."""
+    mapObj = chunkCache['mapObj']
+    chunkSurf = pygame.Surface(getChunkRect(chunkCache, chunkx, chunky).size)
+    chunkSurf.fill(BGCOLOR)
+    for x, y, spaceRect in getChunkTiles(chunkCache, chunkx, chunky):
+        drawTile(chunkSurf, mapObj, gameStateObj, chunkCache['goals'], x, y, spaceRect, chunkCache['scaledTiles'])
+    return chunkSurf
+
+
+def getChunkBytes(chunkCache, chunkx, chunky):
+    """Returns the memory used by the (chunkx, chunky) chunk's Surface (or
+    texture), at 4 bytes per pixel."""
+    chunkRect = getChunkRect(chunkCache, chunkx, chunky)
+    return chunkRect.width * chunkRect.height * 4
+
+
+def drawMapChunks(chunkCache, gameStateObj, surf, topleft):
+    """Draws the chunks of the map that can be seen on surf, with the
+    top left corner of the map at the topleft pixel of surf. Chunks that
+    are not cached yet are drawn first (until getChunkDeadline()), and
+    the least recently used chunks are thrown away if the cache uses too
+    much memory. Returns True if chunks were left for the next frames."""
+
+    mapLeft, mapTop = topleft
+    chunks = chunkCache['chunks']
+    visibleChunks = getVisibleChunks(chunkCache, surf.get_rect(), topleft)
+    deadline = getChunkDeadline(chunkCache)
+    chunksLeft = False
+    for chunkx, chunky in visibleChunks:
+        if (chunkx, chunky) in chunks:
+            chunks.move_to_end((chunkx, chunky)) # mark as recently used
+        elif time.perf_counter() < deadline:
+            chunks[(chunkx, chunky)] = drawChunk(chunkCache, gameStateObj, chunkx, chunky)
+            chunkCache['bytes'] += getChunkBytes(chunkCache, chunkx, chunky)
+        else:
+            chunksLeft = True
+            continue
+        chunkRect = getChunkRect(chunkCache, chunkx, chunky)
+        surf.blit(chunks[(chunkx, chunky)], chunkRect.move(mapLeft, mapTop))
+    trimChunkCache(chunkCache, len(visibleChunks))
+    return chunksLeft
+
+
+def getChunkDeadline(chunkCache):
+    """Returns the time.perf_counter() after which drawMapChunks() leaves
+    the chunks that aren't cached to the next frames (never, if the chunk
+    cache has no drawTime)."""
+    if chunkCache['drawTime'] is None:
+        return float('inf')
+    return time.perf_counter() + chunkCache['drawTime']
+
+
+def getVisibleChunks(chunkCache, screenRect, topleft):
+    """Returns the list of (chunkx, chunky) chunks that can be seen on
+    screenRect (or are within CHUNK_MARGIN pixels of it), with the top
+    left corner of the map at the topleft pixel."""
+    mapLeft, mapTop = topleft
+    viewRect = screenRect.inflate(CHUNK_MARGIN * 2, CHUNK_MARGIN * 2)
+
+    # Work out which chunk columns and rows overlap the view.
+    chunkWidth = chunkCache['chunkTiles'] * chunkCache['tileWidth']
+    chunkHeight = chunkCache['chunkTiles'] * chunkCache['floorHeight']
+    firstColumn = max(0, (viewRect.left - mapLeft) // chunkWidth)
+    lastColumn = min(chunkCache['columns'], (viewRect.right - mapLeft) // chunkWidth + 1)
+    firstRow = max(0, (viewRect.top - mapTop) // chunkHeight)
+    lastRow = min(chunkCache['rows'], (viewRect.bottom - mapTop) // chunkHeight + 1)
+    return [(chunkx, chunky) for chunkx in range(firstColumn, lastColumn) for chunky in range(firstRow, lastRow)]
+
+
+def trimChunkCache(chunkCache, numVisible):
+    """Throws away the least recently used chunks while the cache uses
+    more than CHUNK_CACHE_BYTES, but never the numVisible chunks that
+    were just drawn."""
+    chunks = chunkCache['chunks']
+    while chunkCache['bytes'] > CHUNK_CACHE_BYTES and len(chunks) > numVisible:
+        oldKey, oldChunk = chunks.popitem(last=False)
+        chunkCache['bytes'] -= getChunkBytes(chunkCache, oldKey[0], oldKey[1])
+
+
+def invalidateChunks(chunkCache, cells):
+    """Throws away the cached chunks that the given (x, y) spaces are
+    drawn on, so that they are drawn again the next time they are seen."""
+    chunks = chunkCache['chunks']
+    floorHeight = chunkCache['floorHeight']
+    chunkHeight = chunkCache['chunkTiles'] * floorHeight
+    for x, y in cells:
+        chunkx = x // chunkCache['chunkTiles']
+        # A tile is drawn from its own row down over part of the next one.
+        for chunky in range(y * floorHeight // chunkHeight, (y * floorHeight + chunkCache['tileHeight'] - 1) // chunkHeight + 1):
+            if (chunkx, chunky) in chunks:
+                del chunks[(chunkx, chunky)]
+                chunkCache['bytes'] -= getChunkBytes(chunkCache, chunkx, chunky)
+
+
+def getPieceCells(gameStateObj):
+    """Returns a dict that maps each (x, y) space with a star, player,
+    door or button on it to a tuple describing how it is drawn. Comparing
+    two of these dicts tells which spaces have to be drawn again."""
+    cells = {}
+    for door in gameStateObj['doors']:
+        cells[door] = ('door', isDoorOpen(gameStateObj, door[0], door[1]))
+    for button in gameStateObj['buttons']:
+        cells[button] = cells.get(button, ()) + ('button',)
+    for star in gameStateObj['stars']:
+        cells[star] = cells.get(star, ()) + ('star',)
+    for star in gameStateObj['grabstar']:
+        cells[star] = cells.get(star, ()) + ('grabstar',)
+    player = gameStateObj['player']
+    cells[player] = cells.get(player, ()) + ('player', gameStateObj['playerdirection'])
+    return cells
+
+
+def getChangedCells(oldCells, newCells):
+    """Returns the set of (x, y) spaces that are drawn differently in the
+    two dicts returned by getPieceCells()."""
+    changed = set()
+    for cell in set(oldCells) | set(newCells):
+        if oldCells.get(cell) != newCells.get(cell):
+            changed.add(cell)
+    return changed
+
+
 def isLevelFinished(levelObj, gameStateObj):
     """Returns True if all the goals have stars in them."""
     for goal in levelObj['goals']:
@@ -851,6 +1777,12 @@ def isDoorOpen (gameStateObj,x,y):
 
 
 def terminate():
+    savegame.stopAutosave() # saves the session one last time
+    saveDecorations()
+    if LEVELWATCHER is not None:
+        levelwatcher.stopWatcher(LEVELWATCHER)
+    if THUMBNAILER is not None:
+        levelselect.stopThumbnailer(THUMBNAILER)
     pygame.quit()
     sys.exit()
 
@@ -0,0 +1,435 @@
+# Star Pusher solver
+# Searches for the shortest (or a short) list of actions that solves a
+# level, using the game's own rules: makeMove(), makeTurn() and makeGrab().
+#
+# A state of the game is stored as a tuple:
+#   (player, direction, stars, grab)
+# where player is the (x, y) of the player, direction is the
+# 'playerdirection' value (0 up, 1 left, 2 down, 3 right), stars is a
+# sorted tuple of the (x, y) of the stars that aren't grabbed and grab is
+# the (x, y) of the grabbed star, or None.
+#
+# The actions are the keys the player can press:
+#   'up', 'left', 'down', 'right'     (the arrow keys)
+#   'turnleft', 'turnright'           (W and X)
+#   'grab'                            (SPACE)
+
+import array, collections, heapq
+
+import gameloader, lowerbound
+
+ACTIONS = ('up', 'left', 'down', 'right', 'turnleft', 'turnright', 'grab')
+MOVEACTIONS = ('up', 'left', 'down', 'right') # index = 'playerdirection' value
+OFFSETS = ((0, -1), (-1, 0), (0, 1), (1, 0)) # (x, y) offsets, same order
+PROGRESS_EXPANSIONS = 1024 # expanded states between two calls of search()'s progress
+
+game = gameloader.loadGame()
+
+
+def makeRules(levelObj):
+    """Returns a rules object for the level. It holds everything about the
+    level that never changes while it is played, and is passed to the
+    other functions of this module."""
+    mapObj = levelObj['mapObj']
+    startState = levelObj['startState']
+
+    # Every space that isn't a wall. They are numbered so that states can
+    # be stored as a few bytes (see encodeState()): one byte per space
+    # number, or two on levels with 255 open spaces or more.
+    cells = []
+    for x in range(len(mapObj)):
+        for y in range(len(mapObj[x])):
+            if not game.isWall(mapObj, x, y):
+                cells.append((x, y))
+    wideCells = len(cells) >= 255
+
+    rules = {'mapObj': mapObj,
+             'width': len(mapObj),
+             'height': len(mapObj[0]),
+             'goals': tuple(levelObj['goals']),
+             'doors': list(startState['doors']),
+             'buttons': list(startState['buttons']),
+             'cells': cells,
+             'cellIndex': dict((cells[i], i) for i in range(len(cells))),
+             'wideCells': wideCells,
+             'noGrab': 0xFFFF if wideCells else 0xFF, # grab value when nothing is grabbed
+             'numStars': len(startState['stars']) + len(startState['grabstar'])}
+    rules['inside'] = getInsideCells(rules, startState['player'])
+    rules['goalDistances'] = getGoalDistances(rules)
+    return rules
+
+
+def getInsideCells(rules, startxy):
+    """Returns the set of open spaces the player could walk to from startxy
+    if there were no stars and all the doors were open."""
+    inside = set([startxy])
+    toVisit = [startxy]
+    while toVisit:
+        x, y = toVisit.pop()
+        for xOffset, yOffset in OFFSETS:
+            neighbour = (x + xOffset, y + yOffset)
+            if neighbour in rules['cellIndex'] and neighbour not in inside:
+                inside.add(neighbour)
+                toVisit.append(neighbour)
+    return inside
+
+
+def getDeadSquares(rules):
+    """Returns the set of inside spaces from which a star can never reach
+    any goal, even with no other star in the way and all doors open.
+
+    A star can go from space c to the next space n (n = c + e) by being
+    pushed (the player stands at c - e), pulled (the player holds it and
+    walks back from n to n + e) or turned (the player at c - f holds it
+    and turns, with f at a right angle to e; the star goes through n on
+    its way to c - f + e). The goals are searched backwards along these
+    moves, every inside space that isn't reached is dead."""
+    inside = rules['inside']
+    alive = set(goal for goal in rules['goals'] if goal in inside)
+    toVisit = list(alive)
+    while toVisit:
+        nx, ny = toVisit.pop()
+        for ex, ey in OFFSETS:
+            # Could a star at c = n - e get to n?
+            cx, cy = nx - ex, ny - ey
+            if (cx, cy) not in inside or (cx, cy) in alive:
+                continue
+            canMove = (cx - ex, cy - ey) in inside or (nx + ex, ny + ey) in inside
+            if not canMove:
+                for fx, fy in ((ey, ex), (-ey, -ex)): # the two right angles to e
+                    if (cx - fx, cy - fy) in inside and (cx - fx + ex, cy - fy + ey) in inside:
+                        canMove = True
+                        break
+            if canMove:
+                alive.add((cx, cy))
+                toVisit.append((cx, cy))
+    return inside - alive
+
+
+def getGoalDistances(rules):
+    """Returns a dict that maps each open space to the number of steps to
+    the nearest goal (walking through doors). Used by the heuristic."""
+    distances = {}
+    toVisit = collections.deque()
+    for goal in rules['goals']:
+        distances[goal] = 0
+        toVisit.append(goal)
+    while toVisit:
+        x, y = toVisit.popleft()
+        for xOffset, yOffset in OFFSETS:
+            neighbour = (x + xOffset, y + yOffset)
+            if neighbour in rules['cellIndex'] and neighbour not in distances:
+                distances[neighbour] = distances[(x, y)] + 1
+                toVisit.append(neighbour)
+    return distances
+
+
+def fromGameState(gameStateObj):
+    """Returns the state tuple of a game state object."""
+    if gameStateObj['grabstar']:
+        grab = gameStateObj['grabstar'][0]
+    else:
+        grab = None
+    return (gameStateObj['player'], gameStateObj['playerdirection'], tuple(sorted(gameStateObj['stars'])), grab)
+
+
+def toGameState(rules, state, stepCounter=0):
+    """Returns a new game state object for the state tuple, that can be
+    passed to the game's functions."""
+    player, direction, stars, grab = state
+    return {'player': player,
+            'stepCounter': stepCounter,
+            'stars': list(stars),
+            'playerdirection': direction,
+            'grabstar': [grab] if grab is not None else [],
+            'doors': rules['doors'],
+            'buttons': rules['buttons'],
+            'grabstaroffset': [(0, 0)],
+            'buttonPressed?': False,
+            'otherstar': []}
+
+
+def getStartState(levelObj):
+    """Returns the state tuple the level starts in."""
+    return fromGameState(levelObj['startState'])
+
+
+def applyAction(mapObj, gameStateObj, action):
+    """Does the action on the game state object with the game's rules,
+    like runLevel() does when the key is pressed. Returns True if the
+    game state changed."""
+    if action in MOVEACTIONS:
+        moved = game.makeMove(mapObj, gameStateObj, MOVEACTIONS.index(action))
+        if moved:
+            gameStateObj['stepCounter'] += 1
+        return moved
+    elif action == 'turnleft':
+        return game.makeTurn(mapObj, gameStateObj, game.LEFT)
+    elif action == 'turnright':
+        return game.makeTurn(mapObj, gameStateObj, game.RIGHT)
+    elif action == 'grab':
+        return game.makeGrab(mapObj, gameStateObj)
+    raise ValueError('Unknown action: %r' % (action,))
+
+
+def getSuccessors(rules, state):
+    """Returns a list of (action, newState) for every action that changes
+    the state."""
+    successors = []
+    for action in ACTIONS:
+        if action == 'grab':
+            # Only useful facing a star (grab) or holding one (let go).
+            x, y = state[0]
+            xOffset, yOffset = OFFSETS[state[1]]
+            if state[3] is None and (x + xOffset, y + yOffset) not in state[2]:
+                continue
+        gameStateObj = toGameState(rules, state)
+        if applyAction(rules['mapObj'], gameStateObj, action):
+            newState = fromGameState(gameStateObj)
+            if newState != state:
+                successors.append((action, newState))
+    return successors
+
+
+def isSolved(rules, state):
+    """Returns True if every goal has a (grabbed or not) star on it."""
+    stars = state[2]
+    for goal in rules['goals']:
+        if goal not in stars and goal != state[3]:
+            return False
+    return True
+
+
+def getHeuristic(rules, state):
+    """Returns an estimate of how far the state is from being solved: the
+    sum of the distances from the stars that are closest to a goal to
+    their nearest goal (only as many stars as there are goals)."""
+    distances = rules['goalDistances']
+    starDistances = [distances.get(star, 1000) for star in state[2]]
+    if state[3] is not None:
+        starDistances.append(distances.get(state[3], 1000))
+    starDistances.sort()
+    return sum(starDistances[:len(rules['goals'])])
+
+
+def encodeState(rules, state):
+    """Returns the state as a bytes object: player space, direction,
+    grabbed star space (rules['noGrab'] if none), then the sorted spaces
+    of all the stars (the grabbed one included). Every state of a level
+    encodes to the same length, 3 + the number of stars numbers."""
+    cellIndex = rules['cellIndex']
+    player, direction, stars, grab = state
+    starCells = [cellIndex[star] for star in stars]
+    if grab is not None:
+        starCells.append(cellIndex[grab])
+    starCells.sort()
+    encoded = [cellIndex[player], direction, cellIndex[grab] if grab is not None else rules['noGrab']] + starCells
+    if rules['wideCells']:
+        return array.array('H', encoded).tobytes()
+    return bytes(encoded)
+
+
+def decodeState(rules, data):
+    """Returns the state tuple of a bytes object made by encodeState()."""
+    if rules['wideCells']:
+        numbers = array.array('H')
+        numbers.frombytes(data)
+    else:
+        numbers = data
+    cells = rules['cells']
+    starCells = list(numbers[3:])
+    if numbers[2] != rules['noGrab']:
+        grab = cells[numbers[2]]
+        starCells.remove(numbers[2])
+    else:
+        grab = None
+    return (cells[numbers[0]], numbers[1], tuple(sorted(cells[i] for i in starCells)), grab)
+
+
+def search(rules, startState, weight=1.0, maxStates=None, cancelEvent=None, exhaustive=False, boundObj=None,
+           progress=None):
+    """Searches for a list of actions that solves the level from
+    startState. With weight 0 this is a breadth first search, and the
+    solution has the fewest possible actions. With a weight above 0 it is
+    a best first search ordered by (actions so far + weight * heuristic),
+    which is much faster but may find longer solutions.
+
+    The search stops early when maxStates states have been seen or when
+    cancelEvent (a threading.Event) is set. If exhaustive is True it
+    doesn't stop at the first solution but goes on until every reachable
+    state has been seen (solved states are not expanded, the game ends
+    there).
+
+    If progress is given, it is called every PROGRESS_EXPANSIONS expanded
+    states with the 'best' list of actions so far (see below), when it
+    has changed, so a caller can show it while the search goes on.
+
+    If boundObj (see lowerbound.makeBound()) is given, its lower bound is
+    the heuristic instead of getHeuristic(), and the states it shows can
+    never be solved are not expanded. With weight 1 the search is then an
+    A* search, and the solution has the fewest possible actions: a state
+    reached again by fewer actions is expanded again, and the search only
+    stops when a solved state is taken from the frontier.
+
+    Returns a dict with:
+        'solution': the list of actions, or None
+        'seen': how many different states were seen
+        'expanded': how many states had their successors generated
+        'edges': how many successors the expanded states had in total
+        'complete': True if the search ran until it found a solution or
+                    ran out of states (so None means unsolvable)
+        'best': the list of actions leading to the state that looked the
+                closest to the goal (useful when the search is stopped)"""
+
+    # parents maps each seen state to (previous state, action).
+    parents = {startState: (None, None)}
+    bestState = startState
+    matchings = None
+    if boundObj is None:
+        bestHeuristic = getHeuristic(rules, startState)
+    else:
+        # The star to goal matching of each state waiting to be expanded,
+        # updated from its parent's one.
+        matchings = {startState: lowerbound.makeMatching(boundObj, startState)}
+        bestHeuristic = lowerbound.getLowerBound(matchings[startState])
+    expanded = 0
+    edges = 0
+    complete = True
+    solvedState = None
+    progressState = startState # the best state progress() was last called with
+
+    if weight == 0:
+        frontier = collections.deque([startState])
+    else:
+        counter = 0 # breaks ties in the heap, in the order states were found
+        frontier = [(weight * (bestHeuristic or 0), 0, counter, startState)]
+    if bestHeuristic is None:
+        frontier.clear() # the start state can never be solved
+    depths = {startState: 0}
+
+    if isSolved(rules, startState):
+        solvedState = startState
+
+    while frontier and (solvedState is None or exhaustive):
+        if cancelEvent is not None and expanded % 256 == 0 and cancelEvent.is_set():
+            complete = False
+            break
+        if maxStates is not None and len(parents) >= maxStates:
+            complete = False
+            break
+        if progress is not None and expanded % PROGRESS_EXPANSIONS == 0 and bestState is not progressState:
+            progressState = bestState
+            progress(getPath(parents, bestState))
+
+        if weight == 0:
+            state = frontier.popleft()
+        else:
+            # A state is pushed again when it's reached by fewer actions,
+            # the older entries are skipped. The solved states are only
+            # taken as the solution here, when no state left in the
+            # frontier can lead to a shorter one.
+            priority, stateDepth, order, state = heapq.heappop(frontier)
+            if stateDepth > depths[state]:
+                continue
+            if isSolved(rules, state):
+                if solvedState is None:
+                    solvedState = state
+                continue
+        if matchings is not None:
+            matching = matchings.pop(state)
+        expanded += 1
+        depth = depths[state] + 1
+        successors = getSuccessors(rules, state)
+        edges += len(successors)
+        for action, newState in successors:
+            if newState in parents and (weight == 0 or depth >= depths[newState]):
+                continue
+            parents[newState] = (state, action)
+            depths[newState] = depth
+            if isSolved(rules, newState):
+                if weight != 0:
+                    counter += 1
+                    heapq.heappush(frontier, (depth, depth, counter, newState))
+                    continue
+                # Breadth first: no solved state can be found with fewer actions.
+                if solvedState is None:
+                    solvedState = newState
+                if not exhaustive:
+                    break
+                continue
+            if matchings is None:
+                heuristic = getHeuristic(rules, newState)
+            else:
+                newMatching = lowerbound.updateMatching(boundObj, matching, newState)
+                heuristic = lowerbound.getLowerBound(newMatching)
+                if heuristic is None:
+                    continue # can never be solved, don't expand it
+                matchings[newState] = newMatching
+            if heuristic < bestHeuristic:
+                bestHeuristic = heuristic
+                bestState = newState
+            if weight == 0:
+                frontier.append(newState)
+            else:
+                counter += 1
+                heapq.heappush(frontier, (depth + weight * heuristic, depth, counter, newState))
+
+    return {'solution': getPath(parents, solvedState) if solvedState is not None else None,
+            'seen': len(parents),
+            'expanded': expanded,
+            'edges': edges,
+            'complete': complete,
+            'best': getPath(parents, bestState)}
+
+
+def getPath(parents, state):
+    """Returns the list of actions that lead from the search's start
+    state to state."""
+    actions = []
+    while parents[state][0] is not None:
+        state, action = parents[state]
+        actions.append(action)
+    actions.reverse()
+    return actions
+
+
+def solve(levelObj, weight=1.0, maxStates=None):
+    """Returns a list of actions that solves the level from its start, or
+    None if it wasn't found."""
+    rules = makeRules(levelObj)
+    return search(rules, getStartState(levelObj), weight, maxStates)['solution']
+
+
+def playActions(rules, state, actions):
+    """Returns the list of states reached by doing the actions one after
+    the other, starting with state itself."""
+    states = [state]
+    gameStateObj = toGameState(rules, state)
+    for action in actions:
+        applyAction(rules['mapObj'], gameStateObj, action)
+        states.append(fromGameState(gameStateObj))
+    return states
+
+
+if __name__ == '__main__':
+    # Solve every level of the level file given on the command line (or
+    # starPusherLevels.txt) and print the solutions. The solutions are
+    # kept in levelcache.py's cache, so levels solved before are only
+    # checked again.
+    import sys, time
+    import levelcache
+    levelFile = sys.argv[1] if len(sys.argv) > 1 else gameloader.LEVELFILE
+    levels = game.readLevelsFile(levelFile)
+    cacheObj = levelcache.openCache()
+    try:
+        for levelNum in range(len(levels)):
+            startTime = time.time()
+            hits = cacheObj['hits']
+            solution = levelcache.getSolution(cacheObj, levels[levelNum])
+            cached = ' (cached)' if cacheObj['hits'] > hits else ''
+            if solution is None:
+                print('Level %s: no solution%s' % (levelNum + 1, cached))
+            else:
+                print('Level %s: %s actions, %.2f s%s: %s' % (levelNum + 1, len(solution), time.time() - startTime, cached, ' '.join(solution)))
+    finally:
+        levelcache.closeCache(cacheObj)